@@ -21,13 +21,20 @@ Define BlackMarble class.
 
 __all__ = ['BlackMarble']
 
+from collections import namedtuple
+import functools
+import itertools
 import logging
 import math
 from pathlib import Path
+import tempfile
 
 import numpy as np
 from numpy.polynomial.polynomial import polyval
-from scipy import ndimage
+import rasterio
+import rasterio.features
+from scipy import ndimage, sparse
+import shapely
 import shapely.vectorized
 from cartopy.io import shapereader
 
@@ -51,6 +58,12 @@ DEF_HAZ_TYPE = 'TC'
 DEF_POLY_VAL = [0, 0, 1]
 """Default polynomial transformation used."""
 
+ADMIN1_FILE = 'admin_1_states_provinces'
+"""Natural Earth file of the admin1 territories."""
+
+ADMIN1_KEY = ['name', 'adm0_a3', 'adm1_code']
+"""Keys of the name, country ISO alpha_3 and admin1 code in the admin1 records."""
+
 class BlackMarble(Exposures):
     """Defines exposures from night light intensity, GDP and income group.
     Attribute region_id is defined as:
@@ -62,7 +75,7 @@ class BlackMarble(Exposures):
     _metadata = Exposures._metadata + ['nightlight_file']
 
     def set_countries(self, countries, ref_year=2016, res_km=None, from_hr=None,
-                      admin_file='admin_0_countries', **kwargs):
+                      admin_file='admin_0_countries', pool=None, **kwargs):
         """ Model countries using values at reference year. If GDP or income
         group not available for that year, consider the value of the closest
         available year.
@@ -82,6 +95,9 @@ class BlackMarble(Exposures):
             independently of its year of acquisition.
         admin_file : str
             file name, admin_0_countries or admin_0_map_subunits
+        pool : pathos.pool, optional
+            Pool that will be used to model the countries in parallel. The nightlight
+            matrix is memory mapped by the workers. Default: None
         kwargs : optional
             'gdp' and 'inc_grp' dictionaries with keys the
             country ISO_alpha3 code. 'poly_val' list of polynomial coefficients
@@ -91,10 +107,7 @@ class BlackMarble(Exposures):
         admin_key_dict = {'admin_0_countries': ['ADMIN', 'ADM0_A3'],
                           'admin_0_map_subunits': ['SUBUNIT', 'SU_A3']}
 
-        shp_file = shapereader.natural_earth(resolution='10m',
-                                             category='cultural',
-                                             name=admin_file)
-        shp_file = shapereader.Reader(shp_file)
+        shp_file = _natural_earth_reader(admin_file)
 
         cntry_info, cntry_admin1 = country_iso_geom(countries, shp_file,
                                                     admin_key_dict[admin_file])
@@ -103,14 +116,18 @@ class BlackMarble(Exposures):
         nightlight, coord_nl, fn_nl, res_fact, res_km = get_nightlight(
             ref_year, cntry_info, res_km, from_hr)
 
-        bkmrbl_list = []
+        if pool:
+            bkmrbl_list = _set_countries_pool(pool, cntry_info, cntry_admin1, nightlight,
+                                              coord_nl, res_fact, res_km, **kwargs)
+        else:
+            bkmrbl_list = [
+                self._set_one_country(cntry_val, nightlight, coord_nl, res_fact, res_km,
+                                      cntry_admin1[cntry_iso], **kwargs).gdf
+                for cntry_iso, cntry_val in cntry_info.items()
+            ]
 
         descr_lines = []
-        for cntry_iso, cntry_val in cntry_info.items():
-
-            bkmrbl_list.append(
-                self._set_one_country(cntry_val, nightlight, coord_nl, res_fact, res_km,
-                                      cntry_admin1[cntry_iso], **kwargs).gdf)
+        for cntry_val in cntry_info.values():
             descr_lines.append(f"{cntry_val[1]} {cntry_val[3]:d}"
                             f" GDP: {cntry_val[4]:.3e} income group: {cntry_val[5]:d}")
 
@@ -157,47 +174,182 @@ class BlackMarble(Exposures):
             list of polynomial coefficients to apply to
             nightlight
         """
-        LOGGER.info('Processing country %s.', cntry_info[1])
+        value, lat, lon = _values_one_country(cntry_info, nightlight, coord_nl, res_fact,
+                                              res_km, admin1_geom, **kwargs)
+        return _exposures_one_country(cntry_info[0], value, lat, lon)
 
-        if 'poly_val' in kwargs:
-            poly_val = kwargs['poly_val']
-        else:
-            poly_val = DEF_POLY_VAL
-        geom = cntry_info[2]
 
-        nightlight_reg, lat_reg, lon_reg, on_land = _cut_country(geom, nightlight, coord_nl)
-        nightlight_reg = _set_econ_indicators(nightlight_reg, cntry_info[4],
-                                              cntry_info[5], poly_val)
-        if admin1_geom:
-            nightlight_reg, lat_reg, lon_reg, geom, on_land = _cut_admin1(
-                nightlight_reg, lat_reg, lon_reg, admin1_geom, coord_nl, on_land)
+def _values_one_country(cntry_info, nightlight, coord_nl, res_fact, res_km, admin1_geom,
+                        **kwargs):
+    """Values and coordinates of the exposure points of one country, see
+    BlackMarble._set_one_country.
 
-        LOGGER.info('Generating resolution of approx %s km.', res_km)
-        nightlight_reg, lat_reg, lon_reg = _resample_land(geom, nightlight_reg,
-                                                          lat_reg, lon_reg, res_fact, on_land)
+    Returns
+    -------
+    value, lat, lon (1d arrays)
+    """
+    LOGGER.info('Processing country %s.', cntry_info[1])
 
-        exp_bkmrb = BlackMarble(data={
-            'value': np.asarray(nightlight_reg).reshape(-1,),
-            'latitude': lat_reg,
-            'longitude': lon_reg,
-        })
-        exp_bkmrb.gdf['region_id'] = cntry_info[0]
-        exp_bkmrb.gdf[INDICATOR_IMPF] = 1
+    if 'poly_val' in kwargs:
+        poly_val = kwargs['poly_val']
+    else:
+        poly_val = DEF_POLY_VAL
+    geom = cntry_info[2]
+
+    nightlight_reg, lat_reg, lon_reg, on_land = _cut_country(geom, nightlight, coord_nl)
+    nightlight_reg = _set_econ_indicators(nightlight_reg, cntry_info[4],
+                                          cntry_info[5], poly_val)
+    if admin1_geom:
+        nightlight_reg, lat_reg, lon_reg, geom, on_land = _cut_admin1(
+            nightlight_reg, lat_reg, lon_reg, admin1_geom, coord_nl, on_land)
+
+    LOGGER.info('Generating resolution of approx %s km.', res_km)
+    nightlight_reg, lat_reg, lon_reg = _resample_land(geom, nightlight_reg,
+                                                      lat_reg, lon_reg, res_fact, on_land)
+
+    return np.asarray(nightlight_reg).reshape(-1,), lat_reg, lon_reg
+
+def _exposures_one_country(cntry_id, value, lat, lon):
+    """BlackMarble of one country from the values and coordinates of its points"""
+    exp_bkmrb = BlackMarble(data={
+        'value': value,
+        'latitude': lat,
+        'longitude': lon,
+    })
+    exp_bkmrb.gdf['region_id'] = cntry_id
+    exp_bkmrb.gdf[INDICATOR_IMPF] = 1
+
+    return exp_bkmrb
+
+def _set_countries_pool(pool, cntry_info, cntry_admin1, nightlight, coord_nl, res_fact,
+                        res_km, **kwargs):
+    """Model the countries in parallel. The nightlight matrix is written to temporary
+    .npy files that the workers memory map read-only, so that it is not copied to each
+    of them. The workers return the values and coordinates of the points, from which the
+    exposures are built here (this is faster than sending the point geometries back).
 
-        return exp_bkmrb
+    Parameters
+    ----------
+    pool : pathos.pool
+        pool of the workers
+    cntry_info : dict
+        key = ISO alpha_3 country, value = [cntry_id, cnytry_name, cntry_geometry,
+        ref_year, gdp, income_group]
+    cntry_admin1 : dict
+        key = ISO alpha_3 country, value = [admin1 geometries]
+    nightlight : sparse.csr_matrix or np.array
+        nightlight values
+    coord_nl : np.array
+        nightlight coordinates: [[min_lat, lat_step],
+        [min_lon, lon_step]]
+    res_fact : float
+        resampling factor
+    res_km : float
+        wished resolution in km
+    kwargs : optional
+        'poly_val' as in BlackMarble._set_one_country
 
+    Returns
+    -------
+    list(GeoDataFrame)
+        exposures of each country, in the order of cntry_info
+    """
+    cntry_iso = list(cntry_info.keys())
+    # start with the largest countries, they take longest
+    bounds = np.array([cntry_info[iso][2].bounds for iso in cntry_iso]).reshape(-1, 4)
+    order = np.argsort(-(bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1]),
+                       kind='stable')
+    cntry_iso = [cntry_iso[idx] for idx in order]
+    n_cntry = len(cntry_iso)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        nightlight_files = _share_nightlight(nightlight, tmp_dir)
+        values_list = pool.map(
+            _values_one_country_shared,
+            [cntry_info[iso] for iso in cntry_iso],
+            itertools.repeat(nightlight_files, n_cntry),
+            itertools.repeat(coord_nl, n_cntry),
+            itertools.repeat(res_fact, n_cntry),
+            itertools.repeat(res_km, n_cntry),
+            [cntry_admin1[iso] for iso in cntry_iso],
+            itertools.repeat(kwargs, n_cntry),
+            chunksize=1,
+        )
+
+    bkmrbl_list = [None] * n_cntry
+    for iso, idx, values in zip(cntry_iso, order, values_list):
+        bkmrbl_list[idx] = _exposures_one_country(cntry_info[iso][0], *values).gdf
+    return bkmrbl_list
+
+def _values_one_country_shared(cntry_info, nightlight_files, coord_nl, res_fact, res_km,
+                               admin1_geom, kwargs):
+    """_values_one_country on the nightlight shared by _share_nightlight, for the workers
+    of a pool"""
+    nightlight = _load_nightlight(nightlight_files)
+    return _values_one_country(cntry_info, nightlight, coord_nl, res_fact, res_km,
+                               admin1_geom, **kwargs)
+
+def _share_nightlight(nightlight, directory):
+    """Write the nightlight matrix to .npy files, to be memory mapped by _load_nightlight.
+
+    Parameters
+    ----------
+    nightlight : sparse.csr_matrix or np.array
+        nightlight values
+    directory : str or Path
+        directory of the files
+
+    Returns
+    -------
+    dict
+        shape of the matrix and paths of the files of its arrays: "data", "indices" and
+        "indptr" of a sparse matrix, or "dense"
+    """
+    if sparse.issparse(nightlight):
+        nightlight = sparse.csr_matrix(nightlight)
+        arrays = {'data': nightlight.data, 'indices': nightlight.indices,
+                  'indptr': nightlight.indptr}
+    else:
+        arrays = {'dense': np.asarray(nightlight)}
+    nightlight_files = {'shape': nightlight.shape}
+    for key, array in arrays.items():
+        nightlight_files[key] = Path(directory) / f"nightlight_{key}.npy"
+        np.save(nightlight_files[key], array)
+    return nightlight_files
+
+def _load_nightlight(nightlight_files):
+    """Memory map the nightlight matrix written by _share_nightlight (read-only).
+
+    Parameters
+    ----------
+    nightlight_files : dict
+        as returned by _share_nightlight
+
+    Returns
+    -------
+    sparse.csr_matrix or np.array
+    """
+    if 'dense' in nightlight_files:
+        return np.load(nightlight_files['dense'], mmap_mode='r')
+    return sparse.csr_matrix(
+        tuple(np.load(nightlight_files[key], mmap_mode='r')
+              for key in ['data', 'indices', 'indptr']),
+        shape=nightlight_files['shape'], copy=False)
 
 def country_iso_geom(countries, shp_file, admin_key=['ADMIN', 'ADM0_A3']):
     """ Get country ISO alpha_3, country id (defined as the United Nations
     Statistics Division (UNSD) 3-digit equivalent numeric codes and 0 if
     country not found) and country's geometry shape.
 
+    The records of the shape files are indexed once per process, see
+    _load_admin_index.
+
     Parameters
     ----------
     countries : list or dict
         list of country names (admin0) or dict with key = admin0 name
         and value = [admin1 names]
-    shp_file : cartopy.io.shapereader.Reader
+    shp_file : cartopy.io.shapereader.Reader or str
         shape file
     admin_key: str
         key to find admin0 or subunit name
@@ -210,40 +362,33 @@ def country_iso_geom(countries, shp_file, admin_key=['ADMIN', 'ADM0_A3']):
         key = ISO alpha_3 country, value = [admin1 geometries]
 
     """
-    countries_shp = {}
-    list_records = list(shp_file.records())
-    for info_idx, info in enumerate(list_records):
-        countries_shp[info.attributes[admin_key[0]].title()] = info_idx
+    admin0_index = _load_admin_index(shp_file, tuple(admin_key[:2]))
 
     cntry_info = dict()
     cntry_admin1 = dict()
     if isinstance(countries, list):
         countries = {cntry: [] for cntry in countries}
-        admin1_rec = list()
+        admin1_index = None
     else:
-        admin1_rec = shapereader.natural_earth(resolution='10m',
-                                               category='cultural',
-                                               name='admin_1_states_provinces')
-        admin1_rec = shapereader.Reader(admin1_rec)
-        admin1_rec = list(admin1_rec.records())
+        admin1_index = _load_admin_index(_natural_earth_reader(ADMIN1_FILE), tuple(ADMIN1_KEY))
 
     for country_name, prov_list in countries.items():
-        country_idx = countries_shp.get(country_name.title())
+        country_idx = admin0_index.names.get(country_name.title())
         if country_idx is None:
-            options = [country_opt for country_opt in countries_shp
+            options = [country_opt for country_opt in admin0_index.names
                        if country_name.title() in country_opt]
             if not options:
-                options = list(countries_shp.keys())
+                options = list(admin0_index.names.keys())
             raise ValueError('Country %s not found. Possible options: %s'
                              % (country_name, options))
-        iso3 = list_records[country_idx].attributes[admin_key[1]]
+        record = admin0_index.records[country_idx]
+        iso3 = record.attributes[admin_key[1]]
         try:
             cntry_id = u_coord.country_to_iso(iso3, "numeric")
         except LookupError:
             cntry_id = 0
-        cntry_info[iso3] = [cntry_id, country_name.title(),
-                            list_records[country_idx].geometry]
-        cntry_admin1[iso3] = _fill_admin1_geom(iso3, admin1_rec, prov_list)
+        cntry_info[iso3] = [cntry_id, country_name.title(), record.geometry]
+        cntry_admin1[iso3] = _fill_admin1_geom(iso3, admin1_index, prov_list)
 
     return cntry_info, cntry_admin1
 
@@ -315,7 +460,7 @@ def get_nightlight(ref_year, cntry_info, res_km=None, from_hr=None):
                     str(nl_year))
         res_fact = DEF_RES_NASA_KM / res_km
         geom = [info[2] for info in cntry_info.values()]
-        geom = shapely.ops.cascaded_union(geom)
+        geom = shapely.ops.unary_union(geom)
         req_files = nl_utils.get_required_nl_files(geom.bounds)
         files_exist = nl_utils.check_nl_local_file_exists(req_files,
                                                              SYSTEM_DIR, nl_year)
@@ -349,8 +494,8 @@ def _fill_admin1_geom(iso3, admin1_rec, prov_list):
     ----------
     iso3 : str
         admin0 country name in alpha3
-    admin1_rec : list
-        list of admin1 records
+    admin1_rec : _AdminIndex or list
+        index of the admin1 records (see _load_admin_index), or list of admin1 records
     prov_list : list
         province names
 
@@ -358,27 +503,128 @@ def _fill_admin1_geom(iso3, admin1_rec, prov_list):
     -------
     list(geometry)
     """
-    prov_geom = list()
+    if not prov_list:
+        return list()
+    if not isinstance(admin1_rec, _AdminIndex):
+        admin1_rec = _admin_index(admin1_rec, *ADMIN1_KEY)
 
+    prov_geom = list()
     for prov in prov_list:
-        found = False
-        for rec in admin1_rec:
-            if prov == rec.attributes['name'] and \
-            rec.attributes['adm0_a3'] == iso3:
-                found = True
-                prov_geom.append(rec.geometry)
-                break
-        if not found:
-            options = [rec.attributes['name'] for rec in admin1_rec
-                       if rec.attributes['adm0_a3'] == iso3]
+        prov_idx = admin1_rec.names.get((iso3, prov))
+        if prov_idx is None:
+            options = [admin1_rec.records[idx].attributes[ADMIN1_KEY[0]]
+                       for idx in admin1_rec.by_iso.get(iso3, [])]
             raise ValueError('%s not found. Possible provinces of %s are: %s'
                              % (prov, iso3, options))
+        prov_geom.append(admin1_rec.records[prov_idx].geometry)
 
     return prov_geom
 
+class _AdminIndex(namedtuple('_AdminIndex', ['records', 'names', 'codes', 'by_iso', 'tree'])):
+    """Index of the records of an admin0 or admin1 shape file.
+
+    Attributes
+    ----------
+    records : list
+        records of the shape file
+    names : dict
+        record index by name in title case (admin0), or by (ISO alpha_3, name) (admin1)
+    codes : dict
+        record index by ISO alpha_3 (admin0), or by admin1 code (admin1)
+    by_iso : dict
+        list of the record indices by ISO alpha_3
+    tree : shapely.STRtree
+        spatial index of the record geometries
+    """
+    __slots__ = ()
+
+    def query(self, geometry, predicate='intersects'):
+        """Records whose geometries fulfill the predicate with the given geometry (see
+        shapely.STRtree.query), in the order of the shape file.
+
+        Parameters
+        ----------
+        geometry : shapely.geometry
+            geometry to query
+        predicate : str, optional
+            spatial predicate. Default: 'intersects'
+
+        Returns
+        -------
+        list
+        """
+        return [self.records[idx]
+                for idx in np.sort(self.tree.query(geometry, predicate=predicate))]
+
+def _admin_index(records, name_key, iso_key, code_key=None):
+    """Index admin records by name, ISO alpha_3 and admin1 code, and in a STRtree.
+
+    Parameters
+    ----------
+    records : list
+        records of an admin0 or admin1 shape file
+    name_key : str
+        key of the name in the record attributes
+    iso_key : str
+        key of the ISO alpha_3 in the record attributes
+    code_key : str, optional
+        key of the admin1 code in the record attributes. If given, the records are admin1
+        territories, whose names are only unique within a country. Default: None
+
+    Returns
+    -------
+    _AdminIndex
+    """
+    names, codes, by_iso = dict(), dict(), dict()
+    for rec_idx, rec in enumerate(records):
+        iso3 = rec.attributes[iso_key]
+        by_iso.setdefault(iso3, []).append(rec_idx)
+        if code_key is None:
+            # as in the former linear scans: the last admin0 record of a name is used
+            names[rec.attributes[name_key].title()] = rec_idx
+            codes.setdefault(iso3, rec_idx)
+        else:
+            # and the first admin1 record of a name in a country
+            names.setdefault((iso3, rec.attributes[name_key]), rec_idx)
+            codes.setdefault(rec.attributes[code_key], rec_idx)
+    tree = shapely.STRtree([rec.geometry for rec in records])
+    return _AdminIndex(records, names, codes, by_iso, tree)
+
+@functools.lru_cache(maxsize=8)
+def _load_admin_index(shp_file, admin_key=('ADMIN', 'ADM0_A3')):
+    """Read the records of an admin0 or admin1 shape file and index them, once per process
+    and shape file.
+
+    Parameters
+    ----------
+    shp_file : cartopy.io.shapereader.Reader or str or Path
+        shape file. Readers are cached by identity, file names by value.
+    admin_key : tuple(str)
+        keys of the name and ISO alpha_3 (admin0), or of the name, ISO alpha_3 and admin1
+        code (admin1) in the record attributes
+
+    Returns
+    -------
+    _AdminIndex
+    """
+    if isinstance(shp_file, (str, Path)):
+        shp_file = shapereader.Reader(str(shp_file))
+    return _admin_index(list(shp_file.records()), *admin_key)
+
+@functools.lru_cache(maxsize=8)
+def _natural_earth_reader(name):
+    """Reader of a 10m cultural Natural Earth shape file (downloaded if needed), once per
+    process"""
+    return shapereader.Reader(shapereader.natural_earth(resolution='10m',
+                                                        category='cultural',
+                                                        name=name))
+
 def _cut_admin1(nightlight, lat, lon, admin1_geom, coord_nl, on_land):
     """Cut nightlight image on box containing all the admin1 territories.
 
+    The admin1 territories are rasterized on the grid of the country cut, and only land
+    points of the country within them are kept.
+
     Parameters
     ----------
     nightlight : np.array
@@ -403,7 +649,7 @@ def _cut_admin1(nightlight, lat, lon, admin1_geom, coord_nl, on_land):
     on_land_reg (2d array of same size as previous with True values on land
     points)
     """
-    all_geom = shapely.ops.cascaded_union(admin1_geom)
+    all_geom = shapely.ops.unary_union(admin1_geom)
 
     in_lat = (math.floor((all_geom.bounds[1] - lat[0, 0]) / coord_nl[0, 1]),
               math.ceil((all_geom.bounds[3] - lat[0, 0]) / coord_nl[0, 1]))
@@ -413,20 +659,21 @@ def _cut_admin1(nightlight, lat, lon, admin1_geom, coord_nl, on_land):
     nightlight_reg = nightlight[in_lat[0]:in_lat[-1] + 1, :][:, in_lon[0]:in_lon[-1] + 1]
     nightlight_reg[nightlight_reg < 0.0] = 0.0
 
-    lat_reg, lon_reg = np.mgrid[lat[0, 0] + in_lat[0] * coord_nl[0, 1]:
-                                lat[0, 0] + in_lat[1] * coord_nl[0, 1]:
-                                complex(0, nightlight_reg.shape[0]),
-                                lon[0, 0] + in_lon[0] * coord_nl[1, 1]:
-                                lon[0, 0] + in_lon[1] * coord_nl[1, 1]:
-                                complex(0, nightlight_reg.shape[1])]
+    lat_reg, lon_reg = _window_coord(lat[0, 0], lon[0, 0], coord_nl, in_lat, in_lon,
+                                     nightlight_reg.shape)
 
-    on_land_reg = on_land[in_lat[0]:in_lat[-1] + 1, :][:, in_lon[0]:in_lon[-1] + 1]
+    on_land_reg = on_land[in_lat[0]:in_lat[-1] + 1, :][:, in_lon[0]:in_lon[-1] + 1] \
+        & _rasterize_mask(all_geom, lat_reg[:, 0], lon_reg[0, :])
 
     return nightlight_reg, lat_reg, lon_reg, all_geom, on_land_reg
 
 def _cut_country(geom, nightlight, coord_nl):
     """Cut nightlight image on box containing all the land.
 
+    Only the bounding box window of the country is read from the nightlight matrix, and
+    only its values on land are filled into the dense output. The country mask is
+    rasterized once for all polygons of the country.
+
     Parameters
     ----------
     geom : shapely.geometry
@@ -449,36 +696,79 @@ def _cut_country(geom, nightlight, coord_nl):
     in_lon = (math.floor((geom.bounds[0] - coord_nl[1, 0]) / coord_nl[1, 1]),
               math.ceil((geom.bounds[2] - coord_nl[1, 0]) / coord_nl[1, 1]))
 
-    nightlight_reg = nightlight[in_lat[0]:in_lat[1] + 1, in_lon[0]:in_lon[-1] + 1] \
-        .toarray()
-    lat_reg, lon_reg = np.mgrid[coord_nl[0, 0] + in_lat[0] * coord_nl[0, 1]:
-                                coord_nl[0, 0] + in_lat[1] * coord_nl[0, 1]:
-                                complex(0, nightlight_reg.shape[0]),
-                                coord_nl[1, 0] + in_lon[0] * coord_nl[1, 1]:
-                                coord_nl[1, 0] + in_lon[1] * coord_nl[1, 1]:
-                                complex(0, nightlight_reg.shape[1])]
-
-    on_land_reg = np.zeros(lat_reg.shape, bool)
-    try:
-        iter(geom)
-    except TypeError:
-        geom = [geom]
-    for poly in geom:
-        in_lat = (math.floor((poly.bounds[1] - lat_reg[0, 0]) / coord_nl[0, 1]),
-                  math.ceil((poly.bounds[3] - lat_reg[0, 0]) / coord_nl[0, 1]))
-        in_lon = (math.floor((poly.bounds[0] - lon_reg[0, 0]) / coord_nl[1, 1]),
-                  math.ceil((poly.bounds[2] - lon_reg[0, 0]) / coord_nl[1, 1]))
-        on_land_reg[in_lat[0]:in_lat[1] + 1, in_lon[0]:in_lon[1] + 1] = (
-            on_land_reg[in_lat[0]:in_lat[1] + 1, in_lon[0]:in_lon[1] + 1]
-            | shapely.vectorized.contains(
-                poly, lon_reg[in_lat[0]:in_lat[1] + 1, in_lon[0]:in_lon[1] + 1],
-                lat_reg[in_lat[0]:in_lat[1] + 1, in_lon[0]:in_lon[1] + 1]))
+    window = nightlight[in_lat[0]:in_lat[1] + 1, in_lon[0]:in_lon[-1] + 1]
+    lat_reg, lon_reg = _window_coord(coord_nl[0, 0], coord_nl[1, 0], coord_nl, in_lat, in_lon,
+                                     window.shape)
+    on_land_reg = _rasterize_mask(geom, lat_reg[:, 0], lon_reg[0, :])
 
     # put zero values outside country
-    nightlight_reg[~on_land_reg] = 0.0
+    if sparse.issparse(window):
+        window = sparse.coo_matrix(window)
+        window.sum_duplicates()
+        in_geom = on_land_reg[window.row, window.col]
+        nightlight_reg = np.zeros(window.shape, window.dtype)
+        nightlight_reg[window.row[in_geom], window.col[in_geom]] = window.data[in_geom]
+    else:
+        nightlight_reg = np.array(window)
+        nightlight_reg[~on_land_reg] = 0.0
 
     return nightlight_reg, lat_reg, lon_reg, on_land_reg
 
+def _window_coord(lat_0, lon_0, coord_nl, in_lat, in_lon, shape):
+    """Coordinates of a window of the nightlight grid.
+
+    Parameters
+    ----------
+    lat_0, lon_0 : float
+        coordinates of the first point of the grid
+    coord_nl : np.array
+        nightlight coordinates: [[min_lat, lat_step],
+        [min_lon, lon_step]]
+    in_lat, in_lon : tuple(int)
+        first and last row and column of the window
+    shape : tuple(int)
+        shape of the window
+
+    Returns
+    -------
+    lat_reg, lon_reg (2d read-only views of the latitudes of the rows and the longitudes
+    of the columns with the shape of the window)
+    """
+    lat_reg = np.mgrid[lat_0 + in_lat[0] * coord_nl[0, 1]:
+                       lat_0 + in_lat[1] * coord_nl[0, 1]:
+                       complex(0, shape[0])]
+    lon_reg = np.mgrid[lon_0 + in_lon[0] * coord_nl[1, 1]:
+                       lon_0 + in_lon[1] * coord_nl[1, 1]:
+                       complex(0, shape[1])]
+    return np.broadcast_to(lat_reg[:, None], shape), np.broadcast_to(lon_reg[None, :], shape)
+
+def _rasterize_mask(geom, lat, lon):
+    """Rasterize a geometry on a regular grid: True in the points (cell centers) within
+    the geometry.
+
+    Parameters
+    ----------
+    geom : shapely.geometry
+        geometry to rasterize
+    lat : np.array
+        increasing, equally spaced latitudes of the rows
+    lon : np.array
+        increasing, equally spaced longitudes of the columns
+
+    Returns
+    -------
+    np.array(bool)
+    """
+    shape = (lat.size, lon.size)
+    if geom.is_empty or 0 in shape:
+        return np.zeros(shape, bool)
+    res_lat = (lat[-1] - lat[0]) / (lat.size - 1) if lat.size > 1 else 1.0
+    res_lon = (lon[-1] - lon[0]) / (lon.size - 1) if lon.size > 1 else 1.0
+    transform = rasterio.Affine(res_lon, 0, lon[0] - res_lon / 2,
+                                0, res_lat, lat[0] - res_lat / 2)
+    return rasterio.features.rasterize([geom], out_shape=shape, transform=transform,
+                                       fill=0, default_value=1, dtype='uint8').view(bool)
+
 def _resample_land(geom, nightlight, lat, lon, res_fact, on_land):
     """Model land exposures from nightlight intensities and normalized
     to GDP * (income_group + 1).
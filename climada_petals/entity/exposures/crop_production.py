@@ -298,7 +298,7 @@ class CropProduction(Exposures):
             ).values
             area_crop[irr_var] = np.nan_to_num(area_crop[irr_var]).flatten()
 
-        # set historic mean, its latitude, and longitude:
+        # set historic mean at the exposure coordinates:
         hist_mean_dict = dict()
         # if hist_mean is given as np.ndarray or dict,
         # code assumes it contains hist_mean as returned by relative_cropyield
@@ -310,48 +310,25 @@ class CropProduction(Exposures):
                 # if irr=='combined', both 'firr' and 'noirr' are required.
                 raise ValueError(f'Invalid hist_mean provided: {hist_mean}')
             hist_mean_dict = hist_mean
-            lat_mean = exp.gdf.latitude.values
         elif isinstance(hist_mean, np.ndarray) or isinstance(hist_mean, list):
             hist_mean_dict[irr_types[0]] = np.array(hist_mean)
-            lat_mean = exp.gdf.latitude.values
         elif Path(hist_mean).is_dir(): # else if hist_mean is given as path to directory
         # The adequate file from the directory (depending on crop and irrigation) is extracted
-        # and the variables hist_mean, lat_mean and lon_mean are set accordingly
             for irr_var in irr_types:
-                filename = str(Path(hist_mean, 'hist_mean_%s-%s_%i-%i.hdf5' %(
-                    crop, irr_var, yearrange[0], yearrange[1])))
-                hist_mean_dict[irr_var] = (h5py.File(filename, 'r'))['mean'][()]
-            lat_mean = (h5py.File(filename, 'r'))['lat'][()]
-            lon_mean = (h5py.File(filename, 'r'))['lon'][()]
-        elif Path(input_dir, hist_mean).is_file(): # file in input_dir
-        # Hist_mean, lat_mean and lon_mean are extracted from the given file
+                hist_mean_dict[irr_var] = _read_hist_mean(
+                    Path(hist_mean, 'hist_mean_%s-%s_%i-%i.hdf5' %(
+                        crop, irr_var, yearrange[0], yearrange[1])),
+                    exp.gdf.latitude.values, exp.gdf.longitude.values)
+        elif Path(input_dir, hist_mean).is_file() or hist_mean.is_file():
+        # file in input_dir or, as fall back, complete file path
             if len(irr_types) > 1:
                 raise ValueError("For irr=='combined', hist_mean cannot be a single file.")
-            hist_mean = h5py.File(str(Path(input_dir, hist_mean)), 'r')
-            hist_mean_dict[irr_types[0]] = hist_mean['mean'][()]
-            lat_mean = hist_mean['lat'][()]
-            lon_mean = hist_mean['lon'][()]
-        elif hist_mean.is_file(): # fall back: complete file path
-        # Hist_mean, lat_mean and lon_mean are extracted from the given file
-            if len(irr_types) > 1:
-                raise ValueError("For irr=='combined', hist_mean can not be single file.")
-            hist_mean = h5py.File(str(Path(input_dir, hist_mean)), 'r')
-            hist_mean_dict[irr_types[0]] = hist_mean['mean'][()]
-            lat_mean = hist_mean['lat'][()]
-            lon_mean = hist_mean['lon'][()]
+            hist_mean_dict[irr_types[0]] = _read_hist_mean(
+                Path(input_dir, hist_mean), exp.gdf.latitude.values, exp.gdf.longitude.values)
         else:
             raise ValueError(f"Invalid hist_mean provided: {hist_mean}")
-
-        # The bbox is cut out of the hist_mean data file if needed
-        if len(lat_mean) != len(exp.gdf.latitude.values):
-            idx_mean = np.zeros(len(exp.gdf.latitude.values), dtype=int)
-            for i in range(len(exp.gdf.latitude.values)):
-                idx_mean[i] = np.where(
-                    (lat_mean == exp.gdf.latitude.values[i])
-                    & (lon_mean == exp.gdf.longitude.values[i])
-                )[0][0]
-        else:
-            idx_mean = np.arange(0, len(lat_mean))
+        # hist_mean values are given at the exposure coordinates
+        idx_mean = np.arange(0, len(exp.gdf.latitude.values))
 
         # The exposure [t/y] is computed per grid cell as the product of the area covered
         # by a crop [ha] and its yield [t/ha/y]
@@ -703,12 +680,102 @@ class CropProduction(Exposures):
             aggregated exposure value
         """
 
-        list_countries = np.unique(self.gdf.region_id)
-        country_values = np.zeros(len(list_countries))
-        for i, iso_nr in enumerate(list_countries):
-            country_values[i] = self.gdf.loc[self.gdf.region_id == iso_nr].value.sum()
+        country_values = self.gdf.value.groupby(self.gdf.region_id).sum()
+        return country_values.index.values, country_values.values
+
+
+def _read_hist_mean(filename, lat, lon):
+    """Read the historic mean crop yield at the given coordinates from a hist_mean file (as
+    saved by relative_cropyield.set_multiple_rc_from_isimip)
+
+    If the file contains as many values as coordinates are given, it is assumed to match the
+    coordinates. Otherwise, only the range of values containing the given coordinates is read.
+
+    Parameters
+    ----------
+    filename : Path or str
+        hdf5 file with the datasets 'mean', 'lat' and 'lon'
+    lat, lon : np.array
+        coordinates of the exposure points
+
+    Returns
+    -------
+    np.array
+        historic mean crop yield per exposure point
+    """
+    with h5py.File(filename, 'r') as mean_file:
+        lat_mean = mean_file['lat'][()]
+        lon_mean = mean_file['lon'][()]
+        if len(lat_mean) == len(lat):
+            return mean_file['mean'][()]
+        idx_mean = _coord_index(lat_mean, lon_mean, lat, lon)
+        if idx_mean.size == 0:
+            return mean_file['mean'][0:0]
+        start, stop = idx_mean.min(), idx_mean.max() + 1
+        return mean_file['mean'][start:stop][idx_mean - start]
+
+
+def _coord_index(lat_ref, lon_ref, lat, lon):
+    """Index of the first reference point with exactly the same coordinates as each point
+
+    Parameters
+    ----------
+    lat_ref, lon_ref : np.array
+        coordinates of the reference points
+    lat, lon : np.array
+        coordinates of the points to look up
+
+    Returns
+    -------
+    np.array
+        index of a reference point per point
+
+    Raises
+    ------
+    ValueError
+        if there is no reference point at the coordinates of a point
+    """
+    # adding 0.0 replaces -0.0 by 0.0, which compares equal
+    ref_index = pd.MultiIndex.from_arrays([np.asarray(lat_ref) + 0.0,
+                                           np.asarray(lon_ref) + 0.0])
+    first = np.flatnonzero(~ref_index.duplicated())
+    idx = ref_index[first].get_indexer(pd.MultiIndex.from_arrays([np.asarray(lat) + 0.0,
+                                                                  np.asarray(lon) + 0.0]))
+    if (idx < 0).any():
+        raise ValueError(f'No historic mean crop yield found for {(idx < 0).sum()} of'
+                         f' {idx.size} coordinates.')
+    return first[idx]
 
-        return list_countries, country_values
+
+def _fao_country_mean(fao, crop, yearrange, iso3num):
+    """Mean of the FAO values of a crop within a year range, per country
+
+    Parameters
+    ----------
+    fao : pd.DataFrame
+        FAOSTAT data with the columns 'Area Code', 'Item', 'Year' and 'Value'
+    crop : str
+        crop type
+        e.g., 'mai', 'ric', 'whe', 'soy'
+    yearrange : tuple
+        first and last year
+    iso3num : np.array
+        country codes (numerical ISO3)
+
+    Returns
+    -------
+    country_mean : np.array
+        mean value per country, NaN for countries without values
+    crop_mean : float
+        mean of the values of all countries
+    """
+    fao = fao[(fao.Item == CROP_NAME[crop]['fao'])
+              & (fao.Year >= yearrange[0]) & (fao.Year <= yearrange[1])]
+    fao_code = u_coord.country_iso2faocode(iso3num).astype(int)
+    country_mean = fao.Value.groupby(fao['Area Code']).mean().reindex(fao_code).to_numpy(
+        dtype=float, copy=True)
+    country_mean[fao_code == 0] = np.nan
+    return country_mean, fao.Value.mean()
 
 
 def value_to_kcal(exp_cp, biomass=True):
@@ -781,53 +848,24 @@ def value_to_usd(exp_cp, input_dir=None, yearrange=None):
     if len(yearrange) == 1:
         yearrange = (yearrange[0], yearrange[0])
 
-    # open both FAO files and extract needed variables
     # FAO_FILE: contains producer prices per crop, country and year
-    fao = dict()
-    fao['file'] = pd.read_csv(input_dir / FAO_FILE)
-    fao['crops'] = fao['file'].Item.values
-    fao['year'] = fao['file'].Year.values
-    fao['price'] = fao['file'].Value.values
-
-    fao_country = u_coord.country_faocode2iso(getattr(fao['file'], 'Area Code').values)
-
-    # create deep copy of exposure
-    new_exp = copy.deepcopy(exp_cp)
-
-    # create a list of the countries contained in the exposure
-    iso3num = list()
-    new_exp.gdf.region_id[exp_cp.gdf.region_id == -99] = 0
-    iso3num = np.asarray(u_coord.country_to_iso(
-        new_exp.gdf.region_id, representation="numeric", fillvalue=999), dtype=object)
-    list_countries = np.unique(iso3num)
-
-    # iterate over all countries that are covered in the exposure, extract the according price
-    # and calculate the crop production in USD/y
-    area_price = np.zeros(new_exp.gdf.value.size)
-    for country in list_countries:
-        [idx_country] = (iso3num == country).nonzero()
-        if country == 999:
-            price = 0
-            area_price[idx_country] = new_exp.gdf.value[idx_country] * price
-        # zero means no country, 999 other country
-        elif country != 0 and country != 999:
-            idx_price = np.where((np.asarray(fao_country) == country) &
-                                 (np.asarray(fao['crops']) == \
-                                 (CROP_NAME[new_exp.crop])['fao']) &
-                                 (fao['year'] >= yearrange[0]) &
-                                 (fao['year'] <= yearrange[1]))
-            # if no price can be determined for a specific yearrange and country, the world
-            # average for that crop (in the specified yearrange) is used
-            if idx_price[0].size != 0:
-                price = np.mean(fao['price'][idx_price])
-
-            else:
-                idx_price = np.where((np.asarray(fao['crops']) == \
-                                      (CROP_NAME[new_exp.crop])['fao']) &
-                                     (fao['year'] >= yearrange[0]) &
-                                     (fao['year'] <= yearrange[1]))
-                price = np.mean(fao['price'][idx_price])
-            area_price[idx_country] = new_exp.gdf.value[idx_country] * price
+    fao = pd.read_csv(input_dir / FAO_FILE)
+
+    # determine the countries contained in the exposure
+    new_exp.gdf.loc[exp_cp.gdf.region_id == -99, 'region_id'] = 0
+    region_ids, idx_country = np.unique(new_exp.gdf.region_id.values, return_inverse=True)
+    iso3num = np.array(u_coord.country_to_iso(
+        region_ids, representation="numeric", fillvalue=999), dtype=int)
+
+    # extract the price of each country and calculate the crop production in USD/y
+    price, crop_price = _fao_country_mean(fao, new_exp.crop, yearrange, iso3num)
+    # if no price can be determined for a specific yearrange and country, the world
+    # average for that crop (in the specified yearrange) is used
+    price[np.isnan(price)] = crop_price
+    # zero means no country, 999 other country
+    price[iso3num == 999] = 0
+    area_price = new_exp.gdf.value.values * price[idx_country]
+    area_price[iso3num[idx_country] == 0] = 0
 
     # the exposure values in t/y is saved as 'tonnes_per_year'
     new_exp.gdf['tonnes_per_year'] = exp_cp.gdf['value'].values
@@ -974,63 +1012,48 @@ def normalize_with_fao_cp(exp_firr, exp_noirr, input_dir=None,
         yearrange = YEARS_FAO
     if not unit:
         unit = 't/y'
-    # if the exposure unit is USD/y or kcal/y, temporarily reset the exposure to t/y
-    # (stored in tonnes_per_year) in order to normalize with FAO crop production
-    # values and then apply set_to_XXX() for the normalized exposure to restore the
-    # initial exposure unit
-    if exp_firr.value_unit == 'USD/y' or 'kcal' in exp_firr.value_unit:
-        exp_firr.gdf.value = exp_firr.tonnes_per_year
-    if exp_noirr.value_unit == 'USD/y' or 'kcal' in exp_noirr.value_unit:
-        exp_noirr.gdf.value = exp_noirr.tonnes_per_year
-
-    country_list, countries_firr = exp_firr.aggregate_countries()
-    country_list, countries_noirr = exp_noirr.aggregate_countries()
+    # if the exposure unit is USD/y or kcal/y, the exposure is reset to t/y (stored in
+    # tonnes_per_year) in order to normalize with FAO crop production values, and
+    # value_to_XXX() is applied to the normalized exposure to restore the initial exposure unit
+    exp_firr_norm = copy.deepcopy(exp_firr)
+    exp_noirr_norm = copy.deepcopy(exp_noirr)
+    for exp_norm in (exp_firr_norm, exp_noirr_norm):
+        if exp_norm.value_unit == 'USD/y' or 'kcal' in exp_norm.value_unit:
+            exp_norm.gdf['value'] = exp_norm.gdf['tonnes_per_year']
+            exp_norm.value_unit = 't/y'
+
+    country_list, countries_firr = exp_firr_norm.aggregate_countries()
+    country_list, countries_noirr = exp_noirr_norm.aggregate_countries()
 
     exp_tot_production = countries_firr + countries_noirr
 
     fao = pd.read_csv(input_dir / FAO_FILE2)
-    fao_crops = fao.Item.values
-    fao_year = fao.Year.values
-    fao_values = fao.Value.values
-    fao_code = getattr(fao, 'Area Code').values
-
-    fao_country = u_coord.country_iso2faocode(country_list)
+    fao_crop_production, _ = _fao_country_mean(fao, exp_firr.crop, yearrange, country_list)
 
-    fao_crop_production = np.zeros(len(country_list))
+    # compute ratio per country: if a country has no values in the exposure (e.g. Cyprus)
+    # the exposure value is set to the FAO average value, in this case the ratio is left
+    # being 1. Countries without FAO values have a NaN ratio.
     ratio = np.ones(len(country_list))
-    exp_firr_norm = exp_firr.copy(deep=True)
-    exp_noirr_norm = exp_noirr.copy(deep=True)
-
-    # loop over countries: compute ratio & apply normalization:
-    for country, iso_nr in enumerate(country_list):
-        idx = np.where((np.asarray(fao_code) == fao_country[country])
-                       & (np.asarray(fao_crops) == (CROP_NAME[exp_firr.crop])['fao'])
-                       & (fao_year >= yearrange[0]) & (fao_year <= yearrange[1]))
-        if len(idx) >= 1:
-            fao_crop_production[country] = np.mean(fao_values[idx])
-
-        # if a country has no values in the exposure (e.g. Cyprus) the exposure value
-        # is set to the FAO average value
-        # in this case the ratio is left being 1 (as initiated)
-        if exp_tot_production[country] == 0:
-            exp_tot_production[country] = fao_crop_production[country]
-        elif fao_crop_production[country] != np.nan and fao_crop_production[country] != 0:
-            ratio[country] = fao_crop_production[country] / exp_tot_production[country]
-
-        exp_firr_norm.gdf.value[exp_firr.gdf.region_id == iso_nr] = ratio[country] * \
-        exp_firr.gdf.value[exp_firr.gdf.region_id == iso_nr]
-        exp_noirr_norm.gdf.value[exp_firr.gdf.region_id == iso_nr] = ratio[country] * \
-        exp_noirr.gdf.value[exp_noirr.gdf.region_id == iso_nr]
-
-        if unit == 'USD/y' or exp_noirr.value_unit == 'USD/y':
-            exp_noirr.set_value_to_usd(input_dir=input_dir)
-        elif 'kcal' in unit or 'kcal' in exp_noirr.value_unit:
-            exp_noirr.set_value_to_kcal(biomass=True)
-            # FAO production is provided in biomass, not dry matter
-        if unit == 'USD/y' or exp_firr.value_unit == 'USD/y':
-            exp_firr.set_value_to_usd(input_dir=input_dir)
-        elif 'kcal' in unit or 'kcal' in exp_firr.value_unit:
-            exp_firr.set_value_to_kcal(biomass=True)
+    no_exposure = exp_tot_production == 0
+    exp_tot_production[no_exposure] = fao_crop_production[no_exposure]
+    scaled = ~no_exposure & (fao_crop_production != 0)
+    ratio[scaled] = fao_crop_production[scaled] / exp_tot_production[scaled]
+
+    # apply normalization:
+    ratio_per_country = pd.Series(ratio, index=country_list)
+    for exp_norm in (exp_firr_norm, exp_noirr_norm):
+        exp_norm.gdf['value'] = exp_norm.gdf.value.values * ratio_per_country.reindex(
+            exp_norm.gdf.region_id.values, fill_value=1.).values
+
+    if unit == 'USD/y' or exp_noirr.value_unit == 'USD/y':
+        exp_noirr_norm = value_to_usd(exp_noirr_norm, input_dir=input_dir)
+    elif 'kcal' in unit or 'kcal' in exp_noirr.value_unit:
+        # FAO production is provided in biomass, not dry matter
+        exp_noirr_norm = value_to_kcal(exp_noirr_norm, biomass=True)
+    if unit == 'USD/y' or exp_firr.value_unit == 'USD/y':
+        exp_firr_norm = value_to_usd(exp_firr_norm, input_dir=input_dir)
+    elif 'kcal' in unit or 'kcal' in exp_firr.value_unit:
+        exp_firr_norm = value_to_kcal(exp_firr_norm, biomass=True)
 
     exp_firr_norm.description = " ".join([exp_firr_norm.description or "", "normalized"])
     exp_noirr_norm.description = " ".join([exp_noirr_norm.description or "", "normalized"])
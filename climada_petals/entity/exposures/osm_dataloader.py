@@ -19,16 +19,45 @@ with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
 Download openstreetmap data from the Overpass API
 """
 
-import itertools
+import hashlib
 import logging
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from pathlib import Path
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import overpy
 import shapely
 
 LOGGER = logging.getLogger(__name__)
 
+MAX_WORKERS = 2
+"""default number of concurrent Overpass API requests (the public Overpass API
+instances allow two concurrent requests per client)"""
+
+
+class _CachingOverpass(overpy.Overpass):
+    """overpy.Overpass that stores the raw JSON response of a successful query in a file"""
+
+    def __init__(self, cache_file=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_file = cache_file
+
+    def parse_json(self, data, encoding="utf-8"):
+        result = super().parse_json(data, encoding=encoding)
+        if self.cache_file is not None:
+            # write to a temporary file first, so that concurrent queries never read
+            # incomplete files
+            path_tmp = self.cache_file.with_suffix(
+                f".{os.getpid()}.{threading.get_ident()}.tmp")
+            path_tmp.write_bytes(data if isinstance(data, bytes) else data.encode(encoding))
+            os.replace(path_tmp, self.cache_file)
+        return result
+
 
 class OSMApiQuery:
     """
@@ -82,7 +111,7 @@ class OSMApiQuery:
         return cls(area=f'(poly:"{lat_lon_str}")', condition=condition)
 
     def _insistent_osm_api_query(self, query_clause, read_chunk_size=100000,
-                                 end_of_patience=127):
+                                 end_of_patience=127, url=None, cache_dir=None):
         """Runs a single Overpass API query through overpy.Overpass.query.
         In case of failure it tries again after an ever increasing waiting period.
         If the waiting period surpasses a given limit an exception is raised.
@@ -91,11 +120,23 @@ class OSMApiQuery:
             query_clause (str): the query
             read_chunk_size (int): paramter passed over to overpy.Overpass.query
             end_of_patience (int): upper limit for the next waiting period to proceed.
+            url (str): URL of the Overpass API. Default: the default of overpy.Overpass
+            cache_dir (str or Path): if given, the response is read from a file in this
+                directory named after the hash of the query, if it exists, or written to it
+                otherwise. Default: None
 
         Returns:
             result as returned by overpy.Overpass.query
         """
-        api = overpy.Overpass(read_chunk_size=read_chunk_size)
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = self._cache_file(query_clause, cache_dir)
+            if cache_file.is_file():
+                LOGGER.debug("Reusing Overpass response from %s", cache_file)
+                return overpy.Overpass(url=url).parse_json(cache_file.read_bytes())
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+        api = _CachingOverpass(cache_file=cache_file, read_chunk_size=read_chunk_size, url=url)
         waiting_period = 1
         while True:
             try:
@@ -116,6 +157,111 @@ class OSMApiQuery:
             time.sleep(waiting_period)
             waiting_period *= 2
 
+    @staticmethod
+    def _cache_file(query_clause, cache_dir):
+        """
+        file of the cached response to a query, named after the hash of the query
+        (which contains the condition and the bounding box or polygon)
+
+        Parameters
+        ----------
+        query_clause : str
+        cache_dir : str or Path
+
+        Returns
+        -------
+        Path
+        """
+        query_hash = hashlib.sha1(query_clause.encode("utf-8")).hexdigest()
+        return Path(cache_dir, f"{query_hash}.json")
+
+    def _tiles(self, tile_size):
+        """
+        split the bounding box area into tiles of equal size, such that no tile
+        extends over more than tile_size degrees
+
+        Parameters
+        ----------
+        tile_size : float or None
+            largest extent of a tile in degrees. If None, the area is not split.
+
+        Returns
+        -------
+        list of OSMApiQuery
+            queries of the tiles with the condition of this query, or only this query if
+            the area is a polygon or fits into one tile
+        """
+        if tile_size is None or isinstance(self.area, str):
+            return [self]
+        ymin, xmin, ymax, xmax = self.area
+        n_lat = max(1, int(np.ceil((ymax - ymin) / tile_size)))
+        n_lon = max(1, int(np.ceil((xmax - xmin) / tile_size)))
+        if n_lat * n_lon == 1:
+            return [self]
+        # adjacent tiles share their edges exactly, so that no element is missed
+        lats = np.linspace(ymin, ymax, n_lat + 1).tolist()
+        lons = np.linspace(xmin, xmax, n_lon + 1).tolist()
+        return [type(self)((lats[i], lons[j], lats[i + 1], lons[j + 1]), self.condition)
+                for i in range(n_lat) for j in range(n_lon)]
+
+    @staticmethod
+    def _merge_results(results):
+        """
+        merge overpy results, e.g. of adjacent tiles, into one. Elements contained in
+        several results are kept once, and they are ordered by id, as in the result of a
+        single query.
+
+        Parameters
+        ----------
+        results : list of overpy.Result
+
+        Returns
+        -------
+        overpy.Result
+        """
+        merged = overpy.Result()
+        for result in results:
+            merged.expand(result)
+        by_id = attrgetter('id')
+        return overpy.Result(
+            sorted(merged.nodes, key=by_id) + sorted(merged.ways, key=by_id)
+            + sorted(merged.relations, key=by_id) + sorted(merged.areas, key=by_id),
+            api=results[0].api)
+
+    def _query_tiles(self, tile_size=None, max_workers=MAX_WORKERS, url=None,
+                     cache_dir=None):
+        """
+        query the tiles of the area concurrently and merge their results
+
+        Parameters
+        ----------
+        tile_size : float or None
+            largest extent of a tile in degrees, see _tiles. Default: None
+        max_workers : int
+            largest number of concurrent queries. Default: MAX_WORKERS
+        url : str
+            URL of the Overpass API, see _insistent_osm_api_query
+        cache_dir : str or Path
+            directory of cached responses, see _insistent_osm_api_query
+
+        Returns
+        -------
+        overpy.Result
+        """
+        query_clauses = [tile._overpass_query_string() for tile in self._tiles(tile_size)]
+        if len(query_clauses) == 1:
+            return self._insistent_osm_api_query(
+                query_clauses[0], url=url, cache_dir=cache_dir)
+
+        LOGGER.info("Querying %s tiles with %s concurrent requests",
+                    len(query_clauses), max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda query_clause: self._insistent_osm_api_query(
+                    query_clause, url=url, cache_dir=cache_dir),
+                query_clauses))
+        return self._merge_results(results)
+
     def _overpass_query_string(self):
         return f'[out:json][timeout:180];(nwr{self.condition}{self.area};(._;>;););out;'
 
@@ -147,39 +293,42 @@ class OSMApiQuery:
         data_id = []
         data_tags = []
 
+        # position of each way in the result, to select the member ways of a
+        # relation without scanning all ways
+        ways = result.ways
+        way_pos = {way.id: pos for pos, way in enumerate(ways)}
+
         for relation in result.relations:
             data_tags.append(relation.tags)
             data_id.append(relation.id)
-            roles = []
-            relationways = []
-
-            for way in relation.members:
-                relationways.append(way.ref)
-                roles.append(way.role)
 
-            ways_taken.append(relationways)
+            # member ways with their roles, in the order of the relation; members that
+            # are not ways (e.g. label nodes) or not in the result are skipped
+            members = [member for member in relation.members
+                       if isinstance(member, overpy.RelationWay) and member.ref in way_pos]
+            roles = [member.role for member in members]
+            relationways = [member.ref for member in members]
 
-            nodes_taken_mp, gdf_polys = self._assemble_from_ways(
-                result, relationways, closed_lines_are_polys=True)
+            ways_taken.extend(relationways)
 
-            nodes_taken.append(nodes_taken_mp)
+            nodes_taken_mp, geoms = self._geoms_from_ways(
+                [ways[way_pos[ref]] for ref in relationways], closed_lines_are_polys=True)
 
-            gdf_polys['role'] = roles
+            nodes_taken.extend(nodes_taken_mp)
 
             # separate relationways into inner, outer polygons and linestrings,
             # combine them.
 
             # step 1: polygons to multipolygons
             inner_mp = shapely.geometry.MultiPolygon(
-                gdf_polys.geometry[(gdf_polys.geometry.type == 'Polygon') &
-                                   (gdf_polys.role == 'inner')].values)
+                [geom for geom, role in zip(geoms, roles)
+                 if geom.geom_type == 'Polygon' and role == 'inner'])
             outer_mp = shapely.geometry.MultiPolygon(
-                gdf_polys.geometry[(gdf_polys.geometry.type == 'Polygon') &
-                                   (gdf_polys.role == 'outer')].values)
+                [geom for geom, role in zip(geoms, roles)
+                 if geom.geom_type == 'Polygon' and role == 'outer'])
 
             # step 2: poly from lines --> multiline --> line --> polygon
-            lines = gdf_polys.geometry[
-                (gdf_polys.geometry.type == 'LineString')].values
+            lines = [geom for geom in geoms if geom.geom_type == 'LineString']
             if len(lines) > 0:
                 poly = shapely.geometry.Polygon(
                     shapely.ops.linemerge(shapely.geometry.MultiLineString(lines)))
@@ -197,10 +346,6 @@ class OSMApiQuery:
             data={'osm_id': data_id, 'geometry': data_geom, 'tags': data_tags},
             geometry='geometry', crs='epsg:4326')
 
-        # list of lists into list:
-        nodes_taken = list(itertools.chain.from_iterable(nodes_taken))
-        ways_taken = list(itertools.chain.from_iterable(ways_taken))
-
         return nodes_taken, ways_taken, gdf_rels
 
     def _assemble_from_ways(self, result, ways_avail, closed_lines_are_polys):
@@ -229,32 +374,55 @@ class OSMApiQuery:
         gdf_ways : gpd.GeoDataFrame
             gdf with ways that were assembled from result object
         """
-
-        nodes_taken = []
-        data_geom = []
-        data_id = []
-        data_tags = []
-
-        for way in result.ways:
-            if way.id in ways_avail:
-                node_lat_lons = []
-                for node in way.nodes:
-                    nodes_taken.append(node.id)
-                    node_lat_lons.append((float(node.lat), float(node.lon)))
-                data_geom.append(shapely.geometry.LineString(node_lat_lons))
-                data_id.append(way.id)
-                data_tags.append(way.tags)
-
-            if closed_lines_are_polys:
-                data_geom = [shapely.geometry.Polygon(way) if way.is_closed
-                             else way for way in data_geom]
+        ways_avail = set(ways_avail)
+        ways = [way for way in result.ways if way.id in ways_avail]
+        nodes_taken, data_geom = self._geoms_from_ways(ways, closed_lines_are_polys)
 
         gdf_ways = gpd.GeoDataFrame(
-            data={'osm_id': data_id, 'geometry': data_geom, 'tags': data_tags},
+            data={'osm_id': [way.id for way in ways], 'geometry': data_geom,
+                  'tags': [way.tags for way in ways]},
             geometry='geometry', crs='epsg:4326')
 
         return nodes_taken, gdf_ways
 
+    @staticmethod
+    def _geoms_from_ways(ways, closed_lines_are_polys):
+        """
+        construct line strings (in lat / lon ordering), or polygons for closed
+        lines, from overpy ways
+
+        Parameters
+        ---------
+        ways : list
+            overpy.Way objects
+        closed_lines_are_polys : bool
+            whether closed lines are polygons
+
+        Returns
+        -------
+        nodes_taken : list
+            node-ids of all ways, in the order of the ways
+        geoms : list
+            shapely geometries of the ways
+        """
+        nodes_taken = []
+        geoms = []
+        # node coordinates are converted once, even if nodes are shared by ways
+        node_lat_lon = {}
+        for way in ways:
+            node_lat_lons = []
+            for node in way.nodes:
+                nodes_taken.append(node.id)
+                lat_lon = node_lat_lon.get(node.id)
+                if lat_lon is None:
+                    lat_lon = node_lat_lon[node.id] = (float(node.lat), float(node.lon))
+                node_lat_lons.append(lat_lon)
+            line = shapely.geometry.LineString(node_lat_lons)
+            if closed_lines_are_polys and line.is_closed:
+                line = shapely.geometry.Polygon(line)
+            geoms.append(line)
+        return nodes_taken, geoms
+
     def _assemble_from_nodes(self, result, nodes_avail):
         """
         pick out those nodes and ways from result instance that belong to
@@ -273,18 +441,13 @@ class OSMApiQuery:
         gdf_nodes : gpd.GeoDataFrame
             gdf with nodes that were assembled from result object
         """
-        data_geom = []
-        data_id = []
-        data_tags = []
-
-        for node in result.nodes:
-            if node.id in nodes_avail:
-                data_geom.append(shapely.geometry.Point(node.lat, node.lon))
-                data_id.append(node.id)
-                data_tags.append(node.tags)
+        nodes_avail = set(nodes_avail)
+        nodes = [node for node in result.nodes if node.id in nodes_avail]
 
         gdf_nodes = gpd.GeoDataFrame(
-            data={'osm_id': data_id, 'geometry': data_geom, 'tags': data_tags},
+            data={'osm_id': [node.id for node in nodes],
+                  'geometry': [shapely.geometry.Point(node.lat, node.lon) for node in nodes],
+                  'tags': [node.tags for node in nodes]},
             geometry='geometry', crs='epsg:4326')
 
         return gdf_nodes
@@ -294,6 +457,7 @@ class OSMApiQuery:
         update id availabilities from whole result set after using up some for
         geometry construction
         """
+        to_remove = set(to_remove)
         return [item for item in full_set if item not in to_remove]
 
     def _assemble_results(self, result, closed_lines_are_polys=True):
@@ -359,13 +523,38 @@ class OSMApiQuery:
                                 shapely.ops.transform(
                                     lambda x, y: (y, x), geometry))
 
-    def get_data_overpass(self, closed_lines_are_polys=True):
+    def get_data_overpass(self, closed_lines_are_polys=True, tile_size=None,
+                          max_workers=MAX_WORKERS, cache_dir=None, url=None):
         """
         wrapper for all helper funcs to get & assemble data
-        """
 
-        query_clause = self._overpass_query_string()
-        result = self._insistent_osm_api_query(query_clause)
+        Parameters
+        ----------
+        closed_lines_are_polys : bool
+            whether closed lines are polygons. Default is True
+        tile_size : float or None
+            bounding boxes extending over more than tile_size degrees are split into tiles,
+            which are queried concurrently. Elements in several tiles (e.g. crossing their
+            edges) are kept once. Polygons are always queried at once. Note that large
+            bounding boxes split into small tiles lead to many requests to the Overpass API.
+            Default: None (the area is queried at once)
+        max_workers : int
+            largest number of concurrent queries. Default: MAX_WORKERS
+        cache_dir : str or Path
+            if given, the responses of the Overpass API are stored in this directory, one
+            file per query (i.e. per tile) named after the hash of the query, and read from
+            there when the same query is made again, instead of querying the Overpass API.
+            Cached responses do not expire; remove the files to update them. Default: None
+        url : str
+            URL of the Overpass API. Default: the default of overpy.Overpass
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+            Result-gdf from the overpass query.
+        """
+        result = self._query_tiles(tile_size=tile_size, max_workers=max_workers, url=url,
+                                   cache_dir=cache_dir)
         gdf_result = self._assemble_results(result, closed_lines_are_polys)
         gdf_result = gdf_result.set_geometry(
             self._osm_geoms_to_gis(gdf_result))
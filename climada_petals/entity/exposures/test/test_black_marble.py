@@ -18,15 +18,21 @@ with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
 
 Test BlackMarble base class.
 """
+import tempfile
 import unittest
+from pathlib import Path
+
+import geopandas as gpd
 import numpy as np
 import scipy.sparse as sparse
 import shapely
 from cartopy.io import shapereader
+from pathos.pools import ProcessPool as Pool
 
-from climada_petals.entity.exposures.black_marble import country_iso_geom, \
+from climada_petals.entity.exposures.black_marble import BlackMarble, country_iso_geom, \
 _cut_country, fill_econ_indicators, _set_econ_indicators, _fill_admin1_geom, \
-_cut_admin1, _resample_land
+_cut_admin1, _resample_land, _rasterize_mask, _set_countries_pool, _share_nightlight, \
+_load_nightlight, _load_admin_index, ADMIN1_KEY
 from climada.entity.exposures.litpop.nightlight import NOAA_BORDER, NOAA_RESOLUTION_DEG
 
 SHP_FN = shapereader.natural_earth(resolution='10m', category='cultural',
@@ -88,6 +94,73 @@ class TestCountryIso(unittest.TestCase):
         with self.assertRaises(ValueError):
             country_iso_geom(country_name, SHP_FILE)
 
+class TestAdminIndex(unittest.TestCase):
+    """Test the index of admin shape files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.admin0_file = str(Path(cls.tmp_dir.name) / 'admin0.shp')
+        gpd.GeoDataFrame({
+            'ADMIN': ['Aland', 'Bland', 'Cland'],
+            'ADM0_A3': ['AAA', 'BBB', 'CCC'],
+            'geometry': [shapely.geometry.box(0, 0, 2, 2), shapely.geometry.box(2, 0, 4, 2),
+                         shapely.geometry.box(10, 10, 11, 11)],
+        }, crs='epsg:4326').to_file(cls.admin0_file)
+        cls.admin1_file = str(Path(cls.tmp_dir.name) / 'admin1.shp')
+        gpd.GeoDataFrame({
+            'name': ['North', 'South', 'North'],
+            'adm0_a3': ['AAA', 'AAA', 'BBB'],
+            'adm1_code': ['AAA-1', 'AAA-2', 'BBB-1'],
+            'geometry': [shapely.geometry.box(0, 1, 2, 2), shapely.geometry.box(0, 0, 2, 1),
+                         shapely.geometry.box(2, 0, 4, 2)],
+        }, crs='epsg:4326').to_file(cls.admin1_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_load_admin0_pass(self):
+        """Test _load_admin_index with admin0 records, and country_iso_geom with it."""
+        index = _load_admin_index(self.admin0_file)
+        self.assertIs(index, _load_admin_index(self.admin0_file))
+        self.assertEqual(index.names, {'Aland': 0, 'Bland': 1, 'Cland': 2})
+        self.assertEqual(index.codes, {'AAA': 0, 'BBB': 1, 'CCC': 2})
+        self.assertEqual(index.by_iso, {'AAA': [0], 'BBB': [1], 'CCC': [2]})
+        self.assertEqual(
+            [rec.attributes['ADM0_A3'] for rec in index.query(shapely.geometry.Point(2, 1))],
+            ['AAA', 'BBB'])
+        self.assertEqual(index.query(shapely.geometry.Point(20, 20)), [])
+
+        cntry_info, cntry_admin1 = country_iso_geom(['bland'], self.admin0_file)
+        self.assertEqual(list(cntry_info.keys()), ['BBB'])
+        self.assertEqual(cntry_info['BBB'][1], 'Bland')
+        self.assertTrue(cntry_info['BBB'][2].equals(shapely.geometry.box(2, 0, 4, 2)))
+        self.assertEqual(cntry_admin1, {'BBB': []})
+        with self.assertRaises(ValueError) as cm:
+            country_iso_geom(['Land'], self.admin0_file)
+        self.assertIn("Possible options: ['Aland', 'Bland', 'Cland']", str(cm.exception))
+
+    def test_load_admin1_pass(self):
+        """Test _load_admin_index with admin1 records, and _fill_admin1_geom with it."""
+        index = _load_admin_index(self.admin1_file, tuple(ADMIN1_KEY))
+        self.assertEqual(index.names, {('AAA', 'North'): 0, ('AAA', 'South'): 1,
+                                       ('BBB', 'North'): 2})
+        self.assertEqual(index.codes, {'AAA-1': 0, 'AAA-2': 1, 'BBB-1': 2})
+        self.assertEqual(index.by_iso, {'AAA': [0, 1], 'BBB': [2]})
+        self.assertEqual(
+            [rec.attributes['adm1_code'] for rec in index.query(
+                shapely.geometry.box(1, 0.5, 3, 0.6))],
+            ['AAA-2', 'BBB-1'])
+
+        prov_geom = _fill_admin1_geom('AAA', index, ['South', 'North'])
+        self.assertTrue(prov_geom[0].equals(shapely.geometry.box(0, 0, 2, 1)))
+        self.assertTrue(prov_geom[1].equals(shapely.geometry.box(0, 1, 2, 2)))
+        self.assertEqual(_fill_admin1_geom('BBB', index, []), [])
+        with self.assertRaises(ValueError) as cm:
+            _fill_admin1_geom('BBB', index, ['South'])
+        self.assertIn("Possible provinces of BBB are: ['North']", str(cm.exception))
+
 class TestProvinces(unittest.TestCase):
     """Tst black marble with admin1."""
     def test_fill_admin1_geom_pass(self):
@@ -156,6 +229,27 @@ class TestProvinces(unittest.TestCase):
                             tar_geom.contains(shapely.geometry.Point([coord[1], coord[0]])))
             self.assertTrue(all_geom.contains(shapely.geometry.Point([coord[1], coord[0]])))
 
+    def test_filter_admin1_on_land_pass(self):
+        """Test _cut_admin1 keeps only land points within the admin1."""
+        lat, lon = np.mgrid[35: 44: complex(0, 100), 0: 4: complex(0, 102)]
+        nightlight = np.ones((100, 102))
+
+        coord_nl = np.array([[35, 0.09090909], [0, 0.03960396]])
+        on_land = np.ones((100, 102), bool)
+
+        admin1_rec = list(ADM1_FILE.records())
+        for rec in admin1_rec:
+            if 'Barcelona' == rec.attributes['name']:
+                bcn_geom = rec.geometry
+
+        _, lat_reg, lon_reg, all_geom, on_land_reg = _cut_admin1(
+                nightlight, lat, lon, [bcn_geom], coord_nl, on_land)
+
+        self.assertTrue(on_land_reg.any())
+        self.assertFalse(on_land_reg.all())
+        np.testing.assert_array_equal(
+            on_land_reg, shapely.contains_xy(all_geom, lon_reg, lat_reg))
+
 class TestNightLight(unittest.TestCase):
     """Test nightlight functions."""
 
@@ -198,6 +292,21 @@ class TestNightLight(unittest.TestCase):
         self.assertTrue(np.allclose(on_ref, on_land))
         self.assertTrue(np.allclose(nightlight_ref, nightlight_reg))
 
+    def test_rasterize_mask_pass(self):
+        """Test _rasterize_mask against point in polygon tests."""
+        lat = np.linspace(-10, 10, 81)
+        lon = np.linspace(20, 40, 101)
+        geom = shapely.geometry.MultiPolygon([
+            shapely.geometry.Point(25.03, 0.01).buffer(3.9),
+            shapely.geometry.Polygon([(30.01, -5.02), (38.03, -8.01), (35.02, 9.03)])])
+
+        mask = _rasterize_mask(geom, lat, lon)
+
+        lon_mesh, lat_mesh = np.meshgrid(lon, lat)
+        self.assertEqual(mask.dtype, bool)
+        np.testing.assert_array_equal(mask, shapely.contains_xy(geom, lon_mesh, lat_mesh))
+        self.assertFalse(_rasterize_mask(geom, lat + 30, lon).any())
+
     def test_cut_country_brb_2km_pass(self):
         """Test _resample_land function with fake Barbados."""
         country_iso = 'BRB'
@@ -252,6 +361,41 @@ class TestNightLight(unittest.TestCase):
         self.assertAlmostEqual(nightlight_res[0], 0.1683201638775818)
         self.assertAlmostEqual(nightlight_res[1], 0.33167983612241814)
 
+    def test_share_nightlight_pass(self):
+        """Test _share_nightlight and _load_nightlight."""
+        nightlight = sparse.random(50, 80, density=0.2, format='csr', random_state=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for nl_in in [nightlight, nightlight.toarray()]:
+                nl_out = _load_nightlight(_share_nightlight(nl_in, tmp_dir))
+                self.assertEqual(sparse.issparse(nl_out), sparse.issparse(nl_in))
+                np.testing.assert_array_equal(sparse.csr_matrix(nl_out).toarray(),
+                                              nightlight.toarray())
+                del nl_out
+
+    def test_set_countries_pool_pass(self):
+        """Test _set_countries_pool gives the same exposures as the serial loop."""
+        nightlight = sparse.random(300, 400, density=0.3, format='csr', random_state=0) * 60
+        coord_nl = np.array([[0.05, 0.1], [10.05, 0.1]])
+        cntry_info = {
+            'AAA': [1, 'Aaa', shapely.geometry.box(12, 3, 20, 10), 2016, 1e9, 3],
+            'BBB': [2, 'Bbb', shapely.geometry.Point(40, 20).buffer(8), 2016, 5e9, 4],
+        }
+        cntry_admin1 = {'AAA': [], 'BBB': [shapely.geometry.Point(38, 18).buffer(3)]}
+
+        pool = Pool(nodes=2)
+        for res_fact in [1.0, 0.5]:
+            gdf_list = _set_countries_pool(pool, cntry_info, cntry_admin1, nightlight,
+                                           coord_nl, res_fact, 1)
+            self.assertEqual(len(gdf_list), 2)
+            for (iso, info), gdf in zip(cntry_info.items(), gdf_list):
+                gdf_ref = BlackMarble._set_one_country(info, nightlight, coord_nl, res_fact,
+                                                       1, cntry_admin1[iso]).gdf
+                self.assertGreater(gdf.shape[0], 0)
+                self.assertTrue(gdf.equals(gdf_ref))
+        pool.close()
+        pool.join()
+        pool.clear()
+
 class TestEconIndices(unittest.TestCase):
     """Test functions to get economic indices."""
 
@@ -325,4 +469,5 @@ if __name__ == "__main__":
     TESTS.addTests(unittest.TestLoader().loadTestsFromTestCase(TestCountryIso))
     TESTS.addTests(unittest.TestLoader().loadTestsFromTestCase(TestNightLight))
     TESTS.addTests(unittest.TestLoader().loadTestsFromTestCase(TestProvinces))
+    TESTS.addTests(unittest.TestLoader().loadTestsFromTestCase(TestAdminIndex))
     unittest.TextTestRunner(verbosity=2).run(TESTS)
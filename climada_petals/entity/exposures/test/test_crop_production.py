@@ -63,6 +63,31 @@ class TestCropProduction(unittest.TestCase):
         self.assertEqual(exp.crop, 'mai')
         self.assertAlmostEqual(exp.gdf.value.max(), 284244.81023404596, places=5)
 
+    def test_isimip_load_hist_mean_subset(self):
+        """Test defining crop_production Exposure in a bbox covering part of the
+        hist_mean file"""
+        exp_all = cp.CropProduction.from_isimip_netcdf(input_dir=INPUT_DIR, filename=FILENAME,
+                                      hist_mean=FILENAME_MEAN, bbox=[-5, 42, 16, 55],
+                                      yearrange=np.array([2001, 2005]), scenario='flexible',
+                                      unit='t/y', crop='mai', irr='firr')
+        exp = cp.CropProduction.from_isimip_netcdf(input_dir=INPUT_DIR, filename=FILENAME,
+                                      hist_mean=FILENAME_MEAN, bbox=[0, 45, 10, 50],
+                                      yearrange=np.array([2001, 2005]), scenario='flexible',
+                                      unit='t/y', crop='mai', irr='firr')
+        self.assertEqual(exp.gdf.value.shape, (200,))
+        in_bbox = exp_all.gdf.longitude.between(0, 10) & exp_all.gdf.latitude.between(45, 50)
+        np.testing.assert_array_equal(exp.gdf.value.values, exp_all.gdf.value.values[in_bbox])
+
+    def test_coord_index(self):
+        """Test matching coordinates to the first reference point"""
+        lat_ref = np.array([0.5, 1., 0.5, 1., -0.])
+        lon_ref = np.array([2., 2., 3., 2., 3.])
+        np.testing.assert_array_equal(
+            cp._coord_index(lat_ref, lon_ref, np.array([1., 0., 0.5]), np.array([2., 3., 3.])),
+            [1, 4, 2])
+        with self.assertRaises(ValueError):
+            cp._coord_index(lat_ref, lon_ref, np.array([1.]), np.array([3.]))
+
     def test_set_value_to_usd(self):
         """Test calculating crop_production Exposure in [USD/y] (deprecated set method)"""
         exp = cp.CropProduction.from_isimip_netcdf(input_dir=INPUT_DIR, filename=FILENAME, hist_mean=FILENAME_MEAN,
@@ -194,6 +219,32 @@ class TestCropProduction(unittest.TestCase):
         self.assertListEqual(list(country_list), [0, 40, 56, 70, 191, 203, 208, 250,
                                                   276, 380, 442, 528, 616, 705, 724, 756, 826])
 
+    def test_normalize_with_fao_cp_usd(self):
+        """Test normalizing exposures and converting the normalized exposures to USD/y"""
+        exp = cp.CropProduction.from_isimip_netcdf(input_dir=INPUT_DIR, filename=FILENAME, hist_mean=FILENAME_MEAN,
+                                          bbox=[-5, 42, 16, 55], yearrange=np.array([2001, 2005]),
+                                          scenario='flexible', crop = 'mai', unit='t/y', irr='firr')
+        exp_usd = cp.value_to_usd(exp, INPUT_DIR)
+        _, ratio, exp_firr_norm, exp_noirr_norm = cp.normalize_with_fao_cp(
+            exp, exp_usd, input_dir=INPUT_DIR, yearrange=np.array([2009, 2018]), unit='t/y',
+            return_data=False)
+        _, ratio_usd, exp_firr_usd, exp_noirr_usd = cp.normalize_with_fao_cp(
+            exp, exp, input_dir=INPUT_DIR, yearrange=np.array([2009, 2018]), unit='USD/y',
+            return_data=False)
+
+        np.testing.assert_array_equal(ratio_usd, ratio)
+        self.assertEqual(exp_firr_norm.value_unit, 't/y')
+        self.assertEqual(exp_noirr_norm.value_unit, 'USD/y')
+        self.assertEqual(exp_firr_usd.value_unit, 'USD/y')
+        np.testing.assert_array_equal(exp_noirr_norm.gdf.tonnes_per_year.values,
+                                      exp_firr_norm.gdf.value.values)
+        np.testing.assert_array_equal(exp_firr_usd.gdf.value.values,
+                                      exp_noirr_norm.gdf.value.values)
+        # the given exposures are not modified
+        self.assertEqual(exp.value_unit, 't/y')
+        np.testing.assert_array_equal(exp_usd.gdf.value.values,
+                                      cp.value_to_usd(exp, INPUT_DIR).gdf.value.values)
+
 # Execute Tests
 if __name__ == "__main__":
     TESTS = unittest.TestLoader().loadTestsFromTestCase(TestCropProduction)
@@ -19,7 +19,14 @@ with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
 Test openstreetmap module.
 """
 
+import http.server
+import json
+import re
+import tempfile
+import threading
 import unittest
+from pathlib import Path
+import overpy
 import shapely
 from random import randint
 
@@ -28,6 +35,69 @@ from climada import CONFIG
 
 DATA_DIR = CONFIG.exposures.test_data.dir()
 
+OVERPASS_JSON = {
+    'version': 0.6,
+    'elements': [
+        {'type': 'node', 'id': 1, 'lat': 0.0, 'lon': 0.0},
+        {'type': 'node', 'id': 2, 'lat': 0.0, 'lon': 1.0},
+        {'type': 'node', 'id': 3, 'lat': 1.0, 'lon': 1.0},
+        {'type': 'node', 'id': 4, 'lat': 1.0, 'lon': 0.0},
+        {'type': 'node', 'id': 5, 'lat': 0.2, 'lon': 0.2},
+        {'type': 'node', 'id': 6, 'lat': 0.2, 'lon': 0.4},
+        {'type': 'node', 'id': 7, 'lat': 0.4, 'lon': 0.4},
+        {'type': 'node', 'id': 8, 'lat': 5.0, 'lon': 5.0, 'tags': {'amenity': 'cafe'}},
+        {'type': 'node', 'id': 9, 'lat': 6.0, 'lon': 5.0},
+        {'type': 'node', 'id': 30, 'lat': 7.0, 'lon': 7.0, 'tags': {'amenity': 'bank'}},
+        {'type': 'way', 'id': 10, 'nodes': [1, 2, 3, 4, 1]},
+        {'type': 'way', 'id': 11, 'nodes': [5, 6, 7, 5]},
+        {'type': 'way', 'id': 12, 'nodes': [8, 9], 'tags': {'highway': 'primary'}},
+        {'type': 'way', 'id': 13, 'nodes': [9, 3, 2, 9], 'tags': {'building': 'yes'}},
+        {'type': 'relation', 'id': 20, 'tags': {'building': 'yes'},
+         'members': [{'type': 'way', 'ref': 10, 'role': 'outer'},
+                     {'type': 'way', 'ref': 11, 'role': 'inner'}]},
+    ]}
+"""Overpass JSON response with a multipolygon relation, ways and nodes"""
+
+
+class StubOverpassHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in for the Overpass API, replying to bounding box queries with the
+    elements of OVERPASS_JSON in the bounding box (ignoring the condition)"""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Reply with the elements in the bounding box of the query"""
+        query = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.queries.append(query)
+        bbox = [float(val) for val in re.search(r'\]\(([^)]*)\)', query).group(1).split(',')]
+        response = json.dumps(stub_overpass_response(bbox)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Silence the request log"""
+
+
+def stub_overpass_response(bbox):
+    """Elements of OVERPASS_JSON with a node in the bbox (s, w, n, e), and the ways and
+    nodes they consist of, sorted by type and id as by the Overpass API"""
+    elements = {(elem['type'], elem['id']): elem for elem in OVERPASS_JSON['elements']}
+    nodes = {ident for (kind, ident), elem in elements.items() if kind == 'node'
+             and bbox[0] <= elem['lat'] <= bbox[2] and bbox[1] <= elem['lon'] <= bbox[3]}
+    ways = {ident for (kind, ident), elem in elements.items()
+            if kind == 'way' and nodes.intersection(elem['nodes'])}
+    rels = {ident for (kind, ident), elem in elements.items() if kind == 'relation'
+            and ways.intersection(member['ref'] for member in elem['members'])}
+    for rel in rels:
+        ways.update(member['ref'] for member in elements['relation', rel]['members'])
+    for way in ways:
+        nodes.update(elements['way', way]['nodes'])
+    return {'version': 0.6, 'elements': (
+        [elements['node', ident] for ident in sorted(nodes)]
+        + [elements['way', ident] for ident in sorted(ways)]
+        + [elements['relation', ident] for ident in sorted(rels)])}
+
 
 class TestOSMApiQuery(unittest.TestCase):
     """Test OSMApiQuery class"""
@@ -61,9 +131,79 @@ class TestOSMApiQuery(unittest.TestCase):
             osm_qu_py.area,
             '(poly:"47.36826 8.5327506 47.376877 8.5486078 47.39 8.5486078 47.36826 8.5327506")')
 
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubOverpassHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/api/interpreter"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.queries = []
+
     def test_insistent_osm_api_query(self):
         """test methods of OSMApiQuery" """
-        pass
+        query = osm_dl.OSMApiQuery((0, 0, 8, 8), '["building"]')
+        query_clause = query._overpass_query_string()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir, 'overpass')
+            result = query._insistent_osm_api_query(query_clause, url=self.url,
+                                                    cache_dir=cache_dir)
+            self.assertEqual(len(self.server.queries), 1)
+            self.assertEqual(self.server.queries[0], query_clause)
+            self.assertEqual(list(cache_dir.iterdir()),
+                             [query._cache_file(query_clause, cache_dir)])
+
+            # the cached response is used
+            result_cached = query._insistent_osm_api_query(query_clause, url=self.url,
+                                                           cache_dir=cache_dir)
+            self.assertEqual(len(self.server.queries), 1)
+            self.assertEqual(result_cached.node_ids, result.node_ids)
+            self.assertEqual(result_cached.way_ids, result.way_ids)
+            self.assertEqual(result_cached.relation_ids, [20])
+
+            # another query is not
+            query_clause = osm_dl.OSMApiQuery(
+                (0, 0, 8, 8), '["highway"]')._overpass_query_string()
+            query._insistent_osm_api_query(query_clause, url=self.url, cache_dir=cache_dir)
+            self.assertEqual(len(self.server.queries), 2)
+            self.assertEqual(len(list(cache_dir.iterdir())), 2)
+
+        query._insistent_osm_api_query(query_clause, url=self.url)
+        self.assertEqual(len(self.server.queries), 3)
+
+    def test_tiles(self):
+        """test methods of OSMApiQuery" """
+        query = osm_dl.OSMApiQuery((0, 10, 1, 12), '["building"]')
+        tiles = query._tiles(0.5)
+        self.assertEqual([tile.area for tile in tiles],
+                         [(0, 10, 0.5, 10.5), (0, 10.5, 0.5, 11), (0, 11, 0.5, 11.5),
+                          (0, 11.5, 0.5, 12), (0.5, 10, 1, 10.5), (0.5, 10.5, 1, 11),
+                          (0.5, 11, 1, 11.5), (0.5, 11.5, 1, 12)])
+        self.assertTrue(all(tile.condition == '["building"]' for tile in tiles))
+        self.assertEqual([tile.area for tile in query._tiles(1)],
+                         [(0, 10, 1, 11), (0, 11, 1, 12)])
+        self.assertEqual(query._tiles(2), [query])
+        self.assertEqual(query._tiles(None), [query])
+
+        area_poly = shapely.geometry.Polygon([(10, 0), (12, 1), (12, 0)])
+        query = osm_dl.OSMApiQuery.from_polygon(area_poly, '["building"]')
+        self.assertEqual(query._tiles(0.5), [query])
+
+    def test_merge_results(self):
+        """test methods of OSMApiQuery" """
+        results = [overpy.Result.from_json(stub_overpass_response(bbox))
+                   for bbox in [(4, 4, 8, 8), (0, 0, 0.5, 0.5), (0, 0, 1, 1)]]
+        self.assertEqual(results[0].way_ids, [12, 13])
+        result = osm_dl.OSMApiQuery._merge_results(results)
+        self.assertEqual(result.node_ids, [1, 2, 3, 4, 5, 6, 7, 8, 9, 30])
+        self.assertEqual(result.way_ids, [10, 11, 12, 13])
+        self.assertEqual(result.relation_ids, [20])
+        self.assertEqual([node.id for node in result.ways[3].nodes], [9, 3, 2, 9])
 
     def test_overpass_query_string(self):
         """test methods of OSMApiQuery" """
@@ -87,28 +227,104 @@ class TestOSMApiQuery(unittest.TestCase):
 
     def test_assemble_from_relations(self):
         """test methods of OSMApiQuery" """
-        pass
+        result = overpy.Result.from_json(OVERPASS_JSON)
+        query = osm_dl.OSMApiQuery((0, 0, 1, 1), '["building"]')
+        nodes_taken, ways_taken, gdf_rels = query._assemble_from_relations(result)
+
+        self.assertEqual(nodes_taken, [1, 2, 3, 4, 1, 5, 6, 7, 5])
+        self.assertEqual(ways_taken, [10, 11])
+        self.assertEqual(gdf_rels.osm_id.tolist(), [20])
+        self.assertEqual(gdf_rels.tags[0], {'building': 'yes'})
+        outer = shapely.geometry.Polygon([(0, 0), (0, 1), (1, 1), (1, 0)])
+        inner = shapely.geometry.Polygon([(0.2, 0.2), (0.2, 0.4), (0.4, 0.4)])
+        self.assertTrue(gdf_rels.geometry[0].equals(outer - inner))
+
+        # roles are matched to the member ways by reference, other members are skipped
+        response = json.loads(json.dumps(OVERPASS_JSON))
+        response['elements'][-1]['members'] = [
+            {'type': 'way', 'ref': 11, 'role': 'inner'},
+            {'type': 'node', 'ref': 30, 'role': 'label'},
+            {'type': 'way', 'ref': 10, 'role': 'outer'}]
+        nodes_taken, ways_taken, gdf_rels = query._assemble_from_relations(
+            overpy.Result.from_json(response))
+        self.assertEqual(nodes_taken, [5, 6, 7, 5, 1, 2, 3, 4, 1])
+        self.assertEqual(ways_taken, [11, 10])
+        self.assertTrue(gdf_rels.geometry[0].equals(outer - inner))
 
     def test_assemble_from_ways(self):
         """test methods of OSMApiQuery" """
-        pass
+        result = overpy.Result.from_json(OVERPASS_JSON)
+        query = osm_dl.OSMApiQuery((0, 0, 1, 1), '["building"]')
+        nodes_taken, gdf_ways = query._assemble_from_ways(result, [13, 12], True)
+
+        self.assertEqual(nodes_taken, [8, 9, 9, 3, 2, 9])
+        self.assertEqual(gdf_ways.osm_id.tolist(), [12, 13])
+        self.assertEqual(gdf_ways.tags.tolist(), [{'highway': 'primary'}, {'building': 'yes'}])
+        self.assertTrue(gdf_ways.geometry[0].equals(
+            shapely.geometry.LineString([(5, 5), (6, 5)])))
+        self.assertTrue(gdf_ways.geometry[1].equals(
+            shapely.geometry.Polygon([(6, 5), (1, 1), (0, 1)])))
+
+        _, gdf_ways = query._assemble_from_ways(result, [13], False)
+        self.assertEqual(gdf_ways.geometry[0].geom_type, 'LineString')
 
     def test_assemble_from_nodes(self):
         """test methods of OSMApiQuery" """
-        pass
+        result = overpy.Result.from_json(OVERPASS_JSON)
+        query = osm_dl.OSMApiQuery((0, 0, 1, 1), '["building"]')
+        gdf_nodes = query._assemble_from_nodes(result, [9, 8])
+
+        self.assertEqual(gdf_nodes.osm_id.tolist(), [8, 9])
+        self.assertEqual(gdf_nodes.tags.tolist(), [{'amenity': 'cafe'}, {}])
+        self.assertTrue(gdf_nodes.geometry[0].equals(shapely.geometry.Point(5, 5)))
 
     def test_update_availability(self):
         """test methods of OSMApiQuery" """
-        pass
+        query = osm_dl.OSMApiQuery((0, 0, 1, 1), '["building"]')
+        self.assertEqual(query._update_availability([4, 1, 3, 2], [1, 2, 1]), [4, 3])
+        self.assertEqual(query._update_availability([4, 1], []), [4, 1])
 
     def test_assemble_results(self):
         """test methods of OSMApiQuery" """
-        pass
+        result = overpy.Result.from_json(OVERPASS_JSON)
+        query = osm_dl.OSMApiQuery((0, 0, 1, 1), '["building"]')
+        gdf = query._assemble_results(result)
+
+        self.assertEqual(gdf.osm_id.tolist(), [20, 12, 13, 30])
+        self.assertEqual(gdf.geometry.geom_type.tolist(),
+                         ['Polygon', 'LineString', 'Polygon', 'Point'])
+        self.assertEqual(gdf.index.tolist(), [0, 1, 2, 3])
 
     def test_osm_geoms_to_gis(self):
         """test methods of OSMApiQuery" """
         pass
 
+    def test_get_data_overpass_tiles(self):
+        """test methods of OSMApiQuery"""
+        query = osm_dl.OSMApiQuery.from_bounding_box((0, 0, 8, 8), '["building"]')
+        gdf_ref = query.get_data_overpass(tile_size=None, url=self.url)
+        self.assertEqual(len(self.server.queries), 1)
+        self.assertEqual(gdf_ref.osm_id.tolist(), [20, 12, 13, 30])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gdf = query.get_data_overpass(tile_size=3, url=self.url, cache_dir=tmp_dir)
+            self.assertEqual(len(self.server.queries), 10)
+            self.assertEqual(len(list(Path(tmp_dir).iterdir())), 9)
+            self.assertEqual(gdf.osm_id.tolist(), gdf_ref.osm_id.tolist())
+            self.assertEqual(gdf.tags.tolist(), gdf_ref.tags.tolist())
+            self.assertTrue(gdf.geometry.geom_equals_exact(gdf_ref.geometry, 0).all())
+            self.assertEqual(gdf.geometry[2].bounds, (1, 0, 5, 6))
+
+            gdf = query.get_data_overpass(tile_size=3, max_workers=1, url=self.url,
+                                          cache_dir=tmp_dir)
+            self.assertEqual(len(self.server.queries), 10)
+            self.assertEqual(gdf.osm_id.tolist(), gdf_ref.osm_id.tolist())
+
+        # no tiling by default
+        gdf = query.get_data_overpass(url=self.url)
+        self.assertEqual(len(self.server.queries), 11)
+        self.assertEqual(gdf.osm_id.tolist(), gdf_ref.osm_id.tolist())
+
     def test_get_data_overpass(self):
         """test methods of OSMApiQuery"""
 
@@ -23,26 +23,30 @@ WORK IN PROGRESS
 __all__ = ['LowFlow']
 
 import logging
-import copy
 import datetime as dt
+import itertools
+import os
 from pathlib import Path
 import cftime
+import dask
 import geopandas as gpd
 import numpy as np
-import numba
 import pandas as pd
 import xarray as xr
 
 
-from sklearn.cluster import DBSCAN
 from sklearn.neighbors import BallTree
-from shapely.geometry import Point
 from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.spatial import cKDTree
 
 from climada.hazard.base import Hazard
 from climada.hazard.centroids import Centroids
 import climada.util.coordinates as u_coord
 
+from climada_petals.util.coordinates import closest_centroid
+from climada_petals.util.memory import available_memory_gb
+
 LOGGER = logging.getLogger(__name__)
 
 HAZ_TYPE = 'LF'
@@ -78,6 +82,9 @@ REFERENCE_YEARRANGE = (1971, 2005)
 TARGET_YEARRANGE = (2001, 2005)
 """arbitrary default, i.e. default year range of historical low flow hazard 2001-2005"""
 
+ORDINAL_1970_01_01 = dt.date(1970, 1, 1).toordinal()
+"""proleptic Gregorian ordinal of the numpy datetime64 epoch"""
+
 BBOX = (-180, -85, 180, 85)
 """default quasi-global geographical bounding box: [lon_min, lat_min, lon_max, lat_max]"""
 
@@ -86,9 +93,10 @@ BBOX_WIDTH = 75
 """default width and height of geographical bounding boxes for loop in degree lat/lon.
 i.e., the bounding box is split into square boxes with maximum size BBOX_WIDTH*BBOX_WIDTH
 (avoid memory usage spike)"""
-INTENSITY_STEP = 300
-"""max. number of events to be written to hazard.intensity matrix at once
-(avoid memory usage spike)"""
+DASK_MEMORY_FACTOR = 4
+"""estimated number of copies of a block of daily discharge data held in memory while its
+percentile and mean are computed (input, data without negative values, partitioned copy in
+nanpercentile, temporary arrays of the mean)"""
 
 
 class LowFlow(Hazard):
@@ -150,7 +158,8 @@ class LowFlow(Hazard):
                     yearrange_ref=REFERENCE_YEARRANGE, gh_model=None, cl_model=None,
                     scenario='historical', scenario_ref='historical', soc='histsoc',
                     soc_ref='histsoc', fn_str_var=FN_STR_VAR, keep_dis_data=False,
-                    yearchunks='default', mask_threshold=('mean', 1)):
+                    yearchunks='default', mask_threshold=('mean', 1), use_dask=False,
+                    max_memory_gb=None, pool=None):
         """Wrapper to fill hazard from NetCDF file containing variable dis (daily),
         e.g. as provided from from ISIMIP Water Sectior (Global):
         https://esg.pik-potsdam.de/search/isimip/
@@ -235,6 +244,17 @@ class LowFlow(Hazard):
             values below 0.3 are ignored. default: ('mean', 1}). Set to None for
             no threshold.
             Provide a list of tuples for multiple thresholds.
+        use_dask : boolean
+            compute the threshold grid from lazily opened dask arrays in a single pass over
+            the reference files, with spatial chunks sized according to max_memory_gb,
+            instead of looping over geographical bounding boxes. The computation runs on
+            the active dask scheduler, e.g. within `rf_glofas.dask_client`
+            for a local distributed cluster. Results are identical. Default: False
+        max_memory_gb : float
+            memory budget in GB for the chunks processed at the same time if use_dask is
+            True. Default: None (the available physical memory)
+        pool : pathos.pool, optional
+            pool used to search the closest centroids of the data points in parallel
 
         Raises
         ------
@@ -263,11 +283,12 @@ class LowFlow(Hazard):
             centr_handling = 'full_hazard'
 
         # read data and call preprocessing routine:
-        haz = cls()
+        haz = cls(pool)
         haz.lowflow_df, centroids_import = data_preprocessing_percentile(
             percentile, yearrange, yearrange_ref, input_dir, gh_model, cl_model,
             scenario, scenario_ref, soc, soc_ref, fn_str_var, bbox, min_days_per_month,
-            keep_dis_data, yearchunks, mask_threshold)
+            keep_dis_data, yearchunks, mask_threshold, use_dask=use_dask,
+            max_memory_gb=max_memory_gb)
 
         if centr_handling == 'full_hazard':
             centroids = centroids_import
@@ -309,6 +330,10 @@ class LowFlow(Hazard):
         data have the same coordinates, take the sum of days below threshold
         of these points (duration as accumulated intensity).
 
+        The closest centroid of each distinct (lat, lon) point is searched once for all
+        events, in parallel if self.pool is set, and the days below threshold of all
+        events are summed at once.
+
         Parameters
         ----------
         uniq_ev : list of str
@@ -322,29 +347,37 @@ class LowFlow(Hazard):
 
         Returns
         -------
-        intensity_mat : sparse.lilmatrix
+        intensity_mat : sparse.csr_matrix
             intensity values as sparse matrix
         """
+        lat_lon_uni, point = np.unique(self.lowflow_df[['lat', 'lon']].values,
+                                       return_inverse=True, axis=0)
         tree_centr = BallTree(coord, metric='chebyshev')
-        # steps: list of steps to be written to intensity matrix at once:
-        steps = list(np.arange(0, len(uniq_ev) - 1, INTENSITY_STEP)) + [len(uniq_ev)]
-        if len(steps) == 1:
-            intensity_list = [self._intensity_one_cluster(tree_centr, cl_id, res_centr, num_centr)
-                              for cl_id in uniq_ev]
-            return sparse.csr_matrix(intensity_list)
-        # step_range: list of tuples containing the unique IDs to be written to
-        # the intensity matrix in one step
-        step_range = [tuple(uniq_ev[stp:steps[idx+1]]) for idx, stp in enumerate(steps[0:-1])]
-        for idx, stp in enumerate(step_range):
-            intensity_list = []
-            for cl_id in stp:
-                intensity_list.append(
-                    self._intensity_one_cluster(tree_centr, cl_id, res_centr, num_centr))
-            if not idx:
-                intensity_mat = sparse.lil_matrix(intensity_list)
-            else:
-                intensity_mat = sparse.vstack((intensity_mat,
-                                               sparse.csr_matrix(intensity_list)))
+        if self.pool:
+            lat_lon_chunks = np.array_split(
+                lat_lon_uni, max(min(lat_lon_uni.shape[0], self.pool.ncpus), 1))
+            ind = np.concatenate(self.pool.map(
+                closest_centroid, itertools.repeat(tree_centr, len(lat_lon_chunks)),
+                lat_lon_chunks, itertools.repeat(res_centr, len(lat_lon_chunks))))
+        else:
+            ind = closest_centroid(tree_centr, lat_lon_uni, res_centr)
+
+        # sum of days below threshold per event and distinct point:
+        ev_point, ev_point_inv = np.unique(
+            np.searchsorted(uniq_ev, self.lowflow_df['cluster_id'].values)
+            * lat_lon_uni.shape[0] + point.reshape(-1), return_inverse=True)
+        ndays = np.bincount(ev_point_inv.reshape(-1), weights=self.lowflow_df['ndays'].values)
+        ev_row, point = np.divmod(ev_point, lat_lon_uni.shape[0])
+        ind = ind[point]
+        in_centr = ind >= 0
+        ev_row, ind, ndays = ev_row[in_centr], ind[in_centr], ndays[in_centr]
+        # if several points of an event are mapped on the same centroid, the last one
+        # (in (lat, lon) order) is kept:
+        _, last = np.unique((ev_row * num_centr + ind)[::-1], return_index=True)
+        last = ev_row.size - 1 - last
+        intensity_mat = sparse.csr_matrix((ndays[last], (ev_row[last], ind[last])),
+                                          shape=(uniq_ev.size, num_centr))
+        intensity_mat.eliminate_zeros()
         return intensity_mat
 
     def _set_dates(self, uniq_ev):
@@ -356,17 +389,14 @@ class LowFlow(Hazard):
         uniq_ev : list
             list of unique cluster IDs
         """
-        self.date = np.zeros(uniq_ev.size, int)
-        self.date_start = np.zeros(uniq_ev.size, int)
-        self.date_end = np.zeros(uniq_ev.size, int)
-        for ev_idx, ev_id in enumerate(uniq_ev):
-            # set event date to date of maximum intensity (ndays)
-            self.date[ev_idx] = self.lowflow_df[self.lowflow_df.cluster_id == ev_id]\
-                .groupby('dtime')['ndays'].sum().idxmax()
-            self.date_start[ev_idx] = self.lowflow_df[self.lowflow_df.cluster_id == ev_id]\
-                .dtime.min()
-            self.date_end[ev_idx] = self.lowflow_df[self.lowflow_df.cluster_id == ev_id]\
-                .dtime.max()
+        ndays_per_date = self.lowflow_df.groupby(['cluster_id', 'dtime'])['ndays'].sum()
+        ndays_per_date = ndays_per_date.reset_index()
+        per_event = ndays_per_date.groupby('cluster_id')
+        # set event date to date of maximum intensity (ndays)
+        self.date = ndays_per_date['dtime'].values[
+            per_event['ndays'].idxmax().reindex(uniq_ev).values].astype(int)
+        self.date_start = per_event['dtime'].min().reindex(uniq_ev).values.astype(int)
+        self.date_end = per_event['dtime'].max().reindex(uniq_ev).values.astype(int)
 
     def events_from_clusters(self, centroids):
         """Initiate hazard events from connected clusters found in self.lowflow_df
@@ -474,8 +504,9 @@ class LowFlow(Hazard):
         clus_id_var = 'c_%s_%s' % (cluster_vars[0], cluster_vars[1])
         lowflow_df[clus_id_var] = np.zeros(len(lowflow_df), dtype=int) - 1
 
-        data_iter = lowflow_df[lowflow_df['iter_ev']][[iter_var, cluster_vars[0], cluster_vars[1],
-                                                       'cons_id', clus_id_var]]
+        data_iter = lowflow_df[lowflow_df['iter_ev']][[iter_var, cluster_vars[0], cluster_vars[1]]]
+        if data_iter.empty:
+            return lowflow_df
 
         if 'dt_month' in clus_id_var:
             # transform month count in accordance with spatial resolution
@@ -483,17 +514,10 @@ class LowFlow(Hazard):
             # neighboring points:
             data_iter.dt_month = data_iter.dt_month * res_data * clus_thresh_xy / clus_thres_t
 
-        # Loop over slices: For each slice, perform 2D clustering with DBSCAN
-        for i_var in data_iter[iter_var].unique():
-            temp = np.argwhere(np.array(data_iter[iter_var] == i_var)).reshape(-1, )  # slice
-            x_y = data_iter.iloc[temp][[cluster_vars[0], cluster_vars[1]]].values
-            x_y_uni, x_y_cpy = np.unique(x_y, return_inverse=True, axis=0)
-            cluster_id = DBSCAN(eps=res_data * clus_thresh_xy, min_samples=min_samples). \
-                fit(x_y_uni).labels_
-            cluster_id = cluster_id[x_y_cpy]
-            data_iter[clus_id_var].values[temp] = cluster_id + data_iter[clus_id_var].max() + 1
-
-        lowflow_df[clus_id_var].values[lowflow_df['iter_ev'].values] = data_iter[clus_id_var].values
+        # 2D clustering (DBSCAN) of all slices at once, slices numbered in order of appearance:
+        lowflow_df[clus_id_var].values[lowflow_df['iter_ev'].values] = _dbscan_slices(
+            data_iter[[cluster_vars[0], cluster_vars[1]]].values,
+            pd.factorize(data_iter[iter_var])[0], res_data * clus_thresh_xy, min_samples)
         return lowflow_df
 
     def filter_events(self, min_intensity=1, min_number_cells=1):
@@ -510,18 +534,25 @@ class LowFlow(Hazard):
         Returns
         -------
         Hazard
+            hazard with the remaining events, numbered from 1. Attributes that are not
+            defined per event (e.g. centroids) are shared with this hazard, not copied.
         """
-        haz_tmp = copy.deepcopy(self)
-        haz_tmp.orig_tmp = copy.deepcopy(self.orig)
-        haz_tmp.orig = np.array(np.ones(self.orig.size))
-        # identify events to be filtered out and set haz_tmp.orig to 0.
-        for i_event, _ in enumerate(haz_tmp.event_id):
-            if np.sum(haz_tmp.intensity[i_event] > 0) < min_number_cells or \
-                    np.max(haz_tmp.intensity[i_event]) < min_intensity:
-                haz_tmp.orig[i_event] = 0.
-        haz_tmp = haz_tmp.select(orig=True)  # select events with orig == 1
-        haz_tmp.orig = haz_tmp.orig_tmp  # reset orig
-        del haz_tmp.orig_tmp
+        intensity = self.intensity.tocsr()
+        sel_ev = np.flatnonzero(
+            (np.asarray((intensity > 0).sum(axis=1)).reshape(-1) >= min_number_cells)
+            & (intensity.max(axis=1).toarray().reshape(-1) >= min_intensity))
+
+        # select the attributes of the events to be kept, as in Hazard.select:
+        haz_tmp = self.__class__()
+        for var_name, var_val in self.__dict__.items():
+            if isinstance(var_val, np.ndarray) and var_val.ndim == 1 and var_val.size > 0:
+                setattr(haz_tmp, var_name, var_val[sel_ev])
+            elif isinstance(var_val, sparse.csr_matrix):
+                setattr(haz_tmp, var_name, var_val[sel_ev])
+            elif isinstance(var_val, list) and var_val:
+                setattr(haz_tmp, var_name, [var_val[idx] for idx in sel_ev])
+            else:
+                setattr(haz_tmp, var_name, var_val)
         haz_tmp.event_id = np.arange(1, len(haz_tmp.event_id) + 1).astype(int)
         return haz_tmp
 
@@ -544,80 +575,6 @@ class LowFlow(Hazard):
             return (res_centr[0] + res_centr[1]) / 2
         return res_centr[0]
 
-    def _intensity_one_cluster(self, tree_centr, cluster_id, res_centr, num_centr):
-        """For a given cluster, fill in an intensity np.array with the summed intensity
-        at each centroid.
-
-        Parameters
-        ----------
-        cluster_id : int
-            id of the selected cluster
-        tree_centr : object
-            BallTree instance created from centroids' coordinates
-        res_centr : float
-            resolution of centroids in degree
-        num_centr : int
-            number of centroids
-
-        Returns
-        -------
-        intensity_cl : np.array
-            summed intensity of cluster at each centroids
-        """
-        LOGGER.debug('Number of days below threshold corresponding to event %s.', str(cluster_id))
-        temp_data = self.lowflow_df.reindex(
-            index=np.argwhere(np.array(self.lowflow_df['cluster_id'] == cluster_id)).reshape(-1),
-            columns=['lat', 'lon', 'ndays'])
-        # Identifies the unique (lat,lon) points of the lowflow_df dataframe -> lat_lon_uni
-        # Set the same index value for each duplicate (lat,lon) points -> lat_lon_cpy
-        lat_lon_uni, lat_lon_cpy = np.unique(temp_data[['lat', 'lon']].values,
-                                             return_inverse=True, axis=0)
-        index_uni = np.unique(lat_lon_cpy, axis=0)
-        # Search closest centroid for each point
-        ind, _ = tree_centr.query_radius(lat_lon_uni, r=res_centr / 2, count_only=False,
-                                         return_distance=True, sort_results=True)
-        ind = np.array([ind_i[0] if ind_i.size else -1 for ind_i in ind])
-        intensity_cl = _fill_intensity(num_centr, ind, index_uni, lat_lon_cpy,
-                                       temp_data['ndays'].values)
-        return intensity_cl
-
-    @staticmethod
-    def _intensity_one_cluster_pool(lowflow_df, tree_centr, cluster_id, res_centr, num_centr):
-        """For a given cluster, fill in an intensity np.array with the summed intensity
-        at each centroid. Version for self.pool = True
-
-        Parameters
-        ----------
-        lowflow_df : DataFrame
-        tree_centr : object
-            BallTree instance created from centroids' coordinates
-        cluster_id : int
-            id of the selected cluster
-        res_centr : float
-            resolution of centroids in degree
-        num_centr : int
-            number of centroids
-
-        Returns
-        -------
-        intensity_cl : np.array
-            summed intensity of cluster at each centroids
-        """
-        LOGGER.debug('Number of days below threshold corresponding to event %s.', str(cluster_id))
-        temp_data = lowflow_df.reindex(
-            index=np.argwhere(np.array(lowflow_df['cluster_id'] == cluster_id)).reshape(-1),
-            columns=['lat', 'lon', 'ndays'])
-
-        lat_lon_uni, lat_lon_cpy = np.unique(temp_data[['lat', 'lon']].values,
-                                             return_inverse=True, axis=0)
-        index_uni = np.unique(lat_lon_cpy, axis=0)
-        ind, _ = tree_centr.query_radius(lat_lon_uni, r=res_centr / 2, count_only=False,
-                                         return_distance=True, sort_results=True)
-        ind = np.array([ind_i[0] if ind_i.size else -1 for ind_i in ind])
-        intensity_cl = _fill_intensity(num_centr, ind, index_uni, lat_lon_cpy,
-                                       temp_data['ndays'].values)
-        return intensity_cl
-
 
 def _init_centroids(dis_xarray, centr_res_factor=1):
     """Get centroids from the firms dataset and refactor them.
@@ -650,6 +607,12 @@ def unique_clusters(lowflow_df):
     """identify unqiue clustes based on clusters in 3 dimensions and set unique
     cluster_id
 
+    Data points sharing a 2D cluster in any of the planes (lat, lon), (lat, dt_month) and
+    (lon, dt_month) belong to the same 3D cluster, i.e., the 3D clusters are the connected
+    components of the graph linking data points and 2D clusters. Clusters are numbered in
+    order of appearance of their first data point with a (lat, lon) cluster. Data points
+    outside of a (lat, dt_month) or (lon, dt_month) cluster are not assigned (-1).
+
     Parameters
     ----------
     lowflow_df : pandas.DataFrame
@@ -660,43 +623,33 @@ def unique_clusters(lowflow_df):
     lowflow_df : pandas.DataFrame
         As input with new values in column cluster_id
     """
-    lowflow_df.cluster_id = np.zeros(len(lowflow_df.c_lat_lon)) - 1
-
     lowflow_df.loc[lowflow_df.c_lat_lon == -1, 'c_lat_lon'] = np.nan
     lowflow_df.loc[lowflow_df.c_lat_dt_month == -1, 'c_lat_dt_month'] = np.nan
     lowflow_df.loc[lowflow_df.c_lon_dt_month == -1, 'c_lon_dt_month'] = np.nan
 
-    idc = 0  # event id counter
-    current = 0
-    for c_lat_lon in lowflow_df.c_lat_lon.unique():
-        if np.isnan(c_lat_lon):
-            lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon, 'cluster_id'] = -1
-        else:
-            if len(lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon,
-                                  'cluster_id'].unique()) == 1 \
-                    and -1 in lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon,
-                                             'cluster_id'].unique():
-                idc += 1
-                current = idc
-            else:
-                current = max(lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon,
-                                             'cluster_id'].unique())
-            lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon, 'cluster_id'] = current
-
-            for c_lat_dt_month in lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon,
-                                                 'c_lat_dt_month'].unique():
-                if not np.isnan(c_lat_dt_month):
-                    lowflow_df.loc[lowflow_df.c_lat_dt_month == c_lat_dt_month,
-                                   'cluster_id'] = current
-            for c_lon_dt_month in lowflow_df.loc[lowflow_df.c_lat_lon == c_lat_lon,
-                                                 'c_lon_dt_month'].unique():
-                if not np.isnan(c_lon_dt_month):
-                    lowflow_df.loc[lowflow_df.c_lon_dt_month == c_lon_dt_month,
-                                   'cluster_id'] = current
-
-    lowflow_df.loc[np.isnan(lowflow_df.c_lon_dt_month), 'cluster_id'] = -1
-    lowflow_df.loc[np.isnan(lowflow_df.c_lat_dt_month), 'cluster_id'] = -1
-    lowflow_df.cluster_id = lowflow_df.cluster_id.astype(int)
+    # bipartite graph of data points (first nodes) and 2D clusters (following nodes):
+    n_points = len(lowflow_df)
+    n_nodes = n_points
+    points, clusters = [], []
+    for clus_id_var in ['c_lat_lon', 'c_lat_dt_month', 'c_lon_dt_month']:
+        codes = pd.factorize(lowflow_df[clus_id_var])[0]
+        if clus_id_var == 'c_lat_lon':
+            in_lat_lon = codes >= 0
+        points.append(np.flatnonzero(codes >= 0))
+        clusters.append(codes[codes >= 0] + n_nodes)
+        n_nodes += codes.max(initial=-1) + 1
+    points, clusters = np.concatenate(points), np.concatenate(clusters)
+    graph = sparse.csr_matrix((np.ones(points.size), (points, clusters)),
+                              shape=(n_nodes, n_nodes))
+    component = csgraph.connected_components(graph, directed=False)[1][:n_points]
+
+    uni_comp, first_point = np.unique(component[in_lat_lon], return_index=True)
+    cluster_id = np.zeros(component.max(initial=-1) + 1, dtype=int) - 1
+    cluster_id[uni_comp[np.argsort(first_point)]] = np.arange(1, uni_comp.size + 1)
+    cluster_id = cluster_id[component]
+    cluster_id[np.isnan(lowflow_df.c_lat_dt_month.values.astype(float))
+               | np.isnan(lowflow_df.c_lon_dt_month.values.astype(float))] = -1
+    lowflow_df.cluster_id = cluster_id
     return lowflow_df
 
 
@@ -704,7 +657,7 @@ def data_preprocessing_percentile(percentile, yearrange, yearrange_ref,
                                   input_dir, gh_model, cl_model, scenario,
                                   scenario_ref, soc, soc_ref, fn_str_var, bbox,
                                   min_days_per_month, keep_dis_data, yearchunks,
-                                  mask_threshold):
+                                  mask_threshold, use_dask=False, max_memory_gb=None):
     """load data and reference data and calculate monthly percentiles
     then extract intensity based on days below threshold
     returns geopandas dataframe
@@ -728,7 +681,9 @@ def data_preprocessing_percentile(percentile, yearrange, yearrange_ref,
                                                        fn_str_var, bbox,
                                                        yearchunks,
                                                        mask_threshold=mask_threshold,
-                                                       keep_dis_data=keep_dis_data)
+                                                       keep_dis_data=keep_dis_data,
+                                                       use_dask=use_dask,
+                                                       max_memory_gb=max_memory_gb)
     first_file = True
     if yearchunks == 'default':
         yearchunks = YEARCHUNKS[scenario]
@@ -769,30 +724,52 @@ def _read_and_combine_nc(yearrange, input_dir, gh_model, cl_model, scenario,
     dis_xarray : xarray
     """
     first_file = True
+    for filepath in _nc_filepaths(yearrange, input_dir, gh_model, cl_model, scenario,
+                                  soc, fn_str_var, yearchunks):
+        if first_file:
+            dis_xarray = _read_single_nc(filepath, yearrange, bbox)
+            first_file = False
+        else:
+            dis_xarray = dis_xarray.combine_first(_read_single_nc(filepath, yearrange, bbox))
+
+    # set negative discharge values to zero (debugging of input data):
+    dis_xarray.dis.values[dis_xarray.dis.values < 0] = 0
+    return dis_xarray
+
+
+def _nc_filepaths(yearrange, input_dir, gh_model, cl_model, scenario, soc, fn_str_var,
+                  yearchunks):
+    """Paths of the nc files of the year chunks overlapping with the year range
+
+    Parameters
+    ----------
+    c.f. parameters in LowFlow.set_from_nc()
+
+    Raises
+    ------
+    FileNotFoundError
+
+    Returns
+    -------
+    filepaths : list of pathlib.Path
+    """
     if yearchunks == 'default':
         yearchunks = YEARCHUNKS[scenario]
+    if scenario == 'hist':
+        bias_corr = 'nobc'
+    else:
+        bias_corr = 'ewembi'
+    filepaths = []
     for yearchunk in yearchunks:
         # skip if file is not required, i.e., not in yearrange:
         if int(yearchunk[0:4]) > yearrange[1] or int(yearchunk[-4:]) < yearrange[0]:
             continue
-        if scenario == 'hist':
-            bias_corr = 'nobc'
-        else:
-            bias_corr = 'ewembi'
-
         filepath = Path(input_dir,
                 f'{gh_model}_{cl_model}_{bias_corr}_{scenario}_{soc}_{fn_str_var}_{yearchunk}.nc')
         if not filepath.is_file():
             raise FileNotFoundError(f'Netcdf file not found: {filepath}')
-        if first_file:
-            dis_xarray = _read_single_nc(filepath, yearrange, bbox)
-            first_file = False
-        else:
-            dis_xarray = dis_xarray.combine_first(_read_single_nc(filepath, yearrange, bbox))
-
-    # set negative discharge values to zero (debugging of input data):
-    dis_xarray.dis.values[dis_xarray.dis.values < 0] = 0
-    return dis_xarray
+        filepaths.append(filepath)
+    return filepaths
 
 
 def _read_single_nc(filename, yearrange, bbox):
@@ -896,7 +873,8 @@ def _split_bbox(bbox, width=BBOX_WIDTH):
 
 def _compute_threshold_grid(percentile, yearrange_ref, input_dir, gh_model, cl_model,
                             scenario, soc, fn_str_var, bbox, yearchunks,
-                            mask_threshold=None, keep_dis_data=False):
+                            mask_threshold=None, keep_dis_data=False, use_dask=False,
+                            max_memory_gb=None):
     """given model run and year range specification, this function
     returns the x-th percentile for every pixel over a given
     time horizon (based on daily data) [all-year round percentiles!],
@@ -908,6 +886,11 @@ def _compute_threshold_grid(percentile, yearrange_ref, input_dir, gh_model, cl_m
     mask_threshold : tuple or list
         Threshold(s) of below which the
         grid is masked out. e.g. ('mean', 1.)
+    use_dask : boolean
+        compute the grids in one pass over the files with dask instead of looping
+        over geographical bounding boxes, c.f. _reduce_nc_dask
+    max_memory_gb : float
+        memory budget in GB if use_dask is True
 
     Returns
     -------
@@ -920,26 +903,33 @@ def _compute_threshold_grid(percentile, yearrange_ref, input_dir, gh_model, cl_m
                 percentile, yearrange_ref[0], yearrange_ref[1])
     if isinstance(mask_threshold, tuple):
         mask_threshold = [mask_threshold]
-    bbox = _split_bbox(bbox)
-    p_grid_list = []
-    mean_grid_list = []
-    # loop over coordinate bounding boxes to save memory:
-    for box in bbox:
-        dis_xarray = _read_and_combine_nc(yearrange_ref, input_dir, gh_model, cl_model,
-                                          scenario, soc, fn_str_var, box, yearchunks)
-        if dis_xarray.dis.data.size:  # only if data is not empty
-            p_grid_list += [_xarray_reduce(dis_xarray, fun='p', percentile=percentile)]
-            # only compute mean_grid if required by user or mask_threshold:
-            if keep_dis_data or (mask_threshold and True in ['mean' in x for x in mask_threshold]):
-                mean_grid_list += [_xarray_reduce(dis_xarray, fun='mean')]
-    del dis_xarray
-
-    p_grid = xr.combine_by_coords(p_grid_list)
-    del p_grid_list
-
-    if mean_grid_list:
-        mean_grid = xr.combine_by_coords(mean_grid_list)
-    del mean_grid_list
+    # only compute mean_grid if required by user or mask_threshold:
+    compute_mean = keep_dis_data or (mask_threshold
+                                     and True in ['mean' in x for x in mask_threshold])
+    if use_dask:
+        p_grid, mean_grid = _reduce_nc_dask(percentile, yearrange_ref, input_dir, gh_model,
+                                            cl_model, scenario, soc, fn_str_var, bbox,
+                                            yearchunks, compute_mean, max_memory_gb)
+    else:
+        bbox = _split_bbox(bbox)
+        p_grid_list = []
+        mean_grid_list = []
+        # loop over coordinate bounding boxes to save memory:
+        for box in bbox:
+            dis_xarray = _read_and_combine_nc(yearrange_ref, input_dir, gh_model, cl_model,
+                                              scenario, soc, fn_str_var, box, yearchunks)
+            if dis_xarray.dis.data.size:  # only if data is not empty
+                p_grid_list += [_xarray_reduce(dis_xarray, fun='p', percentile=percentile)]
+                if compute_mean:
+                    mean_grid_list += [_xarray_reduce(dis_xarray, fun='mean')]
+        del dis_xarray
+
+        p_grid = xr.combine_by_coords(p_grid_list)
+        del p_grid_list
+
+        if mean_grid_list:
+            mean_grid = xr.combine_by_coords(mean_grid_list)
+        del mean_grid_list
 
     if isinstance(mask_threshold, list):
         for crit in mask_threshold:
@@ -954,6 +944,90 @@ def _compute_threshold_grid(percentile, yearrange_ref, input_dir, gh_model, cl_m
     return p_grid, None
 
 
+def _reduce_nc_dask(percentile, yearrange_ref, input_dir, gh_model, cl_model, scenario,
+                    soc, fn_str_var, bbox, yearchunks, compute_mean, max_memory_gb=None):
+    """Compute percentile and mean grids in a single pass over the nc files with dask
+
+    The files are opened lazily and split into chunks covering the whole time axis and as
+    many grid cells as fit into the memory budget (c.f. _threshold_chunks). Each chunk is
+    read once and reduced with the same functions as in the loop over bounding boxes, so
+    that the results are identical. The computation runs on the active dask scheduler,
+    i.e., on a distributed cluster if a dask.distributed.Client is active.
+
+    Parameters
+    ----------
+    c.f. parameters in LowFlow.set_from_nc()
+    compute_mean : boolean
+        whether to compute the mean grid
+    max_memory_gb : float, optional
+        memory budget in GB for the chunks processed at the same time.
+        Default: None (the available physical memory)
+
+    Returns
+    -------
+    p_grid : xarray.Dataset
+        grid with dis of given percentile (1-timestep)
+    mean_grid : xarray.Dataset or None
+        grid with mean(dis) if compute_mean
+    """
+    dis_list = [_read_single_nc(filepath, yearrange_ref, bbox if bbox else BBOX)
+                for filepath in _nc_filepaths(yearrange_ref, input_dir, gh_model, cl_model,
+                                              scenario, soc, fn_str_var, yearchunks)]
+    if not dis_list or not dis_list[0].dis.size:
+        return xr.Dataset(), None
+    chunks = _threshold_chunks(sum(dis.sizes['time'] for dis in dis_list),
+                               dis_list[0].sizes['lat'], dis_list[0].sizes['lon'],
+                               dis_list[0].dis.dtype.itemsize, max_memory_gb)
+    dis_xarray = xr.concat([dis.chunk(chunks) for dis in dis_list], dim='time',
+                           join='outer').chunk(chunks)
+    if not dis_xarray.indexes['time'].is_monotonic_increasing:
+        dis_xarray = dis_xarray.sortby('time').chunk(chunks)
+    LOGGER.info('Reducing %i x %i grid cells in chunks of %i x %i with dask',
+                dis_xarray.sizes['lat'], dis_xarray.sizes['lon'], chunks['lat'], chunks['lon'])
+
+    # set negative discharge values to zero (debugging of input data):
+    dis_xarray['dis'] = dis_xarray.dis.where(~(dis_xarray.dis < 0), 0)
+    template = dis_xarray.isel(time=0, drop=True)
+    p_grid = dis_xarray.map_blocks(_xarray_reduce, kwargs=dict(fun='p', percentile=percentile),
+                                   template=template)
+    if not compute_mean:
+        return p_grid.compute(), None
+    mean_grid = dis_xarray.map_blocks(_xarray_reduce, kwargs=dict(fun='mean'),
+                                      template=template)
+    # computed together, every chunk of input data is read only once:
+    return dask.compute(p_grid, mean_grid)
+
+
+def _threshold_chunks(n_time, n_lat, n_lon, itemsize, max_memory_gb=None):
+    """Chunk sizes for the dask computation of the threshold grid
+
+    Chunks cover the whole time axis and a square-shaped area of grid cells, such that the
+    chunks processed at the same time by the local dask workers fit into the memory budget.
+
+    Parameters
+    ----------
+    n_time, n_lat, n_lon : int
+        number of time steps, latitudes and longitudes
+    itemsize : int
+        size of a single value in bytes
+    max_memory_gb : float, optional
+        memory budget in GB. Default: None (the available physical memory)
+
+    Returns
+    -------
+    chunks : dict
+        chunk sizes for the dimensions time, lat and lon
+    """
+    if max_memory_gb is None:
+        max_memory_gb = available_memory_gb()
+    n_workers = dask.config.get('num_workers', None) or os.cpu_count() or 1
+    chunk_bytes = max_memory_gb * 1e9 / n_workers / DASK_MEMORY_FACTOR
+    n_cells = max(1, int(chunk_bytes / (n_time * itemsize)))
+    lat_chunk = int(min(n_lat, max(1, np.sqrt(n_cells))))
+    lon_chunk = int(min(n_lon, max(1, n_cells // lat_chunk)))
+    return dict(time=-1, lat=lat_chunk, lon=lon_chunk)
+
+
 def _days_below_threshold_per_month(dis_xarray, threshold_grid, mean_ref,
                                     min_days_per_month, keep_dis_data):
     """returns sum of days below threshold per month (as xarray with monthly data)
@@ -1004,40 +1078,74 @@ def _xarray_to_geopandas(dis_xarray):
     lowflow_df : GeoDataFrame
     """
 
-    dataf = dis_xarray.to_dataframe()
-    dataf.reset_index(inplace=True)
-    dataf = dataf.dropna()
+    # only the data points without NaN values are converted, the index of the rows is the
+    # flat index in the grid, as with dis_xarray.to_dataframe().reset_index().dropna():
+    dims = list(dis_xarray.dims)
+    values = {var: dis_xarray[var].transpose(*dims).values for var in dis_xarray.data_vars}
+    valid = np.logical_and.reduce([pd.notna(val) for val in values.values()])
+    index = np.flatnonzero(valid)
+    dataf = pd.DataFrame({dim: dis_xarray[dim].values[idx] for dim, idx
+                          in zip(dims, np.unravel_index(index, valid.shape))}, index=index)
+    for var, val in values.items():
+        dataf[var] = val[valid]
     dataf['iter_ev'] = np.ones(len(dataf), bool)
     dataf['cons_id'] = np.zeros(len(dataf), int) - 1
-    dataf['dtime'] = dataf['time'].apply(lambda x: x.toordinal())
-    dataf['dt_month'] = dataf['time'].apply(lambda x: x.year * 12 + x.month)
-    return gpd.GeoDataFrame(dataf, geometry=[Point(x, y) for x, y in zip(dataf['lon'],
-                                                                         dataf['lat'])])
+    # proleptic Gregorian ordinal as in datetime.toordinal, from the days since 1970-01-01:
+    dataf['dtime'] = (dataf['time'].values.astype('datetime64[D]').astype(np.int64)
+                      + ORDINAL_1970_01_01)
+    dataf['dt_month'] = (dataf['time'].dt.year * 12 + dataf['time'].dt.month).astype(np.int64)
+    return gpd.GeoDataFrame(dataf, geometry=gpd.points_from_xy(dataf['lon'], dataf['lat']))
+
 
+def _dbscan_slices(points, slice_id, eps, min_samples):
+    """DBSCAN clustering of 2D points in independent slices
 
-@numba.njit
-def _fill_intensity(num_centr, ind, index_uni, lat_lon_cpy, intensity_raw):
-    """fill intensity list for a single cluster
+    Equivalent to a separate sklearn.cluster.DBSCAN of every slice with the points in
+    lexicographic order, with cluster labels offset by the number of clusters in the
+    previous slices. Neighbors within eps are found with a single KD-tree for all slices and
+    the clusters of core points are the connected components of the neighbor graph.
 
     Parameters
     ----------
-    num_centr : int
-        total number of centroids
-    ind : list
-        list of centroid indices  in cluster
-    lat_lon_cpy : array of int
-        index according to (lat, lon) in intensity_raw
-    intensity_raw : array of int
-        array of ndays values at each data point in cluster
+    points : np.array
+        2D coordinates of the points, shape (npoints, 2)
+    slice_id : np.array of int
+        consecutive slice number of each point, starting from 0
+    eps : float
+        maximum distance between neighboring points
+    min_samples : int
+        minimum number of neighbors (including the point itself) of a core point
 
     Returns
     -------
-    list with summed ndays (=intensity) per geographical point (lat, lon)
+    labels : np.array of int
+        cluster label of each point, -1 for noise
     """
-
-    intensity_cl = np.zeros((1, num_centr), dtype=numba.float64)
-    for idx in range(index_uni.size):
-        if ind[idx] != -1:
-            intensity_cl[0, ind[idx]] = \
-                np.sum(intensity_raw[lat_lon_cpy == index_uni[idx]])
-    return intensity_cl[0]
+    npoints = points.shape[0]
+    # points of different slices are further apart than eps in a third dimension:
+    pairs = cKDTree(np.column_stack([points, slice_id * (2 * eps + 1)])).query_pairs(
+        eps, output_type='ndarray')
+    core = np.bincount(pairs.ravel(), minlength=npoints) + 1 >= min_samples
+    core_pairs = pairs[core[pairs[:, 0]] & core[pairs[:, 1]]]
+    graph = sparse.csr_matrix((np.ones(core_pairs.shape[0]), (core_pairs[:, 0], core_pairs[:, 1])),
+                              shape=(npoints, npoints))
+    component = csgraph.connected_components(graph, directed=False)[1]
+
+    # DBSCAN labels clusters in order of their first core point:
+    rank = np.empty(npoints, dtype=int)
+    rank[np.lexsort((points[:, 1], points[:, 0], slice_id))] = np.arange(npoints)
+    first_rank = np.full(npoints, npoints)
+    np.minimum.at(first_rank, component[core], rank[core])
+    uni_comp = np.flatnonzero(first_rank < npoints)
+    comp_label = np.zeros(npoints, dtype=int) - 1
+    comp_label[uni_comp[np.argsort(first_rank[uni_comp])]] = np.arange(uni_comp.size)
+    labels = np.where(core, comp_label[component], -1)
+
+    # border points join the first cluster of a neighboring core point:
+    border_pairs = np.concatenate([pairs[core[pairs[:, 0]] & ~core[pairs[:, 1]]],
+                                   pairs[~core[pairs[:, 0]] & core[pairs[:, 1]]][:, ::-1]])
+    border_label = np.full(npoints, npoints)
+    np.minimum.at(border_label, border_pairs[:, 1], labels[border_pairs[:, 0]])
+    border = ~core & (border_label < npoints)
+    labels[border] = border_label[border]
+    return labels
@@ -25,13 +25,15 @@ __all__ = ['RelativeCropyield']
 import logging
 from pathlib import Path
 import copy
+import hashlib
+import json
+import os
 
 import numpy as np
 from matplotlib import pyplot as plt
 import cartopy
 import shapely.geometry
 from scipy import sparse
-import scipy.stats
 import h5py
 import xarray as xr
 
@@ -40,6 +42,7 @@ from climada.util import dates_times as dt
 from climada.util import coordinates as coord
 from climada import CONFIG
 
+from climada_petals.util.memory import available_memory_gb
 
 LOGGER = logging.getLogger(__name__)
 
@@ -80,6 +83,13 @@ YEARCHUNKS = {'ISIMIP2a': {'yearrange': (1980, 1999), 'startyear': 1980, 'endyea
 FN_STR_VAR = 'global_annual'
 """filename of ISIMIP output constant part"""
 
+MANIFEST_DIR = 'Manifest'
+"""subdirectory of the output directory with the manifest of the generated hazard sets"""
+
+TASK_MEMORY_FACTOR = 6
+"""approximate number of (years x centroids) float64 arrays held in memory per hazard file
+task in set_multiple_rc_from_isimip"""
+
 
 class RelativeCropyield(Hazard):
     """Agricultural climate risk: Relative Cropyield (relative to historical mean);
@@ -409,42 +419,74 @@ class RelativeCropyield(Hazard):
         return fig
 
 
-def rel_yield_to_int(haz_cy, hist_mean):
+def rel_yield_to_int(haz_cy, hist_mean, chunk_size=None):
     """Return hazard with relative yield (yearly yield / historic mean) as intensity
 
+    The relative yield is computed from the stored values of the sparse intensity matrix,
+    all other events at centroids with a historic mean have a relative yield of -1.
+
     Parameters
     ----------
     haz_cy : RelativeCropyield
         RelativeCropyield hazard instance with abs. yield as intensity.
     hist_mean : np.array
         historic mean per centroid
+    chunk_size : int, optional
+        number of events processed at once. Default: None (all events at once)
 
     Returns
     -------
     RelativeCropyield
         Hazard with modified intensity [unitless]
     """
+    intensity = sparse.csr_matrix(haz_cy.intensity)
+    hist_mean = np.asarray(hist_mean)
+    nevents = intensity.shape[0]
+    if chunk_size is None:
+        chunk_size = max(nevents, 1)
+
     # determine idx of the centroids with a mean yield !=0
     [idx] = np.where(hist_mean != 0)
-
-    # initialize new hazard_matrix
-    hazard_matrix = np.zeros(haz_cy.intensity.shape, dtype=np.float32)
-
-    # compute relative yield for each event:
-    for event in range(len(haz_cy.event_id)):
-        hazard_matrix[event, idx] = (haz_cy.intensity[event, idx].todense() / hist_mean[idx]) - 1
-
-    new_haz = copy.deepcopy(haz_cy)
-    new_haz.intensity = sparse.csr_matrix(hazard_matrix)
+    # position of each centroid within idx, -1 for centroids with a mean yield == 0:
+    idx_pos = np.full(intensity.shape[1], -1)
+    idx_pos[idx] = np.arange(idx.size)
+    # relative yield of events without stored intensity:
+    rel_yield_zero = (np.zeros(1, dtype=intensity.dtype) / hist_mean[idx] - 1).astype(np.float32)
+
+    # all centroids in idx are stored for each event, with the relative yield of the stored
+    # intensity values (computed in chunks of events) or of zero intensity:
+    data = np.empty(nevents * idx.size, dtype=np.float32)
+    for start in range(0, nevents, chunk_size):
+        chunk = intensity[start:start + chunk_size]
+        chunk_data = data[start * idx.size:(start + chunk.shape[0]) * idx.size]
+        chunk_data.reshape(chunk.shape[0], idx.size)[:] = rel_yield_zero
+        row = np.repeat(np.arange(chunk.shape[0]), np.diff(chunk.indptr))
+        pos = idx_pos[chunk.indices]
+        in_idx = pos >= 0
+        chunk_data[row[in_idx] * idx.size + pos[in_idx]] = \
+            chunk.data[in_idx] / hist_mean[chunk.indices[in_idx]] - 1
+    index_dtype = np.int32 if data.size <= np.iinfo(np.int32).max else np.int64
+    rel_yield = sparse.csr_matrix(
+        (data, np.tile(idx.astype(index_dtype), nevents),
+         np.arange(nevents + 1, dtype=index_dtype) * idx.size), shape=intensity.shape)
+    rel_yield.eliminate_zeros()
+
+    # intensity is replaced, no need to copy it:
+    new_haz = copy.deepcopy(haz_cy, memo={id(haz_cy.intensity): None})
+    new_haz.intensity = rel_yield
     new_haz.intensity_def = 'Relative Yield'
     new_haz.units = ''
 
     return new_haz
 
 
-def percentile_to_int(haz_cy, reference_intensity=None):
+def percentile_to_int(haz_cy, reference_intensity=None, chunk_size=None):
     """returns RC hazard with percentile as intensity.
 
+    The percentile of each event at a centroid is its percentile rank among the reference
+    events at this centroid, as in scipy.stats.percentileofscore (kind='rank'), and is
+    computed from the sorted events of all centroids at once.
+
     Parameters
     ----------
     haz_cy : RelativeCropyield
@@ -452,38 +494,109 @@ def percentile_to_int(haz_cy, reference_intensity=None):
     reference_intensity : AD
         intensity to be used as reference
         (e.g. the historic intensity can be used in order to be able
-        to directly compare historic and future projection data)
+        to directly compare historic and future projection data).
+        It must have the same centroids as haz_cy, but can have other events.
+        Default: None (intensity of haz_cy)
+    chunk_size : int, optional
+        number of centroids processed at once, to limit the memory usage for large
+        grids with many events. Default: None (all centroids at once)
 
     Returns
     -------
     RelativeCropyield
         hazard with modified intensity
-    """
 
-    hazard_matrix = np.zeros(haz_cy.intensity.shape)
-    if reference_intensity is None:
-        reference_intensity = haz_cy.intensity
-
-    for centroid in range(haz_cy.intensity.shape[1]):
-        nevents = reference_intensity.shape[0]
-        array = reference_intensity[:, centroid].toarray().reshape(nevents)
-        hazard_matrix[:, centroid] = np.array([scipy.stats.percentileofscore(array, event)
-                                               for event in array])/100
+    Raises
+    ------
+    ValueError
+        if the reference intensity and haz_cy do not have the same number of centroids
+    """
+    intensity = sparse.csc_matrix(haz_cy.intensity)
+    if reference_intensity is not None:
+        reference_intensity = sparse.csc_matrix(reference_intensity)
+        if reference_intensity.shape[1] != intensity.shape[1]:
+            raise ValueError(f"The reference intensity has {reference_intensity.shape[1]} "
+                             f"centroids, the hazard {intensity.shape[1]}.")
+    ncentroids = intensity.shape[1]
+    if chunk_size is None:
+        chunk_size = max(ncentroids, 1)
+
+    hazard_matrix = sparse.hstack([
+        sparse.csc_matrix(_percentile_rank(
+            intensity[:, start:start + chunk_size].toarray(),
+            None if reference_intensity is None
+            else reference_intensity[:, start:start + chunk_size].toarray()))
+        for start in range(0, max(ncentroids, 1), chunk_size)], format='csr')
     new_haz = copy.deepcopy(haz_cy)
-    new_haz.intensity = sparse.csr_matrix(hazard_matrix)
+    new_haz.intensity = hazard_matrix
     new_haz.intensity_def = 'Percentile'
     new_haz.units = ''
 
     return new_haz
 
 
+def _percentile_rank(values, reference=None):
+    """Percentile rank (as a fraction) of each value among the reference values of its
+    column, as scipy.stats.percentileofscore(reference_column, value, kind='rank') / 100.
+    Values are NaN if they are NaN or if their reference column contains NaN values.
+
+    Parameters
+    ----------
+    values : np.array
+        2D array of values
+    reference : np.array, optional
+        2D array of reference values with the same number of columns as values.
+        Default: None (values)
+
+    Returns
+    -------
+    np.array
+        percentile rank of each value
+    """
+    if reference is None:
+        reference = values
+    nref = reference.shape[0]
+    # sort the values together with the reference values, the latter first among equal ones
+    combined = np.concatenate([reference, values], axis=0)
+    order = np.argsort(combined, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(combined, order, axis=0)
+    is_ref = order < nref
+    # number of reference values up to each position (inclusive):
+    ref_count = np.cumsum(is_ref, axis=0)
+    first_equal = np.ones(combined.shape, dtype=bool)
+    first_equal[1:] = sorted_values[1:] != sorted_values[:-1]
+    last_equal = np.ones(combined.shape, dtype=bool)
+    last_equal[:-1] = first_equal[1:]
+    # number of smaller reference values, and of smaller or equal reference values:
+    n_less = np.maximum.accumulate(np.where(first_equal, ref_count - is_ref, 0), axis=0)
+    n_less_equal = np.minimum.accumulate(
+        np.where(last_equal, ref_count, nref)[::-1], axis=0)[::-1]
+    plus1 = n_less_equal > n_less
+    percentile = np.empty(combined.shape)
+    np.put_along_axis(percentile, order,
+                      (n_less + n_less_equal + plus1) * (50.0 / nref) / 100, axis=0)
+    percentile = percentile[nref:]
+    percentile[np.isnan(values)] = np.nan
+    percentile[:, np.isnan(reference).any(axis=0)] = np.nan
+    return percentile
+
+
 def set_multiple_rc_from_isimip(input_dir=None, output_dir=None, bbox=None,
                                 isimip_run=None, yearrange_his=None, yearrange_mean=None,
-                                return_data=False, save=True, combine_subcrops=True):
+                                return_data=False, save=True, combine_subcrops=True,
+                                pool=None, max_memory_gb=None, skip_existing=True):
 
     """Wrapper to generate full hazard set from all ISIMIP-NetCDF files with
     crop yield in a given input directory and save it to output directory.
 
+    Each input file is processed in a separate task, in parallel if a pool is given: first the
+    historical files, then the future files (which require the historical mean of the
+    corresponding historical file). The hazard sets are written by the tasks and recorded in a
+    manifest in the subdirectory MANIFEST_DIR of output_dir, together with the content hash of
+    the output files and a hash of the input files (path, size and modification time) and
+    parameters. Outputs that are up to date according to the manifest are not computed again,
+    e.g., when an interrupted run is restarted.
+
     Parameters
     ----------
     input_dir : pathlib.Path or str
@@ -509,6 +622,14 @@ def set_multiple_rc_from_isimip(input_dir=None, output_dir=None, bbox=None,
         save output data to output_dir
     combine_subcrops : boolean
         combine crops: ric=ri1+ri2, whe=swh+wwh
+    pool : pathos.pool, optional
+        Pool that will be used for parallel computation of the hazard sets. Default: None
+    max_memory_gb : float, optional
+        memory budget in GB that limits the number of tasks running in parallel if a pool is
+        given. Default: None (the available physical memory)
+    skip_existing : boolean, optional
+        skip the hazard sets that are up to date according to the manifest. Only applies if
+        save is True and return_data is False. Default: True
 
     Returns
     -------
@@ -540,6 +661,8 @@ def set_multiple_rc_from_isimip(input_dir=None, output_dir=None, bbox=None,
     # generate output directories if they do not exist yet
     Path(output_dir, 'Hazard').mkdir(parents=True, exist_ok=True)
     Path(output_dir, 'Hist_mean').mkdir(parents=True, exist_ok=True)
+    if save:
+        Path(output_dir, MANIFEST_DIR).mkdir(parents=True, exist_ok=True)
 
     filename_list = list()
     output_list = list()
@@ -560,89 +683,95 @@ def set_multiple_rc_from_isimip(input_dir=None, output_dir=None, bbox=None,
         yearrange_mean = YEARCHUNKS['ISIMIP2a']['yearrange_mean']
         # (1980, 1999)
 
+    skip_existing = skip_existing and save and not return_data
+    manifest = _read_manifest(output_dir) if save else dict()
+    ncentroids = next(iter(hist_mean_per_crop.values()))['value'].shape[1]
+    task_output_dir = output_dir if save else None
+    bbox_params = tuple(float(coord) for coord in bbox)
+
+    # historical hazards and historical mean per file:
+    his_results = dict()
+    his_tasks = list()
+    for his_file in his_file_list:
+        filename = _his_haz_filename(his_file, file_props)
+        mean_filename = f'hist_mean_{Path(filename).stem}.npz'
+        inputs_hash = _inputs_hash(
+            input_dir, _task_input_files(his_file, file_props[his_file], input_dir),
+            (bbox_params, file_props[his_file]['startyear'], file_props[his_file]['endyear'],
+             tuple(int(year) for year in yearrange_mean)))
+        outputs = [Path('Hazard', filename), Path(MANIFEST_DIR, mean_filename)]
+        if skip_existing and _is_up_to_date(output_dir, manifest, outputs, inputs_hash):
+            LOGGER.info('Skipping %s, the output is up to date.', filename)
+            with np.load(Path(output_dir, MANIFEST_DIR, mean_filename)) as mean_file:
+                his_results[his_file] = {'filename': filename, 'haz': None,
+                                         **{key: mean_file[key]
+                                            for key in ['hist_mean', 'lat', 'lon']}}
+        else:
+            his_tasks.append((his_file, inputs_hash, outputs))
+    n_years = [file_props[his_file]['endyear'] - file_props[his_file]['startyear'] + 1
+               for his_file, _, _ in his_tasks]
+    task_results = _run_tasks(
+        _his_haz_task,
+        [(his_file, file_props, input_dir, bbox, yearrange_mean, task_output_dir,
+          return_data) for his_file, _, _ in his_tasks],
+        pool, _max_parallel_tasks(pool, ncentroids, max(n_years, default=1), max_memory_gb))
+    for (his_file, inputs_hash, outputs), result in zip(his_tasks, task_results):
+        his_results[his_file] = result
+        if save:
+            np.savez(Path(output_dir, outputs[1]), hist_mean=result['hist_mean'],
+                     lat=result['lat'], lon=result['lon'])
+            _record_outputs(output_dir, manifest, outputs, inputs_hash)
+
+    # future hazards with the historical mean of the corresponding historical file:
+    fut_results = dict()
+    fut_tasks = list()
+    if isimip_run in ('ISIMIP2b', 'ISIMIP3b'):
+        for his_file in his_file_list:
+            hist_mean_hash = hashlib.sha1(
+                np.ascontiguousarray(his_results[his_file]['hist_mean']).tobytes()).hexdigest()
+            for scenario, fut_file in _fut_files_isimip(his_file, file_props, scenario_list,
+                                                        input_dir):
+                yearrange_fut = _fut_yearrange(fut_file, scenario)
+                filename = _fut_haz_filename(his_file, scenario, file_props, yearrange_fut)
+                inputs_hash = _inputs_hash(
+                    input_dir, _task_input_files(fut_file, file_props[his_file], input_dir),
+                    (bbox_params, yearrange_fut, hist_mean_hash))
+                outputs = [Path('Hazard', filename)]
+                if skip_existing and _is_up_to_date(output_dir, manifest, outputs, inputs_hash):
+                    LOGGER.info('Skipping %s, the output is up to date.', filename)
+                    fut_results[fut_file] = {'filename': filename, 'haz': None}
+                else:
+                    fut_tasks.append((his_file, scenario, fut_file, yearrange_fut, inputs_hash,
+                                      outputs))
+    n_years = [yearrange_fut[1] - yearrange_fut[0] + 1 for _, _, _, yearrange_fut, _, _
+               in fut_tasks]
+    task_results = _run_tasks(
+        _fut_haz_task,
+        [(his_file, scenario, file_props, his_results[his_file]['hist_mean'], input_dir, bbox,
+          fut_file, task_output_dir, return_data)
+         for his_file, scenario, fut_file, _, _, _ in fut_tasks],
+        pool, _max_parallel_tasks(pool, ncentroids, max(n_years, default=1), max_memory_gb))
+    for (_, _, fut_file, _, inputs_hash, outputs), result in zip(fut_tasks, task_results):
+        fut_results[fut_file] = result
+        if save:
+            _record_outputs(output_dir, manifest, outputs, inputs_hash)
+
     for his_file in his_file_list:
-        haz_his, filename, hist_mean = calc_his_haz_isimip(his_file, file_props,
-                                                           input_dir=input_dir, bbox=bbox,
-                                                           yearrange_mean=yearrange_mean)
         # save the historical mean depending on the crop-irrigation combination
         # the idx keeps track of the row in which the hist_mean values are written per crop-irr to
         # ensure that all files are assigned to the corresponding crop-irr combination
         hist_mean_per_crop[file_props[his_file]['combi_crop_irr']]['value'][
-            hist_mean_per_crop[file_props[his_file]['combi_crop_irr']]['idx'], :] = hist_mean
+            hist_mean_per_crop[file_props[his_file]['combi_crop_irr']]['idx'], :] = \
+            his_results[his_file]['hist_mean']
         hist_mean_per_crop[file_props[his_file]['combi_crop_irr']]['idx'] += 1
 
-        filename_list.append(filename)
-        if return_data:
-            output_list.append(haz_his)
-        else: output_list.append(None)
-        if save:
-            haz_his.select(reg_id=1).write_hdf5(str(Path(output_dir, 'Hazard', filename)))
-
+        filename_list.append(his_results[his_file]['filename'])
+        output_list.append(his_results[his_file]['haz'])
         if isimip_run in ('ISIMIP2b', 'ISIMIP3b'):
-            # compute the relative yield for all future scenarios with the corresponding
-            # historic mean
-            for scenario in scenario_list: # loop over all scenarios except historical
-                # check whether future file exists for given historical file and scenario:
-                haz_fut = None
-                filename = None
-                fut_file = '{}_{}_{}_{}_{}_{}_yield-{}-{}_{}_{}_{}.nc'.format(
-                    file_props[his_file]['ag_model'],
-                    file_props[his_file]['cl_model'],
-                    file_props[his_file]['bias_corr'],
-                    scenario,
-                    file_props[his_file]['soc'],
-                    file_props[his_file]['co2'],
-                    file_props[his_file]['crop'],
-                    file_props[his_file]['irr'],
-                    FN_STR_VAR,
-                    YEARCHUNKS[scenario]['startyear'],
-                    YEARCHUNKS[scenario]['endyear']
-                )
-
-                if Path(input_dir, fut_file).is_file():
-                    # if true, calculate and save future hazard set:
-                    haz_fut, filename = calc_fut_haz_isimip(his_file, scenario,
-                                                            file_props, hist_mean,
-                                                            input_dir=input_dir,
-                                                            bbox=bbox,
-                                                            fut_file=fut_file)
-                    filename_list.append(filename)
-                    if save:
-                        haz_fut.select(reg_id=1)\
-                            .write_hdf5(str(Path(output_dir, 'Hazard', filename)))
-                    if return_data:
-                        output_list.append(haz_fut)
-                    else: output_list.append(None)
-
-                if scenario == 'rcp26': # also test for extended
-                    # check whether future file exists for given historical file and scenario:
-                    fut_file = '{}_{}_{}_{}_{}_{}_yield-{}-{}_{}_{}_{}.nc'.format(
-                        file_props[his_file]['ag_model'],
-                        file_props[his_file]['cl_model'],
-                        file_props[his_file]['bias_corr'],
-                        scenario,
-                        file_props[his_file]['soc'],
-                        file_props[his_file]['co2'],
-                        file_props[his_file]['crop'],
-                        file_props[his_file]['irr'],
-                        FN_STR_VAR,
-                        YEARCHUNKS['rcp26-2']['startyear'],
-                        YEARCHUNKS['rcp26-2']['endyear']
-                    )
-
-                    if Path(input_dir, fut_file).is_file():
-                        # if true, calculate and save future hazard set:
-                        haz_fut, filename = calc_fut_haz_isimip(his_file, scenario,
-                                                                file_props, hist_mean,
-                                                                input_dir=input_dir,
-                                                                bbox=bbox, fut_file=fut_file)
-                        filename_list.append(filename)
-                        if save:
-                            haz_fut.select(reg_id=1)\
-                                .write_hdf5(str(Path(output_dir, 'Hazard', filename)))
-                        if return_data:
-                            output_list.append(haz_fut)
-                        else: output_list.append(None)
+            for _, fut_file in _fut_files_isimip(his_file, file_props, scenario_list,
+                                                 input_dir):
+                filename_list.append(fut_results[fut_file]['filename'])
+                output_list.append(fut_results[fut_file]['haz'])
 
     # calculate mean hist_mean for each crop-irrigation combination and save as hdf5
     # in output_dir (required for full exposure set preparation):
@@ -658,12 +787,198 @@ def set_multiple_rc_from_isimip(input_dir=None, output_dir=None, bbox=None,
             if 'hist_mean_' in filename:
                 mean_file = h5py.File(str(Path(output_dir, 'Hist_mean', filename)), 'w')
                 mean_file.create_dataset('mean', data=output_list[idx])
-                mean_file.create_dataset('lat', data=haz_his.centroids.lat)
-                mean_file.create_dataset('lon', data=haz_his.centroids.lon)
+                mean_file.create_dataset('lat', data=his_results[his_file_list[-1]]['lat'])
+                mean_file.create_dataset('lon', data=his_results[his_file_list[-1]]['lon'])
                 mean_file.close()
 
     return filename_list, output_list
 
+def _his_haz_task(his_file, file_props, input_dir, bbox, yearrange_mean, output_dir,
+                  return_data):
+    """Compute the historical hazard of one input file, see calc_his_haz_isimip, and write it
+    to output_dir/Hazard unless output_dir is None
+
+    Returns
+    -------
+    dict
+        the filename of the hazard, the hazard if return_data is True (None otherwise), and
+        the historical mean with its latitudes and longitudes
+    """
+    haz_his, filename, hist_mean = calc_his_haz_isimip(his_file, file_props,
+                                                       input_dir=input_dir, bbox=bbox,
+                                                       yearrange_mean=yearrange_mean)
+    if output_dir is not None:
+        haz_his.select(reg_id=1).write_hdf5(str(Path(output_dir, 'Hazard', filename)))
+    return {'filename': filename, 'haz': haz_his if return_data else None,
+            'hist_mean': hist_mean, 'lat': haz_his.centroids.lat, 'lon': haz_his.centroids.lon}
+
+def _fut_haz_task(his_file, scenario, file_props, hist_mean, input_dir, bbox, fut_file,
+                  output_dir, return_data):
+    """Compute the future hazard of one input file, see calc_fut_haz_isimip, and write it
+    to output_dir/Hazard unless output_dir is None
+
+    Returns
+    -------
+    dict
+        the filename of the hazard, and the hazard if return_data is True (None otherwise)
+    """
+    haz_fut, filename = calc_fut_haz_isimip(his_file, scenario, file_props, hist_mean,
+                                            input_dir=input_dir, bbox=bbox, fut_file=fut_file)
+    if output_dir is not None:
+        haz_fut.select(reg_id=1).write_hdf5(str(Path(output_dir, 'Hazard', filename)))
+    return {'filename': filename, 'haz': haz_fut if return_data else None}
+
+def _run_tasks(func, task_args, pool=None, n_parallel=1):
+    """Apply func to the arguments of each task, in parallel if a pool is given
+
+    Parameters
+    ----------
+    func : function
+        function to apply
+    task_args : list of tuple
+        positional arguments of func for each task
+    pool : pathos.pool, optional
+        Pool used to run the tasks. Default: None
+    n_parallel : int, optional
+        maximum number of tasks running in parallel. Default: 1
+
+    Returns
+    -------
+    generator
+        results of the tasks, in the order of task_args
+    """
+    if pool is None:
+        for args in task_args:
+            yield func(*args)
+        return
+    for start in range(0, len(task_args), n_parallel):
+        yield from pool.map(func, *zip(*task_args[start:start + n_parallel]))
+
+def _max_parallel_tasks(pool, ncentroids, n_years, max_memory_gb=None):
+    """Number of hazard file tasks that can run in parallel within the memory budget
+
+    Parameters
+    ----------
+    pool : pathos.pool or None
+        pool used to run the tasks
+    ncentroids : int
+        number of centroids of the hazard sets
+    n_years : int
+        maximum number of years (events) of the hazard sets
+    max_memory_gb : float, optional
+        memory budget in GB. Default: None (the available physical memory)
+
+    Returns
+    -------
+    int
+    """
+    if pool is None:
+        return 1
+    if max_memory_gb is None:
+        max_memory_gb = available_memory_gb()
+    task_bytes = TASK_MEMORY_FACTOR * ncentroids * n_years * np.dtype(np.float64).itemsize
+    n_parallel = int(max(1, min(pool.ncpus, max_memory_gb * 1e9 // max(task_bytes, 1))))
+    if n_parallel < pool.ncpus:
+        LOGGER.info('Running %s hazard set tasks in parallel due to the memory budget of '
+                    '%.1f GB.', n_parallel, max_memory_gb)
+    return n_parallel
+
+def _fut_files_isimip(his_file, file_props, scenario_list, input_dir):
+    """Future input files that exist in input_dir for a historical input file
+
+    Returns
+    -------
+    list of tuple
+        scenario and file name of each future input file
+    """
+    fut_files = list()
+    for scenario in scenario_list: # loop over all scenarios except historical
+        # also test for extended rcp26:
+        yearchunks = [scenario, 'rcp26-2'] if scenario == 'rcp26' else [scenario]
+        for yearchunk in yearchunks:
+            fut_file = '{}_{}_{}_{}_{}_{}_yield-{}-{}_{}_{}_{}.nc'.format(
+                file_props[his_file]['ag_model'],
+                file_props[his_file]['cl_model'],
+                file_props[his_file]['bias_corr'],
+                scenario,
+                file_props[his_file]['soc'],
+                file_props[his_file]['co2'],
+                file_props[his_file]['crop'],
+                file_props[his_file]['irr'],
+                FN_STR_VAR,
+                YEARCHUNKS[yearchunk]['startyear'],
+                YEARCHUNKS[yearchunk]['endyear']
+            )
+            if Path(input_dir, fut_file).is_file():
+                fut_files.append((scenario, fut_file))
+    return fut_files
+
+def _task_input_files(filename, props, input_dir):
+    """Input files read to compute the hazard of an input file: the file itself, the file of
+    the other subcrop and the wheat mask if the subcrops are combined"""
+    crop = props['crop']
+    input_files = [filename]
+    if crop != props['combi_crop'] and crop in ('swh', 'ri1'):
+        other_crop = 'wwh' if crop == 'swh' else 'ri2'
+        filename2 = filename.replace(f'_yield-{crop}-', f'_yield-{other_crop}-')
+        if Path(input_dir, filename2).is_file():
+            input_files.append(filename2)
+            if crop == 'swh':
+                input_files.append(CONFIG.hazard.relative_cropyield.filename_wheat_mask.str())
+    return input_files
+
+def _inputs_hash(input_dir, input_files, params):
+    """Hash identifying the input files (path, size and modification time) and parameters of
+    a hazard set"""
+    sha = hashlib.sha1()
+    for input_file in input_files:
+        path = Path(input_dir, input_file).resolve()
+        path_stat = path.stat()
+        sha.update(f"{path}:{path_stat.st_size}:{path_stat.st_mtime_ns}".encode())
+    sha.update(repr(params).encode())
+    return sha.hexdigest()
+
+def _file_hash(path):
+    """Hash of the content of a file"""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _read_manifest(output_dir):
+    """Read the manifest of the hazard sets in output_dir, empty if there is none"""
+    path = Path(output_dir, MANIFEST_DIR, 'manifest.json')
+    if not path.is_file():
+        return dict()
+    with path.open() as file:
+        return json.load(file)
+
+def _is_up_to_date(output_dir, manifest, outputs, inputs_hash):
+    """Whether all outputs (paths relative to output_dir) are recorded in the manifest with
+    the given inputs hash, and their content did not change since"""
+    for output in outputs:
+        entry = manifest.get(Path(output).as_posix())
+        path = Path(output_dir, output)
+        if (entry is None or entry['inputs'] != inputs_hash or not path.is_file()
+                or entry['content'] != _file_hash(path)):
+            return False
+    return True
+
+def _record_outputs(output_dir, manifest, outputs, inputs_hash):
+    """Record outputs (paths relative to output_dir) in the manifest and write it"""
+    for output in outputs:
+        manifest[Path(output).as_posix()] = {
+            'inputs': inputs_hash, 'content': _file_hash(Path(output_dir, output))}
+    path = Path(output_dir, MANIFEST_DIR, 'manifest.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, so that an interrupted run never leaves an incomplete
+    # manifest
+    path_tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with path_tmp.open('w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path_tmp, path)
+
 def init_hazard_sets_isimip(filenames, input_dir=None, bbox=None, isimip_run=None,
                             yearrange_his=None, combine_subcrops=True):
     """Initialize full hazard set.
@@ -868,13 +1183,10 @@ def calc_his_haz_isimip(his_file, file_props, input_dir=None, bbox=None,
             if crop == 'swh':
             # mask of winter wheat in spring wheat and vice versa:
                 whe_mask = read_wheat_mask_isimip3(input_dir=input_dir, bbox=bbox)
-                haz_his.intensity = sparse.csr_matrix(np.multiply(haz_his.intensity.todense(),
-                                                                  whe_mask.swh_mask.values.flatten()
-                                                                  )
-                                                      )
-                haz_his2.intensity = sparse.csr_matrix(
-                    np.multiply(haz_his2.intensity.todense(), whe_mask.wwh_mask.values.flatten()
-                                ))
+                haz_his.intensity = _mask_intensity(haz_his.intensity,
+                                                    whe_mask.swh_mask.values.flatten())
+                haz_his2.intensity = _mask_intensity(haz_his2.intensity,
+                                                     whe_mask.wwh_mask.values.flatten())
             # replace NaN by 0.0:
             haz_his.intensity.data[np.isnan(haz_his.intensity.data)] = 0.0
             haz_his2.intensity.data[np.isnan(haz_his2.intensity.data)] = 0.0
@@ -886,6 +1198,10 @@ def calc_his_haz_isimip(his_file, file_props, input_dir=None, bbox=None,
     hist_mean = haz_his.calc_mean(yearrange_mean)
     haz_his.set_rel_yield_to_int(hist_mean)
 
+    return haz_his, _his_haz_filename(his_file, file_props), hist_mean
+
+def _his_haz_filename(his_file, file_props):
+    """Name to save the historical hazard of a historical input hazard file"""
     crop_irr = file_props[his_file]['combi_crop_irr']
     if file_props[his_file]['scenario'] == 'ISIMIP2a':
         filename = ('haz' + '_' + file_props[his_file]['ag_model'] + '_' +
@@ -899,8 +1215,7 @@ def calc_his_haz_isimip(his_file, file_props, input_dir=None, bbox=None,
                     '_' + file_props[his_file]['soc'] + '_' + file_props[his_file]['co2'] +
                     '_' + crop_irr + '_' + str(file_props[his_file]['startyear']) + '-' +
                     str(file_props[his_file]['endyear']) + '.hdf5')
-
-    return haz_his, filename, hist_mean
+    return filename
 
 def calc_fut_haz_isimip(his_file, scenario, file_props, hist_mean, input_dir=None,
                         bbox=None, fut_file=None, yearrange_fut=None):
@@ -941,13 +1256,7 @@ def calc_fut_haz_isimip(his_file, scenario, file_props, hist_mean, input_dir=Non
     if bbox is None:
         bbox = BBOX
     if yearrange_fut is None:
-        if isinstance(fut_file, str) and (len(fut_file.split('_')[-2]) == 4):
-            yearrange_fut = (int(fut_file.split('_')[-2]),
-                             int(fut_file.split('_')[-1].split('.')[0])
-                             )
-        else: # define yearrange from defaults if not specified by user or filename:
-            yearrange_fut = (YEARCHUNKS[scenario]['startyear'],
-                             YEARCHUNKS[scenario]['endyear'])
+        yearrange_fut = _fut_yearrange(fut_file, scenario)
 
     haz_fut = RelativeCropyield()
     haz_fut.set_from_isimip_netcdf(input_dir=input_dir, filename=fut_file,
@@ -987,13 +1296,10 @@ def calc_fut_haz_isimip(his_file, scenario, file_props, hist_mean, input_dir=Non
             if crop == 'swh':
             # mask of winter wheat in spring wheat and vice versa:
                 whe_mask = read_wheat_mask_isimip3(input_dir=input_dir, bbox=bbox)
-                haz_fut.intensity = sparse.csr_matrix(np.multiply(haz_fut.intensity.todense(),
-                                                                  whe_mask.swh_mask.values.flatten()
-                                                                  )
-                                                      )
-                haz_fut2.intensity = sparse.csr_matrix(
-                    np.multiply(haz_fut2.intensity.todense(), whe_mask.wwh_mask.values.flatten()
-                                ))
+                haz_fut.intensity = _mask_intensity(haz_fut.intensity,
+                                                    whe_mask.swh_mask.values.flatten())
+                haz_fut2.intensity = _mask_intensity(haz_fut2.intensity,
+                                                     whe_mask.wwh_mask.values.flatten())
             # replace NaN by 0.0:
             haz_fut.intensity.data[np.isnan(haz_fut.intensity.data)] = 0.0
             haz_fut2.intensity.data[np.isnan(haz_fut2.intensity.data)] = 0.0
@@ -1002,12 +1308,43 @@ def calc_fut_haz_isimip(his_file, scenario, file_props, hist_mean, input_dir=Non
             haz_fut.crop = file_props[his_file]['combi_crop']
 
     haz_fut.set_rel_yield_to_int(hist_mean) # set intensity to relative yield
-    filename = ('haz' + '_' + file_props[his_file]['ag_model'] + '_' +
-                file_props[his_file]['cl_model'] + '_' + scenario + '_' +
-                file_props[his_file]['soc'] + '_' + file_props[his_file]['co2'] +
-                '_' + file_props[his_file]['combi_crop'] + '-' + file_props[his_file]['irr']+ '_' +
-                str(yearrange_fut[0]) + '-' + str(yearrange_fut[1]) + '.hdf5')
-    return haz_fut, filename
+    return haz_fut, _fut_haz_filename(his_file, scenario, file_props, yearrange_fut)
+
+def _fut_yearrange(fut_file, scenario):
+    """Year range of a future input hazard file, from its name or YEARCHUNKS"""
+    if isinstance(fut_file, str) and (len(fut_file.split('_')[-2]) == 4):
+        return (int(fut_file.split('_')[-2]),
+                int(fut_file.split('_')[-1].split('.')[0])
+                )
+    # define yearrange from defaults if not specified by user or filename:
+    return (YEARCHUNKS[scenario]['startyear'],
+            YEARCHUNKS[scenario]['endyear'])
+
+def _fut_haz_filename(his_file, scenario, file_props, yearrange_fut):
+    """Name to save the future hazard of a historical input hazard file and scenario"""
+    return ('haz' + '_' + file_props[his_file]['ag_model'] + '_' +
+            file_props[his_file]['cl_model'] + '_' + scenario + '_' +
+            file_props[his_file]['soc'] + '_' + file_props[his_file]['co2'] +
+            '_' + file_props[his_file]['combi_crop'] + '-' + file_props[his_file]['irr']+ '_' +
+            str(yearrange_fut[0]) + '-' + str(yearrange_fut[1]) + '.hdf5')
+
+def _mask_intensity(intensity, mask):
+    """Multiply the intensity at each centroid with the mask value of the centroid
+
+    Parameters
+    ----------
+    intensity : sparse.csr_matrix
+        intensity matrix (events x centroids)
+    mask : np.array
+        mask value per centroid
+
+    Returns
+    -------
+    sparse.csr_matrix
+    """
+    intensity = sparse.csr_matrix(intensity, copy=True)
+    intensity.data = intensity.data * mask[intensity.indices]
+    return intensity
 
 def read_wheat_mask_isimip3(input_dir=None, filename=None, bbox=None):
     """for ISIMIP3, get masks for spring wheat (swh) and winter wheat (wwh).
@@ -22,11 +22,19 @@ Define TC rain hazard (TCRain class).
 __all__ = ['TCRain']
 
 import datetime as dt
+import hashlib
 import itertools
 import logging
+import os
 from pathlib import Path
-from typing import Optional, Tuple, List, Union
-
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Iterable, Optional, Tuple, List, Union
+
+import h5py
+import numba
 import numpy as np
 import pathos.pools
 from scipy import sparse
@@ -241,6 +249,8 @@ class TCRain(Hazard):
         max_dist_inland_km: float = 1000,
         max_dist_eye_km: float = DEF_MAX_DIST_EYE_KM,
         max_memory_gb: float = DEF_MAX_MEMORY_GB,
+        raster_cache_dir: Optional[Union[str, Path]] = None,
+        stream_file: Optional[Union[str, Path]] = None,
     ):
         """
         Create new TCRain instance that contains rainfields from the specified tracks
@@ -390,8 +400,25 @@ class TCRain(Hazard):
             TC center ("eye") larger than this parameter. Default: 300
         max_memory_gb : float, optional
             To avoid memory issues, the computation is done for chunks of the track sequentially.
-            The chunk size is determined depending on the available memory (in GB). Note that this
-            limit applies to each thread separately if a ``pool`` is used. Default: 8
+            The chunk sizes are determined for each track from the number of centroids within reach
+            of the track positions, such that the memory (in GB) required by the computation of a
+            chunk does not exceed this limit. The requirements are measured while computing the
+            chunks, and reported in the logs together with the run time. Note that this limit
+            applies to each thread separately if a ``pool`` is used. Default: 8
+        raster_cache_dir : Path or str, optional
+            With ``model="TCR"``, the topography and drag coefficient raster products are sampled
+            only once at the centroids for all tracks. If this directory is given, the samples
+            are stored in it as .npy files that are reused by later calls with the same raster
+            files and centroids. If a ``pool`` is used without ``raster_cache_dir``, the samples
+            are stored in a temporary directory. In both cases, the worker processes share the
+            samples by memory mapping the files. Default: None
+        stream_file : Path or str, optional
+            If given, the rain fields of the tracks are appended to this HDF5 file as soon as they
+            are computed (in order of completion if a ``pool`` is used) instead of being kept in
+            memory until all tracks are done. The returned hazard is then assembled from the file
+            in a single pass, so that peak memory usage does not grow with the number of tracks
+            beyond the size of the result. An existing file is overwritten, and the file is kept
+            after the call. Default: None
 
         Returns
         -------
@@ -431,40 +458,75 @@ class TCRain(Hazard):
 
         LOGGER.info('Mapping %s tracks to %s coastal centroids.', str(tracks.size),
                     str(idx_centr_filter.size))
+        raster_cache = None
         if pool:
-            chunksize = max(min(num_tracks // pool.ncpus, 1000), 1)
-            tc_haz_list = pool.map(
-                cls._from_track, tracks.data,
-                itertools.repeat(centroids, num_tracks),
-                itertools.repeat(idx_centr_filter, num_tracks),
-                itertools.repeat(model, num_tracks),
-                itertools.repeat(model_kwargs, num_tracks),
-                itertools.repeat(store_rainrates, num_tracks),
-                itertools.repeat(metric, num_tracks),
-                itertools.repeat(intensity_thres, num_tracks),
-                itertools.repeat(max_dist_eye_km, num_tracks),
-                itertools.repeat(max_memory_gb, num_tracks),
-                chunksize=chunksize)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                if model == "TCR":
+                    raster_cache = _raster_cache(
+                        centroids.coord, idx_centr_filter, model_kwargs,
+                        cache_dir=tmp_dir if raster_cache_dir is None else raster_cache_dir,
+                    )
+                chunksize = max(min(num_tracks // pool.ncpus, 1000), 1)
+                track_args = [
+                    tracks.data,
+                    itertools.repeat(centroids, num_tracks),
+                    itertools.repeat(idx_centr_filter, num_tracks),
+                    itertools.repeat(model, num_tracks),
+                    itertools.repeat(model_kwargs, num_tracks),
+                    itertools.repeat(store_rainrates, num_tracks),
+                    itertools.repeat(metric, num_tracks),
+                    itertools.repeat(intensity_thres, num_tracks),
+                    itertools.repeat(max_dist_eye_km, num_tracks),
+                    itertools.repeat(max_memory_gb, num_tracks),
+                    itertools.repeat(raster_cache, num_tracks),
+                ]
+                if stream_file is None:
+                    tc_haz_list = pool.map(cls._from_track, *track_args, chunksize=chunksize)
+                else:
+                    haz = cls._concat_stream(
+                        pool.uimap(
+                            _enumerate_result,
+                            itertools.repeat(cls._from_track, num_tracks),
+                            range(num_tracks),
+                            *track_args,
+                            chunksize=chunksize,
+                        ),
+                        num_tracks, centroids, stream_file, store_rainrates,
+                    )
         else:
-            last_perc = 0
-            tc_haz_list = []
-            for track in tracks.data:
-                perc = 100 * len(tc_haz_list) / len(tracks.data)
-                if perc - last_perc >= 10:
-                    LOGGER.info("Progress: %d%%", perc)
-                    last_perc = perc
-                tc_haz_list.append(
-                    cls._from_track(track, centroids, idx_centr_filter,
-                                    model=model, model_kwargs=model_kwargs,
-                                    store_rainrates=store_rainrates,
-                                    metric=metric, intensity_thres=intensity_thres,
-                                    max_dist_eye_km=max_dist_eye_km,
-                                    max_memory_gb=max_memory_gb))
-            if last_perc < 100:
-                LOGGER.info("Progress: 100%")
-
-        LOGGER.debug('Concatenate events.')
-        haz = cls.concat(tc_haz_list)
+            if model == "TCR":
+                raster_cache = _raster_cache(
+                    centroids.coord, idx_centr_filter, model_kwargs, cache_dir=raster_cache_dir,
+                )
+
+            def _iter_tracks():
+                last_perc = 0
+                for i_track, track in enumerate(tracks.data):
+                    perc = 100 * i_track / num_tracks
+                    if perc - last_perc >= 10:
+                        LOGGER.info("Progress: %d%%", perc)
+                        last_perc = perc
+                    yield i_track, cls._from_track(
+                        track, centroids, idx_centr_filter,
+                        model=model, model_kwargs=model_kwargs,
+                        store_rainrates=store_rainrates,
+                        metric=metric, intensity_thres=intensity_thres,
+                        max_dist_eye_km=max_dist_eye_km,
+                        max_memory_gb=max_memory_gb,
+                        raster_cache=raster_cache)
+                if last_perc < 100:
+                    LOGGER.info("Progress: 100%")
+
+            if stream_file is None:
+                tc_haz_list = [tc_haz for _, tc_haz in _iter_tracks()]
+            else:
+                haz = cls._concat_stream(
+                    _iter_tracks(), num_tracks, centroids, stream_file, store_rainrates,
+                )
+
+        if stream_file is None:
+            LOGGER.debug('Concatenate events.')
+            haz = cls.concat(tc_haz_list)
         haz.pool = pool
         haz.intensity_thres = intensity_thres
         LOGGER.debug('Compute frequency.')
@@ -484,6 +546,7 @@ class TCRain(Hazard):
         intensity_thres: float = DEF_INTENSITY_THRES,
         max_dist_eye_km: float = DEF_MAX_DIST_EYE_KM,
         max_memory_gb: float = DEF_MAX_MEMORY_GB,
+        raster_cache: Optional[dict] = None,
     ):
         """
         Generate a TC rain hazard object from a single track dataset
@@ -516,6 +579,8 @@ class TCRain(Hazard):
         max_memory_gb : float, optional
             To avoid memory issues, the computation is done for chunks of the track sequentially.
             The chunk size is determined depending on the available memory (in GB). Default: 8
+        raster_cache : dict, optional
+            Raster products sampled at the centroids, see ``_raster_cache``. Default: None
 
         Returns
         -------
@@ -532,6 +597,7 @@ class TCRain(Hazard):
             intensity_thres=intensity_thres,
             max_dist_eye_km=max_dist_eye_km,
             max_memory_gb=max_memory_gb,
+            raster_cache=raster_cache,
         )
 
         new_haz = cls(haz_type=HAZ_TYPE)
@@ -556,6 +622,145 @@ class TCRain(Hazard):
         new_haz.basin = [str(track["basin"].values[0])]
         return new_haz
 
+    @classmethod
+    def _concat_stream(
+        cls,
+        results: Iterable[Tuple[int, "TCRain"]],
+        num_tracks: int,
+        centroids: Centroids,
+        stream_file: Union[str, Path],
+        store_rainrates: bool = False,
+    ):
+        """Concatenate single-track hazards via an HDF5 file as they arrive
+
+        The sparse rows of each single-track hazard are appended to the file and the hazard object
+        is discarded immediately. Once all tracks are done, the final hazard is assembled in track
+        order by reading the file front to back.
+
+        Parameters
+        ----------
+        results : iterable of tuples (int, TCRain)
+            Index of the track and single-track hazard (output of ``_from_track``), in any order.
+        num_tracks : int
+            Number of tracks.
+        centroids : Centroids
+            Centroids of all single-track hazards.
+        stream_file : Path or str
+            HDF5 file to use for intermediate storage. An existing file is overwritten.
+        store_rainrates : boolean, optional
+            If True, the rain rates of the single-track hazards are stored as well.
+            Default: False.
+
+        Returns
+        -------
+        TCRain
+        """
+        n_centroids = centroids.size
+        event_name = [None] * num_tracks
+        basin = [None] * num_tracks
+        date = np.zeros(num_tracks, dtype=int)
+        orig = np.zeros(num_tracks, dtype=bool)
+        category = np.zeros(num_tracks, dtype=int)
+        # for each result in order of completion: track index, nnz, and (for rainrates) nrows
+        track_idx = np.zeros(num_tracks, dtype=np.int64)
+        nnz = np.zeros(num_tracks, dtype=np.int64)
+        rr_nnz = np.zeros(num_tracks, dtype=np.int64)
+        rr_rows = np.zeros(num_tracks, dtype=np.int64)
+
+        groups = ["intensity"] + (["rainrates"] if store_rainrates else [])
+        with h5py.File(stream_file, "w") as h5f:
+            for name in groups:
+                h5f.create_dataset(f"{name}/data", (0,), dtype=float, maxshape=(None,), chunks=True)
+                h5f.create_dataset(f"{name}/indices", (0,), dtype=np.int64, maxshape=(None,),
+                                   chunks=True)
+            if store_rainrates:
+                h5f.create_dataset("rainrates/indptr", (0,), dtype=np.int64, maxshape=(None,),
+                                   chunks=True)
+
+            for i_res, (i_track, tc_haz) in enumerate(results):
+                track_idx[i_res] = i_track
+                event_name[i_track] = tc_haz.event_name[0]
+                basin[i_track] = tc_haz.basin[0]
+                date[i_track] = tc_haz.date[0]
+                orig[i_track] = tc_haz.orig[0]
+                category[i_track] = tc_haz.category[0]
+                nnz[i_res] = _h5_append_csr(h5f["intensity"], tc_haz.intensity)
+                if store_rainrates:
+                    rainrates = tc_haz.rainrates[0]
+                    rr_nnz[i_res] = _h5_append_csr(h5f["rainrates"], rainrates)
+                    rr_rows[i_res] = rainrates.shape[0]
+                    _h5_append(h5f["rainrates/indptr"], rainrates.indptr[1:])
+
+            LOGGER.debug('Assemble events from %s.', str(stream_file))
+            # position of each track's row in the final matrix
+            indptr = np.zeros(num_tracks + 1, dtype=np.int64)
+            indptr[1 + track_idx] = nnz
+            np.cumsum(indptr, out=indptr)
+            data = np.empty(indptr[-1], dtype=float)
+            indices = np.empty(indptr[-1], dtype=np.int64)
+            rainrates = [None] * num_tracks if store_rainrates else []
+            pos, rr_pos, rr_row_pos = 0, 0, 0
+            for i_res, i_track in enumerate(track_idx):
+                start, end = indptr[i_track], indptr[i_track + 1]
+                data[start:end] = h5f["intensity/data"][pos:pos + nnz[i_res]]
+                indices[start:end] = h5f["intensity/indices"][pos:pos + nnz[i_res]]
+                pos += nnz[i_res]
+                if store_rainrates:
+                    rr_slice = slice(rr_pos, rr_pos + rr_nnz[i_res])
+                    rainrates[i_track] = sparse.csr_matrix((
+                        h5f["rainrates/data"][rr_slice],
+                        h5f["rainrates/indices"][rr_slice],
+                        np.concatenate([
+                            [0],
+                            h5f["rainrates/indptr"][rr_row_pos:rr_row_pos + rr_rows[i_res]],
+                        ]),
+                    ), shape=(rr_rows[i_res], n_centroids))
+                    rr_pos += rr_nnz[i_res]
+                    rr_row_pos += rr_rows[i_res]
+
+        return cls(
+            haz_type=HAZ_TYPE,
+            units='mm',
+            centroids=centroids,
+            event_id=np.arange(1, num_tracks + 1),
+            frequency=np.ones(num_tracks),
+            event_name=event_name,
+            date=date,
+            orig=orig,
+            intensity=sparse.csr_matrix(
+                (data, indices, indptr), shape=(num_tracks, n_centroids),
+            ),
+            fraction=sparse.csr_matrix((num_tracks, n_centroids)),
+            category=category,
+            basin=basin,
+            rainrates=rainrates,
+        )
+
+def _enumerate_result(func, idx, *args):
+    """Call a function and return the result together with the given index
+
+    This is used with ``imap_unordered`` to recover the order of the inputs.
+    """
+    return idx, func(*args)
+
+def _h5_append(dataset: h5py.Dataset, values: np.ndarray):
+    """Append values to the end of a resizable one-dimensional HDF5 dataset"""
+    size = dataset.shape[0]
+    dataset.resize((size + values.size,))
+    dataset[size:] = values
+
+def _h5_append_csr(group: h5py.Group, matrix: sparse.csr_matrix) -> int:
+    """Append the data and column indices of a CSR matrix to an HDF5 group
+
+    Returns
+    -------
+    int
+        Number of stored entries of the matrix.
+    """
+    _h5_append(group["data"], matrix.data)
+    _h5_append(group["indices"], matrix.indices)
+    return matrix.nnz
+
 def _compute_rain_sparse(
     track: xr.Dataset,
     centroids: Centroids,
@@ -567,6 +772,7 @@ def _compute_rain_sparse(
     intensity_thres: float = DEF_INTENSITY_THRES,
     max_dist_eye_km: float = DEF_MAX_DIST_EYE_KM,
     max_memory_gb: float = DEF_MAX_MEMORY_GB,
+    raster_cache: Optional[dict] = None,
 ) -> Tuple[sparse.csr_matrix, Optional[sparse.csr_matrix]]:
     """Version of ``compute_rain`` that returns sparse matrices and limits memory usage
 
@@ -598,6 +804,9 @@ def _compute_rain_sparse(
     max_memory_gb : float, optional
         To avoid memory issues, the computation is done for chunks of the track sequentially.
         The chunk size is determined depending on the available memory (in GB). Default: 8
+    raster_cache : dict, optional
+        Raster products sampled at the centroids, see ``_raster_cache``. If not given, the raster
+        products are sampled for this track only. Default: None
 
     Raises
     ------
@@ -652,20 +861,25 @@ def _compute_rain_sparse(
     if n_centr_close == 0:
         return intensity_sparse, rainrates_sparse
 
-    # the total memory requirement in GB if we compute everything without chunking:
-    # 8 Bytes per entry (float64), 25 arrays
-    total_memory_gb = npositions * n_centr_close * 8 * 25 / 1e9
-    if total_memory_gb > max_memory_gb and npositions > 3:
-        # If the number of positions is down to 3 already, we do not split any further. In that
-        # case, we just take the risk and try to do the computation anyway. It might still work
-        # since we have only computed an upper bound for the number of affected centroids.
+    # the total memory requirement in GB if we compute everything without chunking
+    bytes_per_entry = 8 * _n_arrays_in_memory(model, model_kwargs)
+    total_memory_gb = npositions * n_centr_close * bytes_per_entry / 1e9
+    if total_memory_gb > max_memory_gb and npositions > 1:
+        raster_samples = None
+        if model == "TCR":
+            # sample the raster products once for all chunks
+            if raster_cache is None:
+                raster_cache = _raster_cache(centroids.coord, idx_centr_filter, model_kwargs)
+            raster_samples = _raster_samples(raster_cache, idx_centr_filter)
 
         # Split the track into chunks, compute the result for each chunk, and combine:
         return _compute_rain_sparse_chunked(
+            si_track,
+            track["time_step"].values,
+            centroids_close,
             mask_centr_alongtrack,
-            track,
-            centroids,
             idx_centr_filter,
+            ncentroids,
             model=model,
             model_kwargs=model_kwargs,
             store_rainrates=store_rainrates,
@@ -673,6 +887,7 @@ def _compute_rain_sparse(
             intensity_thres=intensity_thres,
             max_dist_eye_km=max_dist_eye_km,
             max_memory_gb=max_memory_gb,
+            raster_samples=raster_samples,
         )
 
     rainrates, idx_centr_reachable = compute_rain(
@@ -682,9 +897,12 @@ def _compute_rain_sparse(
         model_kwargs=model_kwargs,
         metric=metric,
         max_dist_eye_km=max_dist_eye_km,
+        raster_samples=(
+            None if raster_cache is None
+            else _raster_samples(raster_cache, idx_centr_filter)
+        ),
     )
     idx_centr_filter = idx_centr_filter[idx_centr_reachable]
-    npositions = rainrates.shape[0]
 
     # obtain total rainfall in mm by multiplying by time step size (in hours) and summing up
     intensity = (rainrates * track["time_step"].values[:, None]).sum(axis=0)
@@ -697,80 +915,271 @@ def _compute_rain_sparse(
 
     rainrates_sparse = None
     if store_rainrates:
-        n_centr_filter = idx_centr_filter.size
-        indices = np.broadcast_to(idx_centr_filter[None], (npositions, n_centr_filter)).ravel()
-        indptr = np.arange(npositions + 1) * n_centr_filter
-        rainrates_sparse = sparse.csr_matrix((rainrates.ravel(), indices, indptr),
-                                              shape=rainrates_shape)
-        rainrates_sparse.eliminate_zeros()
+        rainrates_sparse = _rainrates_to_sparse(rainrates, idx_centr_filter, ncentroids)
 
     return intensity_sparse, rainrates_sparse
 
 def _compute_rain_sparse_chunked(
+    si_track: xr.Dataset,
+    time_step: np.ndarray,
+    centroids_close: np.ndarray,
     mask_centr_alongtrack: np.ndarray,
-    track: xr.Dataset,
-    *args,
+    idx_centr_filter: np.ndarray,
+    ncentroids: int,
+    model: str = 'R-CLIPER',
+    model_kwargs: Optional[dict] = None,
+    store_rainrates: bool = False,
+    metric: str = "equirect",
+    intensity_thres: float = DEF_INTENSITY_THRES,
+    max_dist_eye_km: float = DEF_MAX_DIST_EYE_KM,
     max_memory_gb: float = DEF_MAX_MEMORY_GB,
-    **kwargs,
+    raster_samples: Optional[dict] = None,
 ) -> Tuple[sparse.csr_matrix, Optional[sparse.csr_matrix]]:
-    """Call ``_compute_rain_sparse`` for chunks of the track and re-assemble the results
+    """Version of ``_compute_rain_sparse`` that splits the track into chunks of positions
+
+    The chunks are planned one after the other, each as large as possible given the number of
+    centroids within reach of its track positions, see ``_chunk_end``. The TCR model uses time
+    differences, which is why it is evaluated with a halo of two extra track positions on both
+    sides of a chunk. The rain rates of the halo positions are discarded so that the result does
+    not depend on the chunking.
+
+    The memory requirement per track position and centroid is initially estimated with
+    ``_n_arrays_in_memory``. The peak memory allocated during the computation of a chunk is
+    measured (with ``tracemalloc``, unless it is already tracing), and the larger of both values is
+    used for planning the remaining chunks. The run time and the peak memory of each chunk are
+    reported in the logs.
 
     Parameters
     ----------
-    mask_centr_alongtrack : np.ndarray of shape (npositions, ncentroids)
+    si_track : xr.Dataset
+        Output of ``_track_to_si_with_q_and_shear`` for the whole track.
+    time_step : ndarray of shape (npositions,)
+        Time step (in hours) of each track position.
+    centroids_close : ndarray of shape (ncentroids_close, 2)
+        Coordinates of the centroids within reach of the track.
+    mask_centr_alongtrack : ndarray of shape (npositions, ncentroids_close)
         Each row is a mask that indicates the centroids within reach for one track position.
-    track : xr.Dataset
-        Single tropical cyclone track.
-    max_memory_gb : float, optional
-        Maximum memory requirements (in GB) for the computation of a single chunk of the track.
-        Default: 8
-    args, kwargs :
-        The remaining arguments are passed on to ``_compute_rain_sparse``.
+    idx_centr_filter : ndarray of shape (ncentroids_close,)
+        Indices of the centroids in ``centroids_close`` within the full set of centroids.
+    ncentroids : int
+        Size of the full set of centroids.
+    raster_samples : dict, optional
+        If given, raster products sampled at ``centroids_close``, see ``_raster_samples``.
+        Default: None
+    model, model_kwargs, store_rainrates, metric, intensity_thres, max_dist_eye_km, max_memory_gb :
+        See ``_compute_rain_sparse``.
 
     Returns
     -------
     intensity, rainrates :
         See ``_compute_rain_sparse`` for a description of the return values.
     """
-    npositions = track.sizes["time"]
-    # The memory requirements for each track position are estimated for the case of 25 arrays
-    # containing `nreachable` float64 (8 Byte) values each. The chunking is only relevant in
-    # extreme cases with a very high temporal and/or spatial resolution.
-    max_nreachable = max_memory_gb * 1e9 / (8 * 25 * npositions)
-    split_pos = [0]
-    chunk_size = 3
-    while split_pos[-1] + chunk_size < npositions:
-        chunk_size += 1
-        # create overlap between consecutive chunks
-        chunk_start = max(0, split_pos[-1] - 2)
-        chunk_end = chunk_start + chunk_size
-        nreachable = mask_centr_alongtrack[chunk_start:chunk_end].any(axis=0).sum()
-        if nreachable > max_nreachable:
-            split_pos.append(chunk_end - 1)
-            chunk_size = 3
-    split_pos.append(npositions)
-
-    intensity = []
-    rainrates = []
-    for prev_chunk_end, chunk_end in zip(split_pos[:-1], split_pos[1:]):
-        chunk_start = max(0, prev_chunk_end - 2)
-        inten, rainr = _compute_rain_sparse(
-            track.isel(time=slice(chunk_start, chunk_end)), *args,
-            max_memory_gb=max_memory_gb, **kwargs,
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    npositions, n_centr_close = mask_centr_alongtrack.shape
+    halo = 2 if model == "TCR" else 0
+    bytes_per_entry = 8 * _n_arrays_in_memory(model, model_kwargs)
+
+    intensity = np.zeros(n_centr_close)
+    rainrates_chunks = []
+    n_chunks, max_peak_gb, time_total = 0, 0, 0
+    chunk_start = 0
+    while chunk_start < npositions:
+        max_entries = max_memory_gb * 1e9 / bytes_per_entry
+        chunk_end = _chunk_end(mask_centr_alongtrack, chunk_start, max_entries, halo=halo)
+        window = slice(max(0, chunk_start - halo), min(npositions, chunk_end + halo))
+        [idx_reach] = mask_centr_alongtrack[window].any(axis=0).nonzero()
+        n_entries = (window.stop - window.start) * idx_reach.size
+
+        (rainrates, idx_centr_reachable), chunk_time, peak_gb = _run_measured(
+            compute_rain,
+            si_track.isel(time=window),
+            centroids_close[idx_reach],
+            MODEL_RAIN[model],
+            model_kwargs=model_kwargs,
+            metric=metric,
+            max_dist_eye_km=max_dist_eye_km,
+            raster_samples=None if raster_samples is None else {
+                key: (values[idx_reach], grads[idx_reach])
+                for key, (values, grads) in raster_samples.items()
+            },
         )
-        intensity.append(inten)
-        rainrates.append(rainr)
-
-    intensity = sparse.csr_matrix(sparse.vstack(intensity).max(axis=0))
-    if rainrates[0] is not None:
-        # eliminate the overlap between consecutive chunks
-        rainrates = (
-            [rainrates[0][:-1, :]]
-            + [rainr[1:-1, :] for rainr in rainrates[1:-1]]
-            + [rainrates[-1][1:, :]]
+        rainrates = rainrates[chunk_start - window.start:chunk_end - window.start]
+        idx_reach = idx_reach[idx_centr_reachable]
+        intensity[idx_reach] += (rainrates * time_step[chunk_start:chunk_end, None]).sum(axis=0)
+        if store_rainrates:
+            rainrates_chunks.append(_rainrates_to_sparse(
+                rainrates, idx_centr_filter[idx_reach], ncentroids,
+            ))
+
+        rss_gb = _peak_rss_gb()
+        LOGGER.debug(
+            "Chunk of track positions %d to %d with %d centroids: estimated %.3f GB, "
+            "traced peak %s GB, process peak RSS %s GB, %.2f s",
+            chunk_start, chunk_end - 1, idx_reach.size, n_entries * bytes_per_entry / 1e9,
+            "-" if peak_gb is None else f"{peak_gb:.3f}",
+            "-" if rss_gb is None else f"{rss_gb:.3f}",
+            chunk_time,
         )
-        rainrates = sparse.vstack(rainrates, format="csr")
-    return intensity, rainrates
+        if peak_gb is not None and n_entries > 0:
+            # adapt the estimate if the measured requirements are larger
+            bytes_per_entry = max(bytes_per_entry, peak_gb * 1e9 / n_entries)
+            max_peak_gb = max(max_peak_gb, peak_gb)
+        n_chunks += 1
+        time_total += chunk_time
+        chunk_start = chunk_end
+
+    LOGGER.info(
+        "Computed rain in %d chunks of track positions (max. traced peak %.3f GB), %.1f s.",
+        n_chunks, max_peak_gb, time_total,
+    )
+
+    intensity[intensity < intensity_thres] = 0
+    intensity_sparse = sparse.csr_matrix(
+        (intensity, idx_centr_filter, [0, intensity.size]),
+        shape=(1, ncentroids))
+    intensity_sparse.eliminate_zeros()
+
+    rainrates_sparse = None
+    if store_rainrates:
+        rainrates_sparse = sparse.vstack(rainrates_chunks, format="csr")
+    return intensity_sparse, rainrates_sparse
+
+def _chunk_end(
+    mask_centr_alongtrack: np.ndarray,
+    chunk_start: int,
+    max_entries: float,
+    halo: int = 0,
+) -> int:
+    """Find the end of the largest chunk of track positions that fits into the memory limit
+
+    The memory requirements of a chunk are proportional to the number of track positions (including
+    a halo of additional positions on both sides) times the number of centroids within reach of any
+    of these positions. A chunk contains at least one track position, even if that exceeds the
+    limit.
+
+    Parameters
+    ----------
+    mask_centr_alongtrack : ndarray of shape (npositions, ncentroids)
+        Each row is a mask that indicates the centroids within reach for one track position.
+    chunk_start : int
+        First track position of the chunk.
+    max_entries : float
+        Maximum number of pairs of track positions and centroids in the chunk.
+    halo : int, optional
+        Number of additional positions to take into account on both sides of the chunk.
+        Default: 0
+
+    Returns
+    -------
+    chunk_end : int
+        Track position after the last position of the chunk.
+    """
+    npositions = mask_centr_alongtrack.shape[0]
+    window_start = max(0, chunk_start - halo)
+    window_end = min(npositions, chunk_start + 1 + halo)
+    reach = mask_centr_alongtrack[window_start:window_end].any(axis=0)
+    chunk_end = chunk_start + 1
+    while chunk_end < npositions:
+        if window_end < npositions:
+            reach_next = reach | mask_centr_alongtrack[window_end]
+            window_end_next = window_end + 1
+        else:
+            reach_next, window_end_next = reach, window_end
+        if (window_end_next - window_start) * np.count_nonzero(reach_next) > max_entries:
+            break
+        reach, window_end = reach_next, window_end_next
+        chunk_end += 1
+    return chunk_end
+
+def _run_measured(func, *args, **kwargs):
+    """Call a function and measure its run time and peak memory allocation
+
+    The memory allocation is measured with ``tracemalloc``, so that only memory allocated by Python
+    and NumPy is taken into account.
+
+    Returns
+    -------
+    result : object
+        Return value of the function call.
+    seconds : float
+        Run time (in s).
+    peak_gb : float or None
+        Peak memory (in GB) allocated during the call. None if ``tracemalloc`` was already tracing
+        before the call (in that case, the measurement would interfere with that of the caller).
+    """
+    trace = not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak_gb = tracemalloc.get_traced_memory()[1] / 1e9 if trace else None
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return result, seconds, peak_gb
+
+def _peak_rss_gb() -> Optional[float]:
+    """Peak resident set size (in GB) of the current process, or None if it can't be determined"""
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        # not available on Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # the value is given in bytes on macOS, but in kilobytes on other platforms
+    return max_rss / (1e9 if sys.platform == "darwin" else 1e6)
+
+def _rainrates_to_sparse(
+    rainrates: np.ndarray,
+    idx_centr: np.ndarray,
+    ncentroids: int,
+) -> sparse.csr_matrix:
+    """Store rain rates for a subset of the centroids in a sparse matrix
+
+    Parameters
+    ----------
+    rainrates : ndarray of shape (npositions, nselected)
+        Rain rates at the selected centroids.
+    idx_centr : ndarray of shape (nselected,)
+        Indices of the selected centroids.
+    ncentroids : int
+        Total number of centroids.
+
+    Returns
+    -------
+    csr_matrix of shape (npositions, ncentroids)
+    """
+    npositions, n_centr = rainrates.shape
+    indices = np.broadcast_to(idx_centr[None], (npositions, n_centr)).ravel()
+    indptr = np.arange(npositions + 1) * n_centr
+    rainrates_sparse = sparse.csr_matrix((rainrates.ravel(), indices, indptr),
+                                         shape=(npositions, ncentroids))
+    rainrates_sparse.eliminate_zeros()
+    return rainrates_sparse
+
+def _n_arrays_in_memory(model: str, model_kwargs: dict) -> int:
+    """Upper bound for the number of float64 arrays of shape (npositions, ncentroids) that are held
+    in memory at the same time by ``compute_rain``
+
+    Parameters
+    ----------
+    model : str
+        Parametric rain model, see ``_compute_rain_sparse``.
+    model_kwargs: dict
+        Keyword arguments of the rain model.
+
+    Returns
+    -------
+    int
+    """
+    wind_model = model_kwargs.get("wind_model", "ER11")
+    if model == "TCR" and MODEL_VANG[wind_model] != MODEL_VANG["ER11"]:
+        # staggered distances and wind profiles are evaluated on full arrays
+        return 25
+    # distances, masks and rain rates only, see ``_eye_distances`` and ``_w_er11_nb``
+    return 4
 
 def compute_rain(
     si_track: xr.Dataset,
@@ -779,6 +1188,7 @@ def compute_rain(
     model_kwargs: Optional[dict] = None,
     metric: str = "equirect",
     max_dist_eye_km: float = DEF_MAX_DIST_EYE_KM,
+    raster_samples: Optional[dict] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Compute rain rate (in mm/h) of the tropical cyclone
 
@@ -807,6 +1217,9 @@ def compute_rain(
     max_dist_eye_km : float, optional
         No rain calculation is done for centroids with a distance (in km) to the TC center
         ("eye") larger than this parameter. Default: 300
+    raster_samples : dict, optional
+        For the TCR model, the raster products sampled at the centroids (see ``_raster_samples``).
+        If not given, the raster files specified in ``model_kwargs`` are sampled. Default: None
 
     Returns
     -------
@@ -823,22 +1236,28 @@ def compute_rain(
     rainrates = np.zeros((npositions, 0), dtype=np.float64)
 
     # exclude centroids that are too far from or too close to the eye
-    d_centr = _centr_distances(si_track, centroids, metric=metric, **model_kwargs)
-    mask_centr_close = (d_centr[""] <= max_dist_eye_km * KM_TO_M) & (d_centr[""] > 1)
+    d_centr = _eye_distances(si_track, centroids, metric=metric)
+    mask_centr_close = (d_centr <= max_dist_eye_km * KM_TO_M) & (d_centr > 1)
     if not np.any(mask_centr_close):
         return rainrates, idx_centr_reachable
 
     # restrict to the centroids that are within reach of any of the positions
     mask_centr_close_any = mask_centr_close.any(axis=0)
     mask_centr_close = mask_centr_close[:, mask_centr_close_any]
-    d_centr = {key: d[:, mask_centr_close_any, ...] for key, d in d_centr.items()}
+    d_centr = d_centr[:, mask_centr_close_any]
     centroids = centroids[mask_centr_close_any]
 
     if model == MODEL_RAIN["R-CLIPER"]:
-        rainrates = _rcliper(si_track, d_centr[""], mask_centr_close, **model_kwargs)
+        rainrates = _rcliper(si_track, d_centr, mask_centr_close, **model_kwargs)
     elif model == MODEL_RAIN["TCR"]:
+        if raster_samples is not None:
+            raster_samples = {
+                key: (values[mask_centr_close_any], grads[mask_centr_close_any])
+                for key, (values, grads) in raster_samples.items()
+            }
         rainrates = _tcr(
-            si_track, centroids, d_centr, mask_centr_close, **model_kwargs,
+            si_track, centroids, d_centr, mask_centr_close,
+            metric=metric, raster_samples=raster_samples, **model_kwargs,
         )
     else:
         raise NotImplementedError
@@ -926,6 +1345,45 @@ def _track_to_si_with_q_and_shear(
 
     return si_track
 
+def _eye_distances(
+    si_track: xr.Dataset,
+    centroids: np.ndarray,
+    metric: str = "equirect",
+) -> np.ndarray:
+    """Compute distances (in m) of centroids to storm locations
+
+    Unlike ``_centr_distances``, neither staggered distances nor directions are stored, and the
+    distances are computed in a single pass by the same kernel as in ``_compute_vertical_velocity``.
+
+    Parameters
+    ----------
+    si_track : xr.Dataset
+        TC track data in SI units, see ``tctrack_to_si``.
+    centroids : ndarray
+        Each row is a pair of lat/lon coordinates.
+    metric : str, optional
+        Approximation method to use for earth distances: "equirect" (faster) or "geosphere" (more
+        accurate). See ``dist_approx`` function in ``climada.util.coordinates``.
+        Default: "equirect".
+
+    Returns
+    -------
+    ndarray of shape (npositions, ncentroids)
+    """
+    return _eye_distances_nb(
+        si_track["lat"].values.astype(np.float64),
+        si_track["lon"].values.astype(np.float64),
+        centroids[:, 0].astype(np.float64),
+        centroids[:, 1].astype(np.float64),
+        _geosphere_metric(metric),
+    )
+
+def _geosphere_metric(metric: str) -> bool:
+    """Whether the distance kernels use the geosphere (True) or equirect (False) metric"""
+    if metric not in ["equirect", "geosphere"]:
+        raise KeyError(f"Unknown distance approximation method: {metric}")
+    return metric == "geosphere"
+
 def _centr_distances(
     si_track: xr.Dataset,
     centroids: np.ndarray,
@@ -1092,8 +1550,8 @@ def _tcr(
         rates depends on the selected wind model.
     centroids : ndarray of shape (ncentroids, 2)
         Each row is a pair of lat/lon coordinates.
-    d_centr : dict
-        Output of ``_centr_distances``.
+    d_centr : ndarray of shape (npositions, ncentroids)
+        Distances from storm centers to centroids, see ``_eye_distances``.
     mask_centr_close : np.ndarray of shape (npositions, ncentroids)
         For each track position one row indicating which centroids are within reach.
     e_precip : float, optional
@@ -1112,18 +1570,18 @@ def _tcr(
     w = _compute_vertical_velocity(si_track, centroids, d_centr, mask_centr_close, **kwargs)
 
     # derive vertical vapor flux wq by multiplying with saturation specific humidity Q950
-    wq = si_track["q950"].values[:, None] * w
+    # and convert rainrate from "meters per second" to "milimeters per hour" (in place)
+    w *= si_track["q950"].values[:, None]
+    w *= (M_TO_MM * H_TO_S) * e_precip * RHO_A_OVER_RHO_L
 
-    # convert rainrate from "meters per second" to "milimeters per hour"
-    rainrate = (M_TO_MM * H_TO_S) * e_precip * RHO_A_OVER_RHO_L * wq
-
-    return rainrate
+    return w
 
 def _compute_vertical_velocity(
     si_track: xr.Dataset,
     centroids: np.ndarray,
-    d_centr: dict,
+    d_centr: np.ndarray,
     mask_centr_close: np.ndarray,
+    metric: str = "equirect",
     wind_model: str = "ER11",
     elevation_tif: Optional[Union[str, Path]] = None,
     c_drag_tif: Optional[Union[str, Path]] = None,
@@ -1132,6 +1590,7 @@ def _compute_vertical_velocity(
     min_c_drag: float = 0.001,
     max_w_foreground: float = 7.0,
     matlab_ref_mode: bool = False,
+    raster_samples: Optional[dict] = None,
 ) -> np.ndarray:
     """Compute the vertical wind velocity at locations along a tropical cyclone track
 
@@ -1147,6 +1606,12 @@ def _compute_vertical_velocity(
     United States. Journal of Applied Meteorology and Climatology 58(8): 1853–1866.
     https://doi.org/10.1175/JAMC-D-19-0011.1
 
+    With the "ER11" wind model, the staggered distances, directions, wind profiles and all
+    components of the vertical velocity are computed in a single pass over the (position,
+    centroid) pairs within reach (see ``_w_er11_nb``), so that the only array of shape
+    (npositions, ncentroids) that is allocated is the result. The other wind models are evaluated
+    on full arrays (see ``_centr_distances`` and ``_horizontal_winds``).
+
     Parameters
     ----------
     si_track : xr.Dataset
@@ -1157,6 +1622,10 @@ def _compute_vertical_velocity(
         Distances from storm centers to centroids.
     mask_centr_close : np.ndarray of shape (npositions, ncentroids)
         For each track position one row indicating which centroids are within reach.
+    metric : str, optional
+        Approximation method to use for earth distances: "equirect" (faster) or "geosphere" (more
+        accurate). See ``dist_approx`` function in ``climada.util.coordinates``.
+        Default: "equirect".
     wind_model : str, optional
         Parametric wind field model to use, see TropCyclone. Default: "ER11".
     elevation_tif : Path or str, optional
@@ -1177,11 +1646,53 @@ def _compute_vertical_velocity(
         implementation. Default: 7.0
     matlab_ref_mode : bool, optional
         Do not apply the changes to the reference MATLAB implementation. Default: False
+    raster_samples : dict, optional
+        The raster products sampled at the centroids, see ``_raster_samples``. If given,
+        ``elevation_tif``, ``c_drag_tif`` and ``min_c_drag`` are ignored. Default: None
 
     Returns
     -------
     ndarray of shape (ntime, ncentroids)
     """
+    if raster_samples is None:
+        raster_samples = {
+            "elevation": _elevation_sample(centroids, elevation_tif=elevation_tif),
+            "drag": _drag_sample(centroids, c_drag_tif=c_drag_tif, min_c_drag=min_c_drag),
+        }
+
+    if MODEL_VANG[wind_model] == MODEL_VANG["ER11"]:
+        _, h_grad = raster_samples["elevation"]
+        c_drag, c_drag_grad = raster_samples["drag"]
+        ntime = si_track.sizes["time"]
+        cp = si_track["cp"].values.astype(np.float64)
+        # In the MATLAB implementation, the Coriolis parameter of the wind profile is chosen to be
+        # 5e-5 (see ``_windprofile``).
+        cp_profile = np.full_like(cp, 5e-5) if matlab_ref_mode else cp
+        vshear = (
+            si_track["vshear"].values if "vshear" in si_track.variables
+            else np.zeros((ntime, 2))
+        )
+        return _w_er11_nb(
+            si_track["lat"].values.astype(np.float64),
+            si_track["lon"].values.astype(np.float64),
+            si_track["rad"].values.astype(np.float64),
+            si_track["vmax"].values.astype(np.float64),
+            cp, cp_profile,
+            si_track["tstep"].values.astype(np.float64),
+            si_track["vtrans"].values.astype(np.float64),
+            vshear.astype(np.float64),
+            float(si_track.attrs["latsign"]),
+            centroids[:, 0].astype(np.float64),
+            centroids[:, 1].astype(np.float64),
+            np.asarray(h_grad, dtype=np.float64),
+            np.asarray(c_drag, dtype=np.float64),
+            np.asarray(c_drag_grad, dtype=np.float64),
+            d_centr, mask_centr_close,
+            _geosphere_metric(metric),
+            res_radial_m, w_rad, max_w_foreground,
+        )
+
+    d_centr = _centr_distances(si_track, centroids, metric=metric, res_radial_m=res_radial_m)
     h_winds = _horizontal_winds(
         si_track,
         d_centr,
@@ -1198,11 +1709,11 @@ def _compute_vertical_velocity(
 
     w_f_plus_w_t = _w_frict_stretch(
         si_track, d_centr, h_winds, centroids,
-        res_radial_m=res_radial_m, c_drag_tif=c_drag_tif, min_c_drag=min_c_drag,
+        res_radial_m=res_radial_m, drag_sample=raster_samples["drag"],
     )[mask_centr_close]
 
     w_h = _w_topo(
-        si_track, d_centr, h_winds, centroids, elevation_tif=elevation_tif,
+        si_track, d_centr, h_winds, centroids, elevation_sample=raster_samples["elevation"],
     )[mask_centr_close]
 
     w_s = _w_shear(si_track, d_centr, h_winds, res_radial_m=res_radial_m)[mask_centr_close]
@@ -1379,12 +1890,201 @@ def _w_shear(
         d_centr["dir"] * si_track["vshear"].values[:, None, :]
     ).sum(axis=-1)
 
+def _elevation_sample(
+    centroids: np.ndarray,
+    elevation_tif: Optional[Union[str, Path]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Sample the land surface elevation and its gradient at the centroids
+
+    Parameters
+    ----------
+    centroids : ndarray
+        Each row is a pair of lat/lon coordinates.
+    elevation_tif : Path or str, optional
+        Path to a GeoTIFF file containing digital elevation model data (in m). If not specified, an
+        SRTM-based topography at 0.1 degree resolution provided with CLIMADA is used. Default: None
+
+    Returns
+    -------
+    h : ndarray of shape (ncentroids,)
+        Elevation (in m), set to -1 over the ocean.
+    h_grad : ndarray of shape (ncentroids, 2)
+        Gradient of the elevation, set to 0 over the ocean.
+    """
+    if elevation_tif is None:
+        elevation_tif = default_elevation_tif()
+
+    # Note that the gradient of the raster products is smoothed (as in the reference MATLAB
+    # implementation), even though it should be piecewise constant since the data itself is read
+    # with bilinear interpolation.
+    h, h_grad = u_coord.read_raster_sample_with_gradients(
+        elevation_tif, centroids[:, 0], centroids[:, 1], method=("linear", "linear"),
+    )
+
+    # only consider interaction with terrain over land
+    mask_onland = (h > -1)
+    h[~mask_onland] = -1
+    h_grad[~mask_onland, :] *= 0
+    return h, h_grad
+
+def _drag_sample(
+    centroids: np.ndarray,
+    c_drag_tif: Optional[Union[str, Path]] = None,
+    min_c_drag: float = 0.001,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Sample the drag coefficient and its gradient at the centroids
+
+    Parameters
+    ----------
+    centroids : ndarray
+        Each row is a pair of lat/lon coordinates.
+    c_drag_tif : Path or str, optional
+        Path to a GeoTIFF file containing gridded drag coefficients (bottom friction). If not
+        specified, an ERA5-based data set provided with CLIMADA is used. Default: None
+    min_c_drag : float, optional
+        The drag coefficient is clipped to this minimum value (esp. over ocean). Default: 0.001
+
+    Returns
+    -------
+    cd : ndarray of shape (ncentroids,)
+        Drag coefficient, clipped to ``min_c_drag``.
+    cd_grad : ndarray of shape (ncentroids, 2)
+        Gradient of the drag coefficient, set to 0 where it is clipped.
+    """
+    if c_drag_tif is None:
+        c_drag_tif = default_drag_tif()
+
+    # Note that the gradient of the raster products is smoothed (as in the reference MATLAB
+    # implementation), even though it should be piecewise constant since the data itself is read
+    # with bilinear interpolation.
+    cd, cd_grad = u_coord.read_raster_sample_with_gradients(
+        c_drag_tif, centroids[:, 0], centroids[:, 1], method=("linear", "linear"),
+    )
+
+    mask_onland = (cd >= min_c_drag)
+    cd[~mask_onland] = min_c_drag
+    cd_grad[~mask_onland, :] *= 0
+    return cd, cd_grad
+
+def _raster_cache(
+    centroids: np.ndarray,
+    idx_centr: np.ndarray,
+    model_kwargs: Optional[dict] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> dict:
+    """Sample the raster products of the TCR model once for a set of centroids
+
+    Parameters
+    ----------
+    centroids : ndarray
+        Each row is a pair of lat/lon coordinates.
+    idx_centr : ndarray
+        Sorted indices of the centroids to sample.
+    model_kwargs : dict, optional
+        TCR model kwargs. The values of "elevation_tif", "c_drag_tif" and "min_c_drag" are used.
+        Default: None
+    cache_dir : Path or str, optional
+        If given, the samples are stored in this directory as .npy files, or read from there if
+        they already exist for the same raster files and centroids. The returned cache then only
+        refers to the files, so that it can be shared with worker processes that memory map the
+        files (see ``_raster_samples``). Default: None
+
+    Returns
+    -------
+    dict
+        "idx_centr" contains the sampled centroid indices. For "elevation" and "drag", the values
+        and gradients are stacked into an array of shape (ncentroids, 3), or the path of the .npy
+        file containing it.
+    """
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    elevation_tif = model_kwargs.get("elevation_tif")
+    elevation_tif = default_elevation_tif() if elevation_tif is None else elevation_tif
+    c_drag_tif = model_kwargs.get("c_drag_tif")
+    c_drag_tif = default_drag_tif() if c_drag_tif is None else c_drag_tif
+    min_c_drag = model_kwargs.get("min_c_drag", 0.001)
+
+    coords = centroids[idx_centr]
+    samplers = {
+        "elevation": (
+            elevation_tif, (),
+            lambda: _elevation_sample(coords, elevation_tif=elevation_tif),
+        ),
+        "drag": (
+            c_drag_tif, (min_c_drag,),
+            lambda: _drag_sample(coords, c_drag_tif=c_drag_tif, min_c_drag=min_c_drag),
+        ),
+    }
+    raster_cache = {"idx_centr": idx_centr}
+    for key, (tif, params, sample) in samplers.items():
+        if cache_dir is None:
+            raster_cache[key] = np.column_stack(sample())
+            continue
+        path = Path(cache_dir) / f"{key}_{_raster_sample_hash(tif, coords, params)}.npy"
+        if path.is_file():
+            LOGGER.debug("Reusing %s samples from %s", key, path)
+        else:
+            # write to a temporary file first, so that concurrent processes never read
+            # incomplete files
+            path_tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with path_tmp.open("wb") as fp:
+                np.save(fp, np.column_stack(sample()))
+            os.replace(path_tmp, path)
+        raster_cache[key] = path
+    return raster_cache
+
+def _raster_sample_hash(tif: Union[str, Path], coords: np.ndarray, params: tuple) -> str:
+    """Hash identifying the samples of a raster file at the given coordinates"""
+    tif = Path(tif).resolve()
+    tif_stat = tif.stat()
+    sha = hashlib.sha1()
+    sha.update(f"{tif}:{tif_stat.st_size}:{tif_stat.st_mtime_ns}:{params}".encode())
+    sha.update(np.ascontiguousarray(coords, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+def _load_raster_sample(path: Path, rows: np.ndarray) -> np.ndarray:
+    """Read some rows of a file written by ``_raster_cache``
+
+    The file is memory mapped during the call only, so that no mapping outlives the file (which
+    can be in a temporary directory that is removed while pool workers are still alive).
+    """
+    data = np.load(path, mmap_mode="r")
+    # fancy indexing copies the rows, the mapping is closed with the last reference to data
+    return data[rows]
+
+def _raster_samples(raster_cache: dict, idx_centr: np.ndarray) -> dict:
+    """Select the raster products sampled at some of the centroids of a raster cache
+
+    Parameters
+    ----------
+    raster_cache : dict
+        Output of ``_raster_cache``.
+    idx_centr : ndarray
+        Sorted indices of the centroids to select. All of them must be in the cache.
+
+    Returns
+    -------
+    dict
+        For "elevation" and "drag", the values and gradients at the selected centroids as returned
+        by ``_elevation_sample`` and ``_drag_sample``.
+    """
+    rows = np.searchsorted(raster_cache["idx_centr"], idx_centr)
+    samples = {}
+    for key in ["elevation", "drag"]:
+        data = raster_cache[key]
+        if isinstance(data, np.ndarray):
+            data = data[rows]
+        else:
+            data = _load_raster_sample(data, rows)
+        samples[key] = (data[:, 0], data[:, 1:])
+    return samples
+
 def _w_topo(
     si_track: xr.Dataset,
     d_centr: dict,
     h_winds: dict,
     centroids: np.ndarray,
     elevation_tif: Optional[Union[str, Path]] = None,
+    elevation_sample: Optional[Tuple[np.ndarray, np.ndarray]] = None,
 ) -> np.ndarray:
     """Compute the topographic component w_h of the vertical wind velocity
 
@@ -1407,25 +2107,17 @@ def _w_topo(
     elevation_tif : Path or str, optional
         Path to a GeoTIFF file containing digital elevation model data (in m). If not specified, an
         SRTM-based topography at 0.1 degree resolution provided with CLIMADA is used. Default: None
+    elevation_sample : tuple of ndarrays, optional
+        Output of ``_elevation_sample`` for the centroids. If given, ``elevation_tif`` is ignored.
+        Default: None
 
     Returns
     -------
     ndarray of shape (ntime, ncentroids)
     """
-    if elevation_tif is None:
-        elevation_tif = default_elevation_tif()
-
-    # Note that the gradient of the raster products is smoothed (as in the reference MATLAB
-    # implementation), even though it should be piecewise constant since the data itself is read
-    # with bilinear interpolation.
-    h, h_grad = u_coord.read_raster_sample_with_gradients(
-        elevation_tif, centroids[:, 0], centroids[:, 1], method=("linear", "linear"),
-    )
-
-    # only consider interaction with terrain over land
-    mask_onland = (h > -1)
-    h[~mask_onland] = -1
-    h_grad[~mask_onland, :] *= 0
+    if elevation_sample is None:
+        elevation_sample = _elevation_sample(centroids, elevation_tif=elevation_tif)
+    _, h_grad = elevation_sample
 
     # reduce effect of translation speed and orography outside of storm core
     vtrans_red = si_track["vtrans"].values[:, None, :] * (
@@ -1446,6 +2138,7 @@ def _w_frict_stretch(
     res_radial_m: float = 2000.0,
     c_drag_tif: Optional[Union[str, Path]] = None,
     min_c_drag: float = 0.001,
+    drag_sample: Optional[Tuple[np.ndarray, np.ndarray]] = None,
 ) -> np.ndarray:
     """Compute the sum of the frictional and stretching components w_f and w_t
 
@@ -1473,15 +2166,15 @@ def _w_frict_stretch(
         specified, an ERA5-based data set provided with CLIMADA is used. Default: None
     min_c_drag : float, optional
         The drag coefficient is clipped to this minimum value (esp. over ocean). Default: 0.001
+    drag_sample : tuple of ndarrays, optional
+        Output of ``_drag_sample`` for the centroids. If given, ``c_drag_tif`` and ``min_c_drag``
+        are ignored. Default: None
 
     Returns
     -------
     ndarray of shape (ntime, ncentroids)
     """
     # sum of frictional and stretching components w_f and w_t
-    if c_drag_tif is None:
-        c_drag_tif = default_drag_tif()
-
     # vnet : absolute value of the total surface wind
     vnet = {
         f"r{rstep}h,t": np.linalg.norm(
@@ -1494,16 +2187,9 @@ def _w_frict_stretch(
         for rstep in ["+", "-"]
     }
 
-    # Note that the gradient of the raster products is smoothed (as in the reference MATLAB
-    # implementation), even though it should be piecewise constant since the data itself is read
-    # with bilinear interpolation.
-    cd, cd_grad = u_coord.read_raster_sample_with_gradients(
-        c_drag_tif, centroids[:, 0], centroids[:, 1], method=("linear", "linear"),
-    )
-
-    mask_onland = (cd >= min_c_drag)
-    cd[~mask_onland] = min_c_drag
-    cd_grad[~mask_onland, :] *= 0
+    if drag_sample is None:
+        drag_sample = _drag_sample(centroids, c_drag_tif=c_drag_tif, min_c_drag=min_c_drag)
+    cd, cd_grad = drag_sample
 
     cd_hstep = (cd_grad[None] * (0.5 * res_radial_m * d_centr["dir"])).sum(axis=-1)
     cd = {
@@ -1557,6 +2243,189 @@ def _w_frict_stretch(
 
     return (pre_wf_wt["r+h,t"] - pre_wf_wt["r-h,t"]) / (res_radial_m * d_centr[""])
 
+_EPS_VTAN = np.spacing(1)
+"""Threshold below which tangential vectors are considered 0 (as in ``u_coord.dist_approx``)"""
+
+_ONE_LAT_M = u_const.ONE_LAT_KM * KM_TO_M
+"""Length (in m) of one degree of latitude, for JIT functions"""
+
+@numba.njit
+def _dist_vtan(lat1, lon1, lat2, lon2, geosphere):
+    """Distance (in m) and tangential vector at the first point pointing to the second point
+
+    Scalar version of ``u_coord.dist_approx`` with ``log=True``, ``normalize=False`` and
+    ``units="m"``. The directional components of the tangential vector are lat-lon, i.e. the y
+    (meridional) direction is listed first.
+    """
+    unit_factor = _ONE_LAT_M
+    if geosphere:
+        lat1, lon1 = np.radians(lat1), np.radians(lon1)
+        lat2, lon2 = np.radians(lat2), np.radians(lon2)
+        dlat = 0.5 * (lat2 - lat1)
+        dlon = 0.5 * (lon2 - lon1)
+        # haversine formula:
+        hav = np.sin(dlat)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon)**2
+        dist = np.degrees(2 * np.arcsin(np.sqrt(hav))) * unit_factor
+
+        # unit vectors on the sphere and local basis at the first point
+        sin_lat1, cos_lat1 = np.sin(lat1 + 0.5 * np.pi), np.cos(lat1 + 0.5 * np.pi)
+        sin_lon1, cos_lon1 = np.sin(lon1), np.cos(lon1)
+        sin_lat2, cos_lat2 = np.sin(lat2 + 0.5 * np.pi), np.cos(lat2 + 0.5 * np.pi)
+        sin_lon2, cos_lon2 = np.sin(lon2), np.cos(lon2)
+        fac = 1 - 2 * hav
+        vec_x = sin_lat2 * cos_lon2 - fac * sin_lat1 * cos_lon1
+        vec_y = sin_lat2 * sin_lon2 - fac * sin_lat1 * sin_lon1
+        vec_z = cos_lat2 - fac * cos_lat1
+        vtan_lat = cos_lat1 * cos_lon1 * vec_x + cos_lat1 * sin_lon1 * vec_y - sin_lat1 * vec_z
+        vtan_lon = -sin_lon1 * vec_x + cos_lon1 * vec_y
+        vtan_norm = np.sqrt(vtan_lat * vtan_lat + vtan_lon * vtan_lon)
+        # for consistency, set dist to 0 if vtan is 0
+        if vtan_norm < _EPS_VTAN:
+            dist = 0.0
+        fac = dist / max(_EPS_VTAN, vtan_norm)
+        return dist, vtan_lat * fac, vtan_lon * fac
+
+    vtan_lat = lat2 - lat1
+    vtan_lon = lon2 - lon1
+    if vtan_lon > 180:
+        vtan_lon -= 360
+    elif vtan_lon < -180:
+        vtan_lon += 360
+    vtan_lon *= np.cos(np.radians(lat1))
+    vtan_lat *= unit_factor
+    vtan_lon *= unit_factor
+    return np.sqrt(vtan_lat * vtan_lat + vtan_lon * vtan_lon), vtan_lat, vtan_lon
+
+@numba.njit
+def _eye_distances_nb(t_lat, t_lon, c_lat, c_lon, geosphere):
+    """Distances (in m) between track positions and centroids, see ``_eye_distances``"""
+    d_centr = np.empty((t_lat.size, c_lat.size))
+    for i in range(t_lat.size):
+        for j in range(c_lat.size):
+            d_centr[i, j] = _dist_vtan(t_lat[i], t_lon[i], c_lat[j], c_lon[j], geosphere)[0]
+    return d_centr
+
+@numba.njit
+def _v_ang_er11(d_centr, r_max, v_max, coriolis_p):
+    """Angular wind speed (in m/s) at one distance from the eye according to the ER11 profile
+
+    Scalar version of ``_stat_er_2011`` from ``climada.hazard.trop_cyclone``. Set ``coriolis_p``
+    to 0 for a cyclostrophic profile.
+    """
+    # compute the momentum at the maximum, including the influence of the Coriolis force
+    momentum_max = r_max * v_max + 0.5 * coriolis_p * r_max**2
+
+    # rescale the momentum using formula (36) in Emanuel and Rotunno 2011 with Ck == Cd
+    r_max_norm = (d_centr / r_max)**2
+    momentum = momentum_max * 2 * r_max_norm / (1 + r_max_norm)
+
+    # extract the velocity from the rescaled momentum through division by r
+    return np.fmax(0, momentum / (d_centr + 1e-11))
+
+@numba.njit
+def _w_er11_nb(
+    t_lat, t_lon, t_rad, t_vmax, t_cp, t_cp_profile, t_tstep, t_vtrans, t_vshear, latsign,
+    c_lat, c_lon, c_h_grad, c_cd, c_cd_grad, d_centr, mask_centr_close, geosphere,
+    res_radial_m, w_rad, max_w_foreground,
+):
+    """Vertical wind velocity (in m/s) with the ER11 wind profile, see ``_compute_vertical_velocity``
+
+    This fuses ``_centr_distances``, ``_horizontal_winds``, ``_w_shear``, ``_w_topo`` and
+    ``_w_frict_stretch``: For each (position, centroid) pair within reach, the staggered distances,
+    the direction, the nine wind profile values and the three components of the vertical velocity
+    are computed in scalar variables, and only the clipped vertical velocity is stored.
+    As in ``compute_angular_windspeeds``, the wind profile is 0 for the first position of the track
+    (or of the shifted track in the case of the time offsets).
+    """
+    ntime, ncentroids = mask_centr_close.shape
+    w = np.zeros((ntime, ncentroids))
+    for i in range(ntime):
+        for j in range(ncentroids):
+            if not mask_centr_close[i, j]:
+                continue
+
+            # staggered distances to the eye and direction from the eye to the centroid
+            d_c = d_centr[i, j]
+            d_p = d_c + res_radial_m
+            d_m = np.fmax(0, d_c - res_radial_m)
+            d_ph = d_c + 0.5 * res_radial_m
+            d_mh = np.fmax(0, d_c - 0.5 * res_radial_m)
+            _, vtan_lat, vtan_lon = _dist_vtan(t_lat[i], t_lon[i], c_lat[j], c_lon[j], geosphere)
+            dir_lat = vtan_lat / np.fmax(1e-3, d_c)
+            dir_lon = vtan_lon / np.fmax(1e-3, d_c)
+
+            # the cyclostrophic wind direction, the meridional direction is listed first!
+            wdir_lat = latsign * dir_lon
+            wdir_lon = -latsign * dir_lat
+
+            # radial windprofile with offset in radius and/or time: v_r[±],t[±]
+            v_r_t = v_rp_t = v_rm_t = v_nocoriolis = 0.0
+            if i > 0:
+                v_r_t = _v_ang_er11(d_c, t_rad[i], t_vmax[i], t_cp_profile[i])
+                v_rp_t = _v_ang_er11(d_p, t_rad[i], t_vmax[i], t_cp_profile[i])
+                v_rm_t = _v_ang_er11(d_m, t_rad[i], t_vmax[i], t_cp_profile[i])
+                v_nocoriolis = _v_ang_er11(d_c, t_rad[i], t_vmax[i], 0.0)
+            # NOTE: For the computation of time derivatives, the eye of the storm is held
+            #       fixed while only the wind profile varies (see MATLAB code)
+            v_rp_tp = v_rp_tm = v_rm_tp = v_rm_tm = 0.0
+            if 2 <= i <= ntime - 2:
+                v_rp_tp = _v_ang_er11(d_p, t_rad[i + 1], t_vmax[i + 1], t_cp_profile[i + 1])
+                v_rm_tp = _v_ang_er11(d_m, t_rad[i + 1], t_vmax[i + 1], t_cp_profile[i + 1])
+                v_rp_tm = _v_ang_er11(d_p, t_rad[i - 1], t_vmax[i - 1], t_cp_profile[i - 1])
+                v_rm_tm = _v_ang_er11(d_m, t_rad[i - 1], t_vmax[i - 1], t_cp_profile[i - 1])
+            # radial windprofile with half-sized offsets in radius
+            v_rph_t = 0.5 * (v_r_t + v_rp_t)
+            v_rmh_t = 0.5 * (v_r_t + v_rm_t)
+
+            # shear component, see ``_w_shear``
+            fac = (
+                t_cp[i]
+                + v_r_t / (1 + d_c)
+                + (v_rp_t - v_rm_t) / (2.0 * res_radial_m)
+            )
+            w_s = v_nocoriolis * fac * (
+                dir_lat * t_vshear[i, 0] + dir_lon * t_vshear[i, 1]
+            )
+
+            # topographic component, see ``_w_topo``
+            vtrans_fac = min(max((300 * KM_TO_M - d_c) / (50 * KM_TO_M), 0), 1)
+            h_grad_fac = min(max((150 * KM_TO_M - d_c) / (30 * KM_TO_M), 0.2), 0.6)
+            w_h = (
+                (t_vtrans[i, 0] * vtrans_fac + v_nocoriolis * wdir_lat)
+                * (c_h_grad[j, 0] * h_grad_fac)
+                + (t_vtrans[i, 1] * vtrans_fac + v_nocoriolis * wdir_lon)
+                * (c_h_grad[j, 1] * h_grad_fac)
+            )
+
+            # frictional and stretching components, see ``_w_frict_stretch``
+            cd_hstep = (
+                c_cd_grad[j, 0] * (0.5 * res_radial_m * dir_lat)
+                + c_cd_grad[j, 1] * (0.5 * res_radial_m * dir_lon)
+            )
+            pre_wf_wt = 0.0
+            for rsign, d_s, d_sh, v_rs_t, v_rsh_t, v_rs_tp, v_rs_tm in (
+                (1.0, d_p, d_ph, v_rp_t, v_rph_t, v_rp_tp, v_rp_tm),
+                (-1.0, d_m, d_mh, v_rm_t, v_rmh_t, v_rm_tp, v_rm_tm),
+            ):
+                vnet = np.sqrt(
+                    (v_rsh_t * wdir_lat + t_vtrans[i, 0])**2
+                    + (v_rsh_t * wdir_lon + t_vtrans[i, 1])**2
+                )
+                cd_s = min(max(c_cd[j] + rsign * cd_hstep, 0.0), 0.01)
+                tau = -cd_s * v_rsh_t * vnet
+                dMdr = d_sh * (t_cp[i] + rsign * (v_rs_t - v_r_t) / res_radial_m) + v_rsh_t
+                pre_wf_wt += rsign * (
+                    d_s**2 / np.fmax(10, dMdr) * (
+                        np.fmin(1, (-1 + 2 * (d_s / t_rad[i])**2))
+                        * H_TROP * (v_rs_tp - v_rs_tm) / (2 * t_tstep[i])
+                        - tau
+                    )
+                )
+            w_f_plus_w_t = pre_wf_wt / (res_radial_m * d_c)
+
+            w[i, j] = np.fmax(np.fmin(w_f_plus_w_t + w_h + w_s, max_w_foreground) - w_rad, 0)
+    return w
+
 def _qs_from_t_diff_level(
     temps_in: np.ndarray,
     vmax: np.ndarray,
@@ -1590,7 +2459,8 @@ def _qs_from_t_diff_level(
     Since it's possible to compute Q from T on the same pressure level (see
     ``_r_from_t_same_level``), we can use this relationship to compute Q at one pressure level from
     T given on a different pressure level. However, since we can't solve the equation for T
-    analytically, we use the Newton-Raphson method to find the solution.
+    analytically, we use the Newton-Raphson method to find the solution. The iteration is done for
+    each value separately in a JIT-compiled kernel.
 
     Parameters
     ----------
@@ -1624,59 +2494,15 @@ def _qs_from_t_diff_level(
 
     # In the MATLAB implementation, the "Bolton1980" coefficients, and an approximative form of the
     # derivative are used in the computation of the mixing ratio.
-    r_from_t_kwargs = dict(
-        tetens_coeffs="Bolton1980" if matlab_ref_mode else "Buck1981",
-        use_cc_derivative=matlab_ref_mode,
-    )
+    tetens_coeffs = _tetens_coeffs("Bolton1980" if matlab_ref_mode else "Buck1981")
 
-    # first, calculate mixing ratio r_in from temps_in
-    r_in, _ = _r_from_t_same_level(pres_in, np.fmax(T_ICE_K - 50, temps_in), **r_from_t_kwargs)
-
-    # derive (temps_out, r_out) from (temps_in, r_in) iteratively (Newton-Raphson method)
-    r_out = np.zeros_like(r_in)
-    temps_out = temps_in.copy() + 20  # first guess, assuming that pres_out > pres_in
-
-    # exclude missing data (fill values) in the inputs
-    mask = (temps_in > 100)
-
-    # s : Total entropy, which is conserved across pressure levels when assuming a moist adiabatic
-    #     lapse rate. The additional vmax-term is a correction to account for the fact that the
-    #     eyewall is warmer than the environment at 600 hPa (thermal wind balance). For a reference
-    #     of the vmax-term, see, e.g., the considerations in the following article:
-    #
-    #         Emanuel, K. (1986): An Air-Sea Interaction Theory for Tropical Cyclones. Part I:
-    #         Steady-State Maintenance. Journal of the Atmospheric Sciences 43(6): 585–605.
-    #         https://doi.org/10.1175/1520-0469(1986)043<0585:AASITF>2.0.CO;2
-    #
-    #     Compared to eq. (34), the last term is neglected due to V >> fr. The boundary layer
-    #     theta_e under the eyewall is equated with that of the far environment, and the saturation
-    #     theta_e of the eyewall (which is constant along an M surface) is equated with the
-    #     saturation theta_e of the sea surface.
-    s_in = (
-        cap_heat_air * np.log(temps_in[mask])
-        + L_EVAP_WATER * r_in[mask] / temps_in[mask]
-        - R_DRY_AIR * np.log(pres_in)
-        + c_vmax * vmax[mask]**2 / DELTA_T_TROPOPAUSE
+    temps_in, vmax = np.broadcast_arrays(
+        np.asarray(temps_in, dtype=np.float64), np.asarray(vmax, dtype=np.float64),
     )
-
-    # solve `s_out(T_out) - s_in = 0` using the Newton-Raphson method
-    for it in range(max_iter):
-        # compute new estimate of r_out from current estimate of T_out
-        r_out[mask], drdT = _r_from_t_same_level(
-            pres_out, temps_out[mask], gradient=True, **r_from_t_kwargs,
-        )
-        s_out = (
-            cap_heat_air * np.log(temps_out[mask])
-            + L_EVAP_WATER * r_out[mask] / temps_out[mask]
-            - R_DRY_AIR * np.log(pres_out)
-        )
-        dsdT = (
-            cap_heat_air * temps_out[mask]
-            + L_EVAP_WATER * (drdT * temps_out[mask] - r_out[mask])
-        ) / temps_out[mask]**2
-
-        # take Newton step
-        temps_out[mask] -= (s_out - s_in) / dsdT
+    r_out = _r_from_t_diff_level_nb(
+        temps_in.ravel(), vmax.ravel(), float(pres_in), float(pres_out), float(cap_heat_air),
+        c_vmax, int(max_iter), tetens_coeffs, matlab_ref_mode,
+    ).reshape(temps_in.shape)
 
     if matlab_ref_mode:
         # In the MATLAB implementation, this function does actually return the mixing ratio which
@@ -1686,6 +2512,91 @@ def _qs_from_t_diff_level(
         q_out = r_out / (1 + r_out)
     return q_out
 
+@numba.njit
+def _r_from_t_diff_level_nb(
+    temps_in, vmax, pres_in, pres_out, cap_heat_air, c_vmax, max_iter, tetens_coeffs,
+    use_cc_derivative,
+):
+    """Solve for the mixing ratio at pres_out, see ``_qs_from_t_diff_level``
+
+    This is a fused version of the Newton-Raphson iteration on full arrays that was used before.
+    Since each value is treated with the same sequence of operations, the results agree with the
+    array version up to floating point round-off (relative differences below 1e-12).
+
+    Returns
+    -------
+    r_out : ndarray
+        Mixing ratio (in kg/kg) at the pressure level pres_out, or 0 where temps_in is missing.
+    """
+    r_out = np.zeros_like(temps_in)
+    log_pres_in = np.log(pres_in)
+    log_pres_out = np.log(pres_out)
+    for i in range(temps_in.size):
+        t_in = temps_in[i]
+        # exclude missing data (fill values) in the inputs
+        if not t_in > 100:
+            continue
+
+        # first, calculate mixing ratio r_in from temps_in
+        r_in, _ = _r_from_t_nb(
+            pres_in, max(T_ICE_K - 50, t_in), tetens_coeffs, False, use_cc_derivative,
+        )
+
+        # s : Total entropy, which is conserved across pressure levels when assuming a moist
+        #     adiabatic lapse rate. The additional vmax-term is a correction to account for the
+        #     fact that the eyewall is warmer than the environment at 600 hPa (thermal wind
+        #     balance). For a reference of the vmax-term, see, e.g., the considerations in the
+        #     following article:
+        #
+        #         Emanuel, K. (1986): An Air-Sea Interaction Theory for Tropical Cyclones. Part I:
+        #         Steady-State Maintenance. Journal of the Atmospheric Sciences 43(6): 585–605.
+        #         https://doi.org/10.1175/1520-0469(1986)043<0585:AASITF>2.0.CO;2
+        #
+        #     Compared to eq. (34), the last term is neglected due to V >> fr. The boundary layer
+        #     theta_e under the eyewall is equated with that of the far environment, and the
+        #     saturation theta_e of the eyewall (which is constant along an M surface) is equated
+        #     with the saturation theta_e of the sea surface.
+        s_in = (
+            cap_heat_air * np.log(t_in)
+            + L_EVAP_WATER * r_in / t_in
+            - R_DRY_AIR * log_pres_in
+            + c_vmax * vmax[i]**2 / DELTA_T_TROPOPAUSE
+        )
+
+        # solve `s_out(T_out) - s_in = 0` using the Newton-Raphson method
+        t_out = t_in + 20  # first guess, assuming that pres_out > pres_in
+        r = 0.0
+        for _ in range(max_iter):
+            # compute new estimate of r_out from current estimate of T_out
+            r, drdT = _r_from_t_nb(pres_out, t_out, tetens_coeffs, True, use_cc_derivative)
+            s_out = (
+                cap_heat_air * np.log(t_out)
+                + L_EVAP_WATER * r / t_out
+                - R_DRY_AIR * log_pres_out
+            )
+            dsdT = (cap_heat_air * t_out + L_EVAP_WATER * (drdT * t_out - r)) / t_out**2
+
+            # take Newton step
+            t_out -= (s_out - s_in) / dsdT
+        r_out[i] = r
+    return r_out
+
+@numba.njit
+def _r_from_t_nb(p_ref, temp, tetens_coeffs, gradient, use_cc_derivative):
+    """Scalar version of ``_r_from_t_same_level`` with coefficients from ``_tetens_coeffs``"""
+    a, b, c = tetens_coeffs
+    es = c * np.exp(a * (temp - T_ICE_K) / (temp - b))
+    fact = M_WATER / M_DRY_AIR
+    r_mix = fact * es / (p_ref - es)
+    drdT = 0.0
+    if gradient:
+        if use_cc_derivative:
+            r_water = 1000 * R_GAS / M_WATER
+            drdT = (L_EVAP_WATER / r_water) / temp**2 * r_mix
+        else:
+            drdT = a * (T_ICE_K - b) / (temp - b)**2 * r_mix * (1 + r_mix / fact)
+    return r_mix, drdT
+
 def _r_from_t_same_level(
     p_ref: float,
     temps: np.ndarray,
@@ -1751,15 +2662,7 @@ def _r_from_t_same_level(
         If ``gradient`` is False, this is None. Otherwise, the derivative of Q with respect to T is
         returned.
     """
-    try:
-        a, b, c = {
-            "Murray1967": (17.2693882, 35.86, 6.1078),
-            "Bolton1980": (17.67, 29.65, 6.112),
-            "Buck1981": (17.502, 32.19, 6.1121),
-            "Alduchov1996": (17.625, 30.12, 6.1094),
-        }[tetens_coeffs]
-    except KeyError as err:
-        raise ValueError(f"Unknown Tetens coefficients: {tetens_coeffs}") from err
+    a, b, c = _tetens_coeffs(tetens_coeffs)
 
     # es : saturation vapor pressure (in hPa)
     es = c * np.exp(a * (temps - T_ICE_K) / (temps - b))
@@ -1780,3 +2683,15 @@ def _r_from_t_same_level(
             drdT = a * (T_ICE_K - b) / (temps - b)**2 * r_mix * (1 + r_mix / fact)
 
     return r_mix, drdT
+
+def _tetens_coeffs(name: str) -> Tuple[float, float, float]:
+    """Coefficients (a, b, c) of the Tetens formula, see ``_r_from_t_same_level``"""
+    try:
+        return {
+            "Murray1967": (17.2693882, 35.86, 6.1078),
+            "Bolton1980": (17.67, 29.65, 6.112),
+            "Buck1981": (17.502, 32.19, 6.1121),
+            "Alduchov1996": (17.625, 30.12, 6.1094),
+        }[name]
+    except KeyError as err:
+        raise ValueError(f"Unknown Tetens coefficients: {name}") from err
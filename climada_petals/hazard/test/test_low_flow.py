@@ -21,12 +21,15 @@ Test low flow module.
 import unittest
 import numpy as np
 import pandas as pd
+import xarray as xr
 import datetime as dt
+from sklearn.cluster import DBSCAN
 
 from climada.hazard.centroids import Centroids
 from climada.util.api_client import Client
-from climada_petals.hazard.low_flow import LowFlow, unique_clusters, \
-    _compute_threshold_grid, _read_and_combine_nc, _split_bbox
+from climada_petals.hazard.low_flow import LowFlow, unique_clusters, _dbscan_slices, \
+    _compute_threshold_grid, _read_and_combine_nc, _split_bbox, _threshold_chunks, \
+    _xarray_to_geopandas
 
 
 client = Client()
@@ -89,6 +92,35 @@ class TestLowFlowDummyData(unittest.TestCase):
         self.assertEqual(data.size, 75)
         self.assertListEqual(list(data.cluster_id), list(data.target_cluster))
 
+    def test_unique_clusters_chain(self):
+        """Test unique_clusters: 2D clusters connected via a chain of data points
+        form a single 3D cluster"""
+        data = pd.DataFrame({'cluster_id': np.zeros(4, dtype=int) - 1,
+                             'c_lat_lon': [3, 3, 2, 1],
+                             'c_lat_dt_month': [2, 3, 1, 1],
+                             'c_lon_dt_month': [1, 2, 3, 2]})
+        data = unique_clusters(data)
+        self.assertListEqual(list(data.cluster_id), [1, 1, 1, 1])
+
+    def test_dbscan_slices(self):
+        """Test _dbscan_slices: same labels as DBSCAN of each slice"""
+        rnd = np.random.RandomState(0)
+        points = np.unique(np.column_stack([rnd.randint(0, 10, (200, 2)) * .5,
+                                            rnd.randint(0, 3, 200)]), axis=0)
+        points = points[rnd.permutation(points.shape[0])]
+        slice_id = pd.factorize(points[:, 2])[0]
+        for eps, min_samples in [(.75, 1), (.75, 3), (1., 4)]:
+            labels = _dbscan_slices(points[:, :2], slice_id, eps, min_samples)
+            n_clusters = 0
+            for i_slice in range(slice_id.max() + 1):
+                in_slice = slice_id == i_slice
+                x_y_uni, x_y_cpy = np.unique(points[in_slice, :2], return_inverse=True, axis=0)
+                target = DBSCAN(eps=eps, min_samples=min_samples).fit(x_y_uni).labels_
+                target = target[x_y_cpy.ravel()]
+                target[target >= 0] += n_clusters
+                self.assertListEqual(list(labels[in_slice]), list(target))
+                n_clusters = target.max(initial=n_clusters - 1) + 1
+
     def test_identify_clusters_default(self):
         """Test identify_clusters:
             clustering event from monthly days below threshold data"""
@@ -135,6 +167,25 @@ class TestLowFlowDummyData(unittest.TestCase):
             self.assertLessEqual(date, date_end)
 
 
+    def test_filter_events(self):
+        """Test filter_events: remove events with low intensity or small extent"""
+        haz = LowFlow()
+        haz.lowflow_df = init_test_data_clustering()
+        haz.identify_clusters(clus_thresh_xy=1.5, clus_thresh_t=1, min_samples=1)
+        centroids = init_test_centroids(haz.lowflow_df)
+        haz.events_from_clusters(centroids)
+        haz_filtered = haz.filter_events(min_intensity=20, min_number_cells=2)
+        self.assertListEqual(list(haz_filtered.event_id), [1, 2])
+        self.assertListEqual(haz_filtered.event_name, ['1', '3'])
+        self.assertListEqual(list(haz_filtered.date), [60, 60])
+        self.assertListEqual(list(haz_filtered.date_start), [1, 60])
+        self.assertListEqual(list(haz_filtered.date_end), [60, 60])
+        self.assertEqual(haz_filtered.intensity.shape, (2, centroids.size))
+        self.assertListEqual(list(np.asarray(haz_filtered.intensity.sum(axis=1)).ravel()),
+                             [70., 66.])
+        self.assertIs(haz_filtered.centroids, haz.centroids)
+        self.assertEqual(haz.size, 4)
+
     def test_events_from_clusters_parameter(self):
         """Test events_from_clusters: creation of events and computation of intensity based on clusters,
         requires: identify_clusters, Centroids, also tests correct intensity sum"""
@@ -273,6 +324,49 @@ class TestDischargeDataHandling(unittest.TestCase):
         self.assertEqual(len(perc_data_mask.lon.data), 27)
         self.assertEqual(max(perc_data_mask.lon.data), 8.25)
 
+    def test_compute_threshold_grid_dask(self):
+        """test that the dask computation in chunks equals the loop over bounding boxes"""
+        for mask_threshold in [None, [('mean', 1500), ('percentile', 10)]]:
+            perc_loop, mean_loop = _compute_threshold_grid(
+                5, (2001, 2005), INPUT_DIR, 'h08', 'gfdl-esm2m', 'historical', 'histsoc',
+                FN_STR_DEMO, None, ['2001_2003', '2004_2005'],
+                mask_threshold=mask_threshold, keep_dis_data=True)
+            perc_dask, mean_dask = _compute_threshold_grid(
+                5, (2001, 2005), INPUT_DIR, 'h08', 'gfdl-esm2m', 'historical', 'histsoc',
+                FN_STR_DEMO, None, ['2001_2003', '2004_2005'],
+                mask_threshold=mask_threshold, keep_dis_data=True,
+                use_dask=True, max_memory_gb=0.01)
+            xr.testing.assert_identical(perc_loop, perc_dask)
+            xr.testing.assert_identical(mean_loop, mean_dask)
+
+        chunks = _threshold_chunks(1826, 19, 27, 4, max_memory_gb=0.01)
+        self.assertEqual(chunks['time'], -1)
+        self.assertLessEqual(chunks['lat'], 19)
+        self.assertLessEqual(chunks['lon'], 27)
+        self.assertEqual(_threshold_chunks(1826, 19, 27, 4, max_memory_gb=1e3),
+                         dict(time=-1, lat=19, lon=27))
+
+    def test_xarray_to_geopandas(self):
+        """test conversion of gridded monthly data to GeoDataFrame without NaN values"""
+        ndays = np.full((2, 2, 3), np.nan)
+        ndays[0, 1, 2] = 3
+        ndays[1, 0, 0] = 5
+        data = xr.Dataset({'ndays': (('time', 'lat', 'lon'), ndays)},
+                          coords=dict(time=pd.to_datetime(['2001-01-31', '2001-02-28']),
+                                      lat=[1.25, 0.75], lon=[0.25, 0.75, 1.25]))
+        dataf = _xarray_to_geopandas(data)
+        self.assertListEqual(list(dataf.index), [5, 6])
+        self.assertListEqual(list(dataf.ndays), [3, 5])
+        self.assertListEqual(list(dataf.lat), [0.75, 1.25])
+        self.assertListEqual(list(dataf.lon), [1.25, 0.25])
+        self.assertListEqual(list(dataf.dtime), [dt.date(2001, 1, 31).toordinal(),
+                                                 dt.date(2001, 2, 28).toordinal()])
+        self.assertListEqual(list(dataf.dt_month), [2001 * 12 + 1, 2001 * 12 + 2])
+        self.assertListEqual(list(dataf.geometry.x), [1.25, 0.25])
+        self.assertListEqual(list(dataf.geometry.y), [0.75, 1.25])
+        self.assertTrue(dataf.iter_ev.all())
+        self.assertTrue((dataf.cons_id == -1).all())
+
     def test_split_bbox(self):
         """test splitting the bounding box in parts"""
         bbox = [-180, -60, 180, 75]
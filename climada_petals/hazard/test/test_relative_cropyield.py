@@ -18,10 +18,17 @@ with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
 
 Test crop potential module.
 """
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
+
 import numpy as np
+import scipy.stats
+from scipy import sparse
 from climada_petals.hazard.relative_cropyield import RelativeCropyield
-from climada_petals.hazard.relative_cropyield import rel_yield_to_int, percentile_to_int
+from climada_petals.hazard.relative_cropyield import rel_yield_to_int, percentile_to_int, \
+    set_multiple_rc_from_isimip, _percentile_rank, _mask_intensity, MANIFEST_DIR
 from climada.util.constants import DEMO_DIR as INPUT_DIR
 
 FN_STR_DEMO = 'annual_FR_DE_DEMO'
@@ -65,6 +72,13 @@ class TestRelativeCropyield(unittest.TestCase):
         self.assertAlmostEqual(np.nanmax(haz_new.intensity.toarray()), 4.0, places=5)
         self.assertAlmostEqual(haz_new.intensity.max(), 4.0, places=5)
         self.assertAlmostEqual(haz_new.intensity.min(), -1.0, places=5)
+        self.assertIsNot(haz_new.intensity, haz.intensity)
+        self.assertEqual(haz.intensity_def, 'Yearly Yield')
+
+        haz_chunks = rel_yield_to_int(haz, hist_mean, chunk_size=2)
+        self.assertEqual(haz_chunks.intensity.dtype, np.float32)
+        np.testing.assert_array_equal(haz_chunks.intensity.toarray(),
+                                      haz_new.intensity.toarray())
 
     def test_set_percentile_to_int(self):
         """Test setting intensity to percentile of the yield"""
@@ -80,6 +94,103 @@ class TestRelativeCropyield(unittest.TestCase):
         self.assertAlmostEqual(haz_new.intensity.min(), 0.2, places=5)
         self.assertAlmostEqual(haz_new.intensity.data[10], 0.6, places=5)
 
+        haz_chunks = percentile_to_int(haz, chunk_size=100)
+        np.testing.assert_array_equal(haz_chunks.intensity.toarray(),
+                                      haz_new.intensity.toarray())
+
+        # reference with other events than the hazard
+        reference = haz.intensity[[0, 1, 2, 3, 4, 0, 2]]
+        haz_ref = percentile_to_int(haz.select(event_id=haz.event_id[:3]), reference,
+                                    chunk_size=100)
+        self.assertEqual(haz_ref.intensity.shape, (3, 1092))
+        self.assertEqual(haz_ref.event_id.size, 3)
+        values = haz.intensity.toarray()
+        reference = reference.toarray()
+        for centroid in [0, 10, 500]:
+            target = [scipy.stats.percentileofscore(reference[:, centroid], event) / 100
+                      for event in values[:3, centroid]]
+            np.testing.assert_array_equal(haz_ref.intensity[:, centroid].toarray().ravel(),
+                                          target)
+
+        with self.assertRaises(ValueError):
+            percentile_to_int(haz, haz.intensity[:, :100])
+
+    def test_percentile_rank(self):
+        """Test percentile rank of the events at each centroid against scipy"""
+        values = np.array([[1., 0., 2.],
+                           [3., 0., 2.],
+                           [1., 0., np.nan],
+                           [0., 5., 2.]])
+        percentile = _percentile_rank(values)
+        for centroid in range(2):
+            target = [scipy.stats.percentileofscore(values[:, centroid], event) / 100
+                      for event in values[:, centroid]]
+            np.testing.assert_array_equal(percentile[:, centroid], target)
+        self.assertTrue(np.isnan(percentile[:, 2]).all())
+
+        reference = np.array([[2., 1., 2.],
+                              [0., 1., 2.],
+                              [1., 1., 2.]])
+        percentile = _percentile_rank(values, reference)
+        self.assertEqual(percentile.shape, values.shape)
+        for centroid in range(3):
+            target = [scipy.stats.percentileofscore(reference[:, centroid], event) / 100
+                      for event in values[:, centroid]]
+            np.testing.assert_array_equal(percentile[:, centroid], target)
+        self.assertTrue(np.isnan(_percentile_rank(reference, values)[:, 2]).all())
+
+    def test_mask_intensity(self):
+        """Test multiplication of the sparse intensity with a mask per centroid"""
+        intensity = sparse.csr_matrix(np.array([[1., 0., 2., 4.],
+                                                [0., 3., 2., np.nan]]))
+        mask = np.array([1., 0., np.nan, 0.5])
+        masked = _mask_intensity(intensity, mask)
+        np.testing.assert_array_equal(masked.toarray(),
+                                      np.multiply(intensity.toarray(), mask))
+        self.assertEqual(intensity[0, 0], 1.)
+
+    def test_set_multiple_rc_manifest(self):
+        """Test generation of hazard sets from ISIMIP files, skipping existing outputs"""
+        his_file = ('lpjml_ipsl-cm5a-lr_ewembi_historical_2005soc_co2_yield-whe-noirr_'
+                    + FN_STR_DEMO + '_1861_2005.nc')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = Path(tmp_dir, 'Input')
+            output_dir = Path(tmp_dir, 'Output')
+            input_dir.mkdir()
+            output_dir.mkdir()
+            shutil.copy(Path(INPUT_DIR, his_file), input_dir.joinpath(
+                his_file.replace(FN_STR_DEMO, 'global_annual')))
+            shutil.copy(Path(INPUT_DIR, his_file), input_dir.joinpath(
+                his_file.replace(FN_STR_DEMO, 'global_annual').replace('historical', 'rcp60')
+                .replace('1861_2005', '2006_2099')))
+
+            filenames, outputs = set_multiple_rc_from_isimip(
+                input_dir=input_dir, output_dir=output_dir, return_data=True)
+            self.assertEqual(filenames, [
+                'haz_lpjml_ipsl-cm5a-lr_historical_2005soc_co2_whe-noirr_1976-2005.hdf5',
+                'haz_lpjml_ipsl-cm5a-lr_rcp60_2005soc_co2_whe-noirr_2006-2099.hdf5',
+                'hist_mean_whe-noirr_1976-2005.hdf5'])
+            self.assertEqual(outputs[0].intensity.shape, (30, 1092))
+            self.assertEqual(outputs[1].intensity.shape, (94, 1092))
+            self.assertTrue(Path(output_dir, MANIFEST_DIR, 'manifest.json').is_file())
+
+            # outputs are up to date and not written again
+            haz_paths = [Path(output_dir, 'Hazard', filename) for filename in filenames[:2]]
+            mtimes = [path.stat().st_mtime_ns for path in haz_paths]
+            filenames_skip, outputs_skip = set_multiple_rc_from_isimip(
+                input_dir=input_dir, output_dir=output_dir)
+            self.assertEqual(filenames_skip, filenames)
+            self.assertEqual(outputs_skip[:2], [None, None])
+            np.testing.assert_array_equal(outputs_skip[2], outputs[2])
+            self.assertEqual([path.stat().st_mtime_ns for path in haz_paths], mtimes)
+
+            # modified outputs are computed again
+            with haz_paths[1].open('ab') as file:
+                file.write(b'0')
+            set_multiple_rc_from_isimip(input_dir=input_dir, output_dir=output_dir)
+            self.assertEqual(haz_paths[0].stat().st_mtime_ns, mtimes[0])
+            self.assertNotEqual(haz_paths[1].stat().st_mtime_ns, mtimes[1])
+
 # Execute Tests
 if __name__ == "__main__":
     TESTS = unittest.TestLoader().loadTestsFromTestCase(TestRelativeCropyield)
@@ -20,9 +20,12 @@ Test TCRain class
 """
 
 import datetime as dt
+from pathlib import Path
+import tempfile
 import unittest
 
 import numpy as np
+from pathos.pools import ProcessPool as Pool
 from scipy import sparse
 import xarray as xr
 
@@ -34,9 +37,23 @@ from climada_petals.hazard.tc_rainfield import (
     compute_rain,
     KN_TO_MS,
     MODEL_RAIN,
+    MODEL_VANG,
+    _centr_distances,
+    _chunk_end,
+    _compute_rain_sparse,
+    _compute_vertical_velocity,
+    _drag_sample,
+    _elevation_sample,
+    _eye_distances,
+    _horizontal_winds,
     _qs_from_t_diff_level,
     _r_from_t_same_level,
+    _raster_cache,
+    _raster_samples,
     _track_to_si_with_q_and_shear,
+    _w_frict_stretch,
+    _w_shear,
+    _w_topo,
 )
 from climada.util.api_client import Client
 from climada.util.constants import SYSTEM_DIR
@@ -178,6 +195,36 @@ class TestReader(unittest.TestCase):
         self.assertEqual(tc_haz.intensity.shape, (1, 296))
         self.assertEqual(tc_haz.intensity.nonzero()[0].size, 0)
 
+    def test_stream_file_pass(self):
+        """Test from_tracks constructor with intermediate storage in a file."""
+        tc_track = TCTracks.from_processed_ibtracs_csv([TEST_TRACK, TEST_TRACK_SHORT])
+        tc_track.equal_timestep()
+        tc_haz = TCRain.from_tracks(tc_track, centroids=CENTR_TEST_BRB, store_rainrates=True)
+
+        pool = Pool(nodes=2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stream_file = Path(tmp_dir) / "stream.h5"
+            for tc_pool in [None, pool]:
+                tc_haz_stream = TCRain.from_tracks(
+                    tc_track, centroids=CENTR_TEST_BRB, pool=tc_pool, store_rainrates=True,
+                    stream_file=stream_file,
+                )
+                self.assertTrue(stream_file.is_file())
+                self.assertEqual(tc_haz_stream.event_name, tc_haz.event_name)
+                self.assertEqual(tc_haz_stream.basin, tc_haz.basin)
+                for attr in ["event_id", "frequency", "date", "orig", "category"]:
+                    np.testing.assert_array_equal(
+                        getattr(tc_haz_stream, attr), getattr(tc_haz, attr))
+                self.assertEqual(tc_haz_stream.fraction.shape, tc_haz.fraction.shape)
+                self.assertEqual((tc_haz_stream.intensity != tc_haz.intensity).nnz, 0)
+                self.assertEqual(len(tc_haz_stream.rainrates), 2)
+                for rainrates, rainrates_ref in zip(tc_haz_stream.rainrates, tc_haz.rainrates):
+                    self.assertEqual(rainrates.shape, rainrates_ref.shape)
+                    self.assertEqual((rainrates != rainrates_ref).nnz, 0)
+        pool.close()
+        pool.join()
+        pool.clear()
+
 class TestModel(unittest.TestCase):
     """Test modelling of rainfall"""
 
@@ -222,6 +269,43 @@ class TestModel(unittest.TestCase):
                 rtol=1e-1,
             )
 
+    def test_compute_rain_sparse_chunked(self):
+        """Test that the results do not depend on the chunking of the track"""
+        tc_track = TCTracks.from_processed_ibtracs_csv(TEST_TRACK)
+        tc_track.equal_timestep()
+        track_ds = tc_track.data[0]
+        idx_centr_filter = np.arange(CENTR_TEST_BRB.size)
+        for model in ["R-CLIPER", "TCR"]:
+            results = [
+                _compute_rain_sparse(
+                    track_ds, CENTR_TEST_BRB, idx_centr_filter, model=model,
+                    store_rainrates=True, max_memory_gb=max_memory_gb,
+                )
+                for max_memory_gb in [8, 1e-4, 1e-6]
+            ]
+            intensity_ref, rainrates_ref = results[0]
+            self.assertGreater(intensity_ref.nnz, 0)
+            for intensity, rainrates in results[1:]:
+                np.testing.assert_allclose(
+                    intensity.toarray(), intensity_ref.toarray(), rtol=1e-12)
+                self.assertEqual(rainrates.shape, rainrates_ref.shape)
+                np.testing.assert_allclose(
+                    rainrates.toarray(), rainrates_ref.toarray(), rtol=1e-12)
+
+    def test_chunk_end(self):
+        """Test the planning of chunks of track positions"""
+        # position i reaches centroids i and i + 1
+        mask = np.eye(6, 7, dtype=bool) | np.eye(6, 7, k=1, dtype=bool)
+        self.assertEqual(_chunk_end(mask, 0, 7 * 6), 6)
+        # 2 positions reach 3 centroids, 3 positions reach 4 centroids
+        self.assertEqual(_chunk_end(mask, 0, 6), 2)
+        self.assertEqual(_chunk_end(mask, 2, 12), 5)
+        # the halo positions are taken into account
+        self.assertEqual(_chunk_end(mask, 2, 12, halo=1), 3)
+        # at least one position is returned
+        self.assertEqual(_chunk_end(mask, 3, 0), 4)
+        self.assertEqual(_chunk_end(mask, 5, 1e6, halo=2), 6)
+
     def test_r_from_t_same_level(self):
         """Test the derivative of _r_from_t_same_level"""
         for tetens_coeffs in ["Alduchov1996", "Buck1981", "Bolton1980", "Murray1967"]:
@@ -271,6 +355,91 @@ class TestModel(unittest.TestCase):
         q_out = _qs_from_t_diff_level(temps_in, vmax, pres_in, pres_out)
         np.testing.assert_allclose(q_out, q_out_ref, rtol=1e-4)
 
+        # on the same pressure level and without wind, the iteration converges to the input
+        # temperature
+        temps_in = np.linspace(260, 300, 9)
+        for matlab_ref_mode, tetens_coeffs in [(False, "Buck1981"), (True, "Bolton1980")]:
+            r_mix, _ = _r_from_t_same_level(pres_out, temps_in, tetens_coeffs=tetens_coeffs)
+            q_out = _qs_from_t_diff_level(
+                temps_in, np.zeros_like(temps_in), pres_out, pres_out, max_iter=20,
+                matlab_ref_mode=matlab_ref_mode,
+            )
+            q_ref = r_mix if matlab_ref_mode else r_mix / (1 + r_mix)
+            np.testing.assert_allclose(q_out, q_ref, rtol=1e-12)
+
+    def test_vertical_velocity_er11(self):
+        """Compare the fused ER11 kernel with the evaluation on full arrays"""
+        tracks = TCTracks.from_hdf5(tcrain_examples())
+        track_ds = tracks.data[0]
+        centroids = CENTR_TEST_BRB.coord
+        # shift the centroids to the track location
+        centroids = centroids - centroids.mean(axis=0) + [
+            track_ds["lat"].values.mean(), track_ds["lon"].values.mean(),
+        ]
+        for metric in ["equirect", "geosphere"]:
+            for matlab_ref_mode in [False, True]:
+                si_track = _track_to_si_with_q_and_shear(track_ds, metric=metric)
+                d_centr_ref = _centr_distances(si_track, centroids, metric=metric)
+                d_centr = _eye_distances(si_track, centroids, metric=metric)
+                np.testing.assert_allclose(d_centr, d_centr_ref[""], rtol=1e-12)
+                mask_centr_close = (d_centr <= 300e3) & (d_centr > 1)
+                self.assertTrue(mask_centr_close.any())
+
+                w = _compute_vertical_velocity(
+                    si_track, centroids, d_centr, mask_centr_close, metric=metric,
+                    matlab_ref_mode=matlab_ref_mode,
+                )
+
+                h_winds = _horizontal_winds(
+                    si_track, d_centr_ref, mask_centr_close, MODEL_VANG["ER11"],
+                    matlab_ref_mode=matlab_ref_mode,
+                )
+                w_ref = (
+                    _w_frict_stretch(si_track, d_centr_ref, h_winds, centroids)
+                    + _w_topo(si_track, d_centr_ref, h_winds, centroids)
+                    + _w_shear(si_track, d_centr_ref, h_winds)
+                )
+                w_ref = np.fmax(np.fmin(w_ref, 7.0) - 0.005, 0) * mask_centr_close
+                np.testing.assert_allclose(w, w_ref, rtol=1e-8, atol=1e-10)
+
+    def test_raster_cache(self):
+        """Test that raster samples are cached on disk and reused"""
+        centroids = CENTR_TEST_BRB.coord
+        idx_centr = np.arange(0, centroids.shape[0], 3)
+        idx_sel = idx_centr[1::4]
+        h_ref, h_grad_ref = _elevation_sample(centroids[idx_sel])
+        cd_ref, cd_grad_ref = _drag_sample(centroids[idx_sel])
+
+        cache_mem = _raster_cache(centroids, idx_centr)
+        self.assertIsInstance(cache_mem["elevation"], np.ndarray)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = _raster_cache(centroids, idx_centr, cache_dir=tmp_dir)
+            paths = sorted(Path(tmp_dir).iterdir())
+            self.assertEqual(len(paths), 2)
+            mtimes = [path.stat().st_mtime_ns for path in paths]
+
+            # a second call with the same inputs reuses the files
+            cache_again = _raster_cache(centroids, idx_centr, cache_dir=tmp_dir)
+            self.assertEqual(cache_again["elevation"], cache["elevation"])
+            self.assertEqual([path.stat().st_mtime_ns for path in paths], mtimes)
+
+            # different parameters are cached separately
+            _raster_cache(centroids, idx_centr, {"min_c_drag": 0.002}, cache_dir=tmp_dir)
+            self.assertEqual(len(list(Path(tmp_dir).iterdir())), 3)
+
+            for raster_cache in [cache_mem, cache]:
+                samples = _raster_samples(raster_cache, idx_sel)
+                np.testing.assert_allclose(samples["elevation"][0], h_ref, rtol=1e-10)
+                np.testing.assert_allclose(samples["elevation"][1], h_grad_ref, rtol=1e-10)
+                np.testing.assert_allclose(samples["drag"][0], cd_ref, rtol=1e-10)
+                np.testing.assert_allclose(samples["drag"][1], cd_grad_ref, rtol=1e-10)
+
+            # the files are not mapped after the samples are read
+            self.assertIs(type(samples["elevation"][0].base), np.ndarray)
+            maps = Path("/proc/self/maps")
+            if maps.is_file():
+                self.assertNotIn(tmp_dir, maps.read_text())
+
     def test_track_to_si(self):
         tracks = TCTracks.from_hdf5(tcrain_examples())
         track_ds = tracks.data[0]
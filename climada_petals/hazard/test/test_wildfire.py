@@ -21,12 +21,13 @@ Test Wild fire class
 
 # import os
 from pathlib import Path
+import copy
 import unittest
 import numpy as np
 import pandas as pd
 from scipy import sparse
 
-from climada_petals.hazard.wildfire import WildFire
+from climada_petals.hazard.wildfire import WildFire, _propagate_fire, _proba_fire_season
 from climada.hazard.centroids.centr import Centroids
 from climada.util.constants import ONE_LAT_KM
 
@@ -210,6 +211,26 @@ class TestMethodsFirms(unittest.TestCase):
             i_iter += 1
         self.assertEqual(i_iter, 1)
 
+    def test_firms_events_pass(self):
+        """ Test _firms_events against iterating the step-wise methods """
+        wf = WildFire()
+        for res_data, days_shift in [(0.375, 0), (0.375/2/15, 0), (0.375/ONE_LAT_KM, 3)]:
+            firms = wf._clean_firms_df(TEST_FIRMS)
+            firms['datenum'].values[100] = 7000
+            # some detections a few days later at the same place
+            firms['datenum'].values[:2000:7] += days_shift
+            firms_ref = firms.copy()
+            while firms_ref.iter_ev.any():
+                wf._firms_cons_days(firms_ref)
+                wf._firms_clustering(firms_ref, res_data)
+                wf._firms_fire(firms_ref)
+            firms = wf._firms_events(firms, res_data)
+
+            self.assertFalse(firms.iter_ev.any())
+            for col_name in ('cons_id', 'clus_id', 'event_id'):
+                np.testing.assert_array_equal(firms[col_name].values,
+                                              firms_ref[col_name].values)
+
 
     def test_calc_bright_pass(self):
         """ Test _calc_brightness """
@@ -252,6 +273,32 @@ class TestMethodsFirms(unittest.TestCase):
         self.assertEqual((wf.intensity[5, :]>0).sum(), 264)
         self.assertEqual((wf.intensity[6, :]>0).sum(), 2)
 
+    def test_calc_bright_empty_fire_pass(self):
+        """ Test _calc_brightness removes fires outside of the centroids """
+        firms = pd.DataFrame({'latitude': [0.02, 0.021, 0.04, 5.0, 0.29, 0.3],
+                              'longitude': [0.02, 0.019, 0.03, 5.0, 0.31, 0.2],
+                              'brightness': [310., 330., 320., 400., 300., 305.],
+                              'datenum': [736100, 736102, 736101, 736090, 736095, 736097],
+                              'event_id': [3, 3, 3, 5, 8, 8]})
+        centroids = Centroids.from_pnt_bounds((0, 0, 0.4, 0.4), 0.1)
+        wf = WildFire()
+        wf._calc_brightness(firms, centroids, 0.1)
+        wf.check()
+
+        self.assertTrue(np.allclose(wf.event_id, np.arange(1, 3)))
+        self.assertEqual(wf.event_name, ['1', '2'])
+        self.assertTrue(np.allclose(wf.date, [736100, 736095]))
+        self.assertTrue(np.allclose(wf.date_end, [736102, 736097]))
+        self.assertTrue(isinstance(wf.intensity, sparse.csr_matrix))
+        self.assertEqual(wf.intensity.shape, (2, centroids.size))
+        self.assertEqual(wf.fraction.nnz, 0)
+        centr_1 = np.argmin(np.abs(centroids.coord - [0., 0.]).max(axis=1))
+        centr_2 = np.argmin(np.abs(centroids.coord - [0.3, 0.2]).max(axis=1))
+        self.assertEqual(wf.intensity[0].nnz, 1)
+        self.assertAlmostEqual(wf.intensity[0, centr_1], 330.)
+        self.assertEqual(wf.intensity[1].nnz, 2)
+        self.assertAlmostEqual(wf.intensity[1, centr_2], 305.)
+
     def test_set_frequency_pass(self):
         """ Test _set_frequency """
         wf = WildFire()
@@ -303,7 +350,138 @@ class TestMethodsFirms(unittest.TestCase):
         firms['instrument'][0] = 'MODIS'
         self.assertAlmostEqual(wf._firms_resolution(firms), 1.0/ONE_LAT_KM)
 
+def propagate_fire_ref(fire_propa_matrix, on_land, prop_proba, max_it_propa,
+                       centr_ix, centr_iy):
+    """ Reference fire propagation scanning the whole grid in every step """
+    hood = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+    shape = fire_propa_matrix.shape
+    centr_burned = np.zeros(shape, int)
+    centr_burned[centr_ix, centr_iy] = 1
+    count_it = 0
+    while np.any(centr_burned == 1) and count_it < max_it_propa:
+        count_it += 1
+        burned = np.argwhere(centr_burned == 1)
+        if len(burned) > 1:
+            centr_ix, centr_iy = burned[np.random.randint(0, len(burned))]
+        else:
+            centr_ix, centr_iy = burned[0]
+        if 1 <= centr_ix < shape[0]-1 and 1 <= centr_iy < shape[1]-1 and \
+        on_land[centr_ix*shape[1] + centr_iy]:
+            prob_array = np.random.random(500)
+            burned_one_step = np.zeros(shape, int)
+            burned_one_step[centr_ix, centr_iy] = 1
+            for i_neig, (delta_x, delta_y) in enumerate(hood):
+                if prob_array[i_neig] <= prop_proba * \
+                    fire_propa_matrix[centr_ix+delta_x, centr_iy+delta_y] and \
+                centr_burned[centr_ix+delta_x, centr_iy+delta_y] == 0:
+                    burned_one_step[centr_ix+delta_x, centr_iy+delta_y] = 1
+            centr_burned += burned_one_step
+    return centr_burned
+
+def fire_propa_matrix_ref(hist_burned, blurr_steps):
+    """ Reference fire propagation matrix looping over the whole grid """
+    hood = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+    fire_propa_matrix = hist_burned.astype(float)
+    blurr_lvl = 2.**(-np.arange(blurr_steps))
+    for blurr in range(blurr_steps-1):
+        for i in range(fire_propa_matrix.shape[0]):
+            for j in range(fire_propa_matrix.shape[1]):
+                if fire_propa_matrix[i, j] == blurr_lvl[blurr]:
+                    for delta_x, delta_y in hood:
+                        try:
+                            if fire_propa_matrix[i+delta_x, j+delta_y] == 0:
+                                fire_propa_matrix[i+delta_x, j+delta_y] = blurr_lvl[blurr+1]
+                        except IndexError:
+                            pass
+    return fire_propa_matrix
+
+class TestProbaFire(unittest.TestCase):
+    """Test generation of probabilistic fires"""
+
+    def test_propagate_fire_pass(self):
+        """ Test _propagate_fire against the full grid propagation """
+        rnd = np.random.RandomState(0)
+        shape = (40, 47)
+        fire_propa_matrix = rnd.choice([0., 0.25, 0.5, 1.], size=shape)
+        on_land = rnd.random_sample(shape[0] * shape[1]) > 0.05
+        for seed, max_it in [(0, 200), (1, 5000), (2, 5000)]:
+            np.random.seed(seed)
+            centr_ref = propagate_fire_ref(fire_propa_matrix, on_land, 0.8,
+                                           max_it, 20, 20)
+            rnd_ref = np.random.random()
+
+            np.random.seed(seed)
+            rnd_state = np.random.get_state()
+            mt_state = np.append(rnd_state[1].astype(np.int64), rnd_state[2])
+            centr_burned = np.zeros(shape, int)
+            count_it = _propagate_fire(centr_burned, fire_propa_matrix, on_land,
+                                       0.8, max_it, 20 * shape[1] + 20, mt_state)
+            np.random.set_state((rnd_state[0], mt_state[:-1].astype(np.uint32),
+                                 int(mt_state[-1]), rnd_state[3], rnd_state[4]))
+
+            self.assertLessEqual(count_it, max_it)
+            self.assertGreater((centr_burned > 0).sum(), 1)
+            np.testing.assert_array_equal(centr_burned, centr_ref)
+            self.assertEqual(np.random.random(), rnd_ref)
+
+    def test_set_fire_propa_matrix_pass(self):
+        """ Test _set_fire_propa_matrix against the loop over the grid """
+        centroids = Centroids.from_pnt_bounds((0, 0, 2.3, 1.6), 0.1)
+        n_rows, n_cols = centroids.shape
+        self.assertEqual((n_rows, n_cols), (17, 24))
+        for blurr_steps in [1, 2, 4, 6]:
+            for seed in range(3):
+                intensity = sparse.random(3, centroids.size, density=0.01,
+                                          format='csr', random_state=seed)
+                # burned centroids at the grid edges
+                intensity[seed, [0, n_cols-1, (n_rows-1)*n_cols, n_rows*n_cols-1]] = 300.
+                wf = WildFire()
+                wf.centroids = copy.deepcopy(centroids)
+                wf.intensity = intensity
+                wf.ProbaParams.blurr_steps = blurr_steps
+                wf._set_fire_propa_matrix()
+
+                hist_burned = np.asarray(intensity.sum(0) > 0).reshape(n_rows, n_cols)
+                np.testing.assert_array_equal(
+                    wf.centroids.fire_propa_matrix,
+                    fire_propa_matrix_ref(hist_burned, blurr_steps))
+                self.assertEqual(wf.centroids.fire_propa_matrix.max(), 1.)
+
+    def test_proba_fire_season_pass(self):
+        """ Test _proba_fire_season """
+        rnd = np.random.RandomState(1)
+        fire_propa_matrix = rnd.choice([0., 0.5, 1.], size=(30, 35), p=[.5, .3, .2])
+        on_land = np.ones(fire_propa_matrix.size, bool)
+        proba_params = WildFire.ProbaParams(prop_proba=0.8, max_it_propa=2000)
+        hist_bright = np.array([300., 310., 320.])
+        seed_seqs = np.random.SeedSequence(3).spawn(2)
+
+        centr, bright, fires = _proba_fire_season(
+            seed_seqs[0], 2, 5, fire_propa_matrix, on_land, hist_bright,
+            proba_params, True)
+        self.assertTrue(np.all(np.diff(centr) > 0))
+        self.assertTrue(np.all(np.isin(bright, hist_bright)))
+        self.assertTrue(2 <= fires.shape[0] < 5)
+        self.assertEqual(fires.shape[1], fire_propa_matrix.size)
+        np.testing.assert_array_equal(fires.max(0).toarray().ravel()[centr], bright)
+        self.assertEqual(fires.max(0).nnz, centr.size)
+
+        # same stream gives same season, without keeping all fires
+        centr_2, bright_2, fires_2 = _proba_fire_season(
+            seed_seqs[0], 2, 5, fire_propa_matrix, on_land, hist_bright,
+            proba_params, False)
+        np.testing.assert_array_equal(centr, centr_2)
+        np.testing.assert_array_equal(bright, bright_2)
+        self.assertIsNone(fires_2)
+
+        # independent stream gives another season
+        centr_3, _, _ = _proba_fire_season(
+            seed_seqs[1], 2, 5, fire_propa_matrix, on_land, hist_bright,
+            proba_params, False)
+        self.assertFalse(np.array_equal(centr, centr_3))
+
 # Execute Tests
 if __name__ == "__main__":
     TESTS = unittest.TestLoader().loadTestsFromTestCase(TestMethodsFirms)
+    TESTS.addTests(unittest.TestLoader().loadTestsFromTestCase(TestProbaFire))
     unittest.TextTestRunner(verbosity=2).run(TESTS)
@@ -40,6 +40,8 @@ from climada.util.constants import ONE_LAT_KM
 import climada.util.dates_times as u_dt
 import climada.util.coordinates as u_coord
 
+from climada_petals.util.coordinates import closest_centroid
+
 LOGGER = logging.getLogger(__name__)
 
 HAZ_TYPE = 'WF'
@@ -171,15 +173,7 @@ class WildFire(Hazard):
         res_centr = haz._centroids_resolution(centroids)
 
         # fire identification
-        while df_firms.iter_ev.any():
-            # Compute cons_id: consecutive fires in current iteration
-            haz._firms_cons_days(df_firms)
-            # Compute clus_id: cluster identifier inside cons_id
-            haz._firms_clustering(df_firms, res_data)
-            # compute event_id
-            haz._firms_fire(df_firms)
-            LOGGER.info('Remaining fires to identify: %s.', str(np.argwhere(\
-            df_firms.iter_ev.values).size))
+        haz._firms_events(df_firms, res_data)
 
         # remove minor fires
         if haz.FirmsParams.remove_minor_fires_firms:
@@ -333,7 +327,7 @@ class WildFire(Hazard):
         self.__dict__ = WildFire.from_hist_fire_seasons_FIRMS(*args, **kwargs).__dict__
 
     def set_proba_fire_seasons(self, n_fire_seasons=1, n_ignitions=None,
-                               keep_all_fires=False):
+                               keep_all_fires=False, seed=None):
         """ Generate probabilistic fire seasons.
 
         Fire seasons are created by running n probabilistic fires per year
@@ -365,6 +359,12 @@ class WildFire(Hazard):
         keep_all_fires : bool, optional
             keep detailed list of all fires; default is False to save
             memory.
+        seed : int, optional
+            If given, every fire season is generated from its own
+            numpy.random.Generator stream spawned from this seed, in parallel
+            if self.pool is set. The result does not depend on the number of
+            CPUs used. If None (default), seasons are generated one after the
+            other from the global numpy random state.
         """
         # min/max for uniform distribtion to sample for n_fires per year
         if n_ignitions is None:
@@ -374,13 +374,24 @@ class WildFire(Hazard):
             ign_min = n_ignitions[0]
             ign_max = n_ignitions[1]
 
-        prob_fire_seasons = [] # list to save probabilistic fire seasons
-        # create probabilistic fire seasons
-        for i in range(n_fire_seasons):
-            n_ign = np.random.randint(ign_min, ign_max)
-            LOGGER.info('Setting up probabilistic fire season with %s fires.',\
-                        str(n_ign))
-            prob_fire_seasons.append(self._set_one_proba_fire_season(n_ign, seed=i))
+        if seed is not None:
+            new_intensity, prob_fire_seasons = self._set_proba_fire_seasons_streams(
+                n_fire_seasons, int(ign_min), int(ign_max), keep_all_fires, seed)
+        else:
+            prob_fire_seasons = [] # list to save probabilistic fire seasons
+            # create probabilistic fire seasons
+            for i in range(n_fire_seasons):
+                n_ign = np.random.randint(ign_min, ign_max)
+                LOGGER.info('Setting up probabilistic fire season with %s fires.',\
+                            str(n_ign))
+                prob_fire_seasons.append(self._set_one_proba_fire_season(n_ign, seed=i))
+
+            # Following values are defined for each event and centroid
+            new_intensity = sparse.lil_matrix((np.zeros([n_fire_seasons,
+                                                         len(self.centroids.lat)])))
+            for idx, wf in enumerate(prob_fire_seasons):
+                new_intensity[idx] = sparse.csr_matrix(wf).max(0)
+            new_intensity = new_intensity.tocsr()
 
         if keep_all_fires:
             self.prob_fire_seasons = prob_fire_seasons
@@ -396,10 +407,6 @@ class WildFire(Hazard):
         self._set_frequency()
 
         # Following values are defined for each event and centroid
-        new_intensity = sparse.lil_matrix((np.zeros([n_fire_seasons, len(self.centroids.lat)])))
-        for idx, wf in enumerate(prob_fire_seasons):
-            new_intensity[idx] = sparse.csr_matrix(wf).max(0)
-        new_intensity = new_intensity.tocsr()
         self.intensity = sparse.vstack([self.intensity, new_intensity],
                                        format='csr')
         self.fraction = sparse.csr_matrix(self.intensity.shape)
@@ -805,6 +812,81 @@ class WildFire(Hazard):
             else:
                 df_firms.iter_ev.values[df_firms.event_id.values == ev_id] = True
 
+    def _firms_events(self, df_firms, res_data):
+        """ Identify fire events of all data points, equivalent to iterating
+        _firms_cons_days, _firms_clustering and _firms_fire until all events
+        are temporally consecutive.
+
+        In every iteration, the temporal clusters of all remaining events are
+        computed at once from the data sorted by event and date. The
+        geographic clusters of all temporal clusters are then computed at
+        once as connected components of points not further apart than the
+        DBSCAN eps used in _firms_clustering, see _firms_cluster_roots.
+        Cluster and event identifiers are numbered as in the step-wise
+        methods.
+
+        Parameters
+        ----------
+        df_firms : pd.DataFrame
+            FIRMS data
+        res_data : float
+            FIRMS instrument resolution in degrees
+
+        Returns
+        -------
+        df_firms : pd.DataFrame
+            FIRMS data including info on temporal cluster, spatial cluster
+            and final cluster (=event) per point
+        """
+        days_thres = self.FirmsParams.days_thres_firms
+        clus_eps = res_data * self.FirmsParams.clus_thres_firms
+        datenum = df_firms.datenum.values
+        lat_lon = df_firms[['latitude', 'longitude']].values.astype(float)
+        iter_ev = df_firms.iter_ev.values.copy()
+        cons_id = df_firms.cons_id.values.copy()
+        clus_id = df_firms.clus_id.values.copy()
+        event_id = df_firms.event_id.values.copy()
+
+        while iter_ev.any():
+            # Compute cons_id: consecutive fires in current iteration
+            iter_idx = np.flatnonzero(iter_ev)
+            iter_idx = iter_idx[np.lexsort((datenum[iter_idx], event_id[iter_idx]))]
+            new_cons = np.ones(iter_idx.size, bool)
+            new_cons[1:] = (np.diff(event_id[iter_idx]) != 0) | \
+                (np.abs(np.diff(datenum[iter_idx])) >= days_thres)
+            cons_iter = np.cumsum(new_cons) - 1
+            cons_id[iter_idx] = cons_id.max() + 1 + cons_iter
+
+            # Compute clus_id: connected components of points closer than
+            # clus_eps within the same cons_id
+            node_pnt, node_inv = _unique_rows(cons_iter, lat_lon[iter_idx, 0],
+                                              lat_lon[iter_idx, 1])
+            node_cons = cons_iter[node_pnt]
+            node_root = _firms_cluster_roots(node_cons, lat_lon[iter_idx[node_pnt], 0],
+                                             lat_lon[iter_idx[node_pnt], 1], clus_eps)
+            # clusters are numbered by their first (lat, lon) in each cons_id
+            clus_first = np.unique(node_root)
+            clus_rank = np.arange(clus_first.size)
+            clus_rank -= np.maximum.accumulate(np.where(
+                np.r_[True, np.diff(node_cons[clus_first]) != 0], clus_rank, 0))
+            clus_id[iter_idx] = clus_rank[np.searchsorted(clus_first, node_root)][node_inv]
+
+            # compute event_id: unique combination of cons_id and clus_id
+            _, event_id = _unique_rows(cons_id, clus_id)
+
+            # iterate events which are not consecutive in time
+            ev_sort = np.lexsort((datenum, event_id))
+            ev_gap = (np.diff(event_id[ev_sort]) == 0) & \
+                (np.diff(datenum[ev_sort]) >= days_thres)
+            iter_ev = np.isin(event_id, event_id[ev_sort[1:][ev_gap]])
+            LOGGER.info('Remaining fires to identify: %s.', str(iter_ev.sum()))
+
+        df_firms['iter_ev'] = iter_ev
+        df_firms['cons_id'] = cons_id
+        df_firms['clus_id'] = clus_id
+        df_firms['event_id'] = event_id
+        return df_firms
+
     @staticmethod
     def _firms_remove_minor_fires(df_firms, minor_fires_thres):
         """ Remove fires containg fewer FIRMS entries than threshold.
@@ -852,32 +934,40 @@ class WildFire(Hazard):
         res_centr : float
             centroids resolution in centroids unit
         """
-        uni_ev = np.unique(df_firms['event_id'].values)
-        num_ev = uni_ev.size
         num_centr = centroids.size
 
-        # For one fire, if more than one points of firms dataframe have the
-        # same coordinates, take the maximum brightness value
-        # of these points (maximal damages).
+        # Search closest centroid of each unique (lat,lon) point, for all
+        # fires at once. Only the coordinates are sent to the workers.
+        uni_first, uni_inv = _unique_rows(df_firms['latitude'].values,
+                                          df_firms['longitude'].values)
+        lat_lon_uni = df_firms[['latitude', 'longitude']].values[uni_first]
         tree_centr = BallTree(centroids.coord, metric='chebyshev')
         if self.pool:
-            chunksize = max(min(num_ev//self.pool.ncpus, 1000), 1)
-            bright_list = self.pool.map(self._brightness_one_fire,
-                                        itertools.repeat(df_firms, num_ev),
-                                        itertools.repeat(tree_centr, num_ev),
-                                        uni_ev, itertools.repeat(res_centr),
-                                        itertools.repeat(num_centr),
-                                        chunksize=chunksize)
+            lat_lon_chunks = np.array_split(
+                lat_lon_uni, max(min(lat_lon_uni.shape[0], self.pool.ncpus), 1))
+            ind = np.concatenate(self.pool.map(
+                closest_centroid, itertools.repeat(tree_centr, len(lat_lon_chunks)),
+                lat_lon_chunks, itertools.repeat(res_centr, len(lat_lon_chunks))))
         else:
-            bright_list = []
-            for ev_id in uni_ev:
-                bright_list.append(self._brightness_one_fire(df_firms, tree_centr, \
-                ev_id, res_centr, num_centr))
-
-        bright_list, df_firms = self._remove_empty_fires(bright_list, df_firms)
+            ind = closest_centroid(tree_centr, lat_lon_uni, res_centr)
+        ind = ind[uni_inv]
 
-        uni_ev = np.unique(df_firms['event_id'].values)
-        num_ev = uni_ev.size
+        # For one fire, if more than one points of firms dataframe are mapped
+        # on the same centroid, take the maximum brightness value
+        # of these points (maximal damages).
+        uni_ev, ev_row = np.unique(df_firms['event_id'].values, return_inverse=True)
+        in_centr = ind >= 0
+        intensity = _scatter_max(ev_row[in_centr], ind[in_centr],
+                                 df_firms['brightness'].values[in_centr],
+                                 (uni_ev.size, num_centr))
+
+        # Remove fires which contain no intensity. This happens for events
+        # which occur outside of the defined centroids.
+        ev_keep = np.diff(intensity.indptr) > 0
+        intensity = intensity[ev_keep]
+        num_ev = intensity.shape[0]
+        LOGGER.info('Returning %s fires that impacted the defined centroids.', num_ev)
+        ev_dates = df_firms.groupby('event_id')['datenum'].agg(['min', 'max'])
 
         # save
         self.haz_type = 'WFsingle'
@@ -887,95 +977,71 @@ class WildFire(Hazard):
         # Following values are defined for each fire
         self.event_id = np.arange(1, num_ev+1).astype(int)
         self.event_name = list(map(str, self.event_id))
-        self.date = np.zeros(num_ev, int)
-        self.date_end = np.zeros(num_ev, int)
-        for ev_idx, ev_id in enumerate(uni_ev):
-            self.date[ev_idx] = df_firms[df_firms.event_id == ev_id].datenum.min()
-            self.date_end[ev_idx] = df_firms[df_firms.event_id == ev_id].datenum.max()
+        self.date = ev_dates['min'].values[ev_keep].astype(int)
+        self.date_end = ev_dates['max'].values[ev_keep].astype(int)
         self.orig = np.ones(num_ev, bool)
         self._set_frequency()
 
         # Following values are defined for each fire and centroid
-        intensity = sparse.lil_matrix(np.zeros((num_ev, num_centr)))
-        for idx, ev_bright in enumerate(bright_list):
-            intensity[idx] = ev_bright
-        self.intensity = intensity.tocsr()
+        self.intensity = intensity
         self.fraction = sparse.csr_matrix(self.intensity.shape)
 
-    @staticmethod
-    def _brightness_one_fire(df_firms, tree_centr, ev_id, res_centr, num_centr):
-        """ For a given fire, fill in an intensity np.array with the maximum brightness
-        at each centroid.
-
-        Parameters
-        ----------
-        df_firms : pd.DataFrame
-            FIRMS data
-        centroids : Centroids
-        ev_id : int
-            id of the selected event
-
-        Returns
-        -------
-        brightness_ev : lil_matrix
-            maximum brightness at each centroids
-        """
-        LOGGER.debug('Brightness corresponding to FIRMS event %s.', str(ev_id))
-        temp_firms = df_firms.reindex(
-            index=(np.argwhere(df_firms['event_id'].values == ev_id).reshape(-1,)),
-            columns=['latitude', 'longitude', 'brightness', 'datenum'])
-
-        # Identifies the unique (lat,lon) points of the firms dataframe -> lat_lon_uni
-        # Set the same index value for each duplicate (lat,lon) points -> lat_lon_cpy
-        lat_lon_uni, lat_lon_cpy = np.unique(temp_firms[['latitude', 'longitude']].values,
-                                             return_inverse=True, axis=0)
-        index_uni = np.unique(lat_lon_cpy, axis=0)
-
-        # Search closest centroid for each firms point
-        ind, _ = tree_centr.query_radius(lat_lon_uni, r=res_centr/2, count_only=False,
-                                         return_distance=True, sort_results=True)
-        ind = np.array([ind_i[0] if ind_i.size else -1 for ind_i in ind])
-
-        brightness_ev = _fill_intensity_max(num_centr, ind, index_uni, lat_lon_cpy,
-                                            temp_firms['brightness'].values)
-
-        return sparse.lil_matrix(brightness_ev)
-
-    @staticmethod
-    def _remove_empty_fires(bright_list, df_firms):
-        """ Removes instances which were identified as an eventbut which
-        contain no intensity. This happens for events which occur
-        outside of the defined centroids.
+    def _set_proba_fire_seasons_streams(self, n_fire_seasons, ign_min, ign_max,
+                                        keep_all_fires, seed):
+        """ Generate probabilistic fire seasons from independent random
+        streams, in parallel if self.pool is set.
 
         Parameters
         ----------
-        bright_list : list
-            idnividual wild fires
-        firms : pd.DataFrame
-            FIRMS data
+        n_fire_seasons : int
+            number of fire seasons to be generated
+        ign_min : int
+            minimum number of fires per season
+        ign_max : int
+            maximum number of fires per season (exclusive)
+        keep_all_fires : bool
+            return the intensity of every single fire
+        seed : int
+            seed from which the streams of the fire seasons are spawned
 
         Returns
         -------
-        bright_list_nonzero : list
-            list with events that occured on the defined centroids
-        firms : pd.DataFrame
-            FIRMS data (with data that occured on the defined centroids)
+        intensity : csr_matrix
+            max intensity of every fire season at every centroid
+        prob_fire_seasons : list
+            csr_matrix with the intensity of every fire per season, empty
+            if keep_all_fires is False
         """
-        bright_list_nonzero = []
-        event_id_new = 1
-        for i, br_list in enumerate(bright_list):
-            if br_list.count_nonzero() > 0:
-                bright_list_nonzero.append(br_list)
-                df_firms.event_id.values[df_firms.event_id == i+1] = event_id_new
-                event_id_new = event_id_new + 1
-            else:
-                df_firms = df_firms.drop(df_firms[df_firms.event_id == i].index)
-
-        df_firms = df_firms.reset_index()
-        LOGGER.info('Returning %s fires that impacted the defined centroids.',
-                    len(bright_list_nonzero))
-
-        return bright_list_nonzero, df_firms
+        # set fire propagation matrix if not already defined
+        if not hasattr(self.centroids, 'fire_propa_matrix'):
+            self._set_fire_propa_matrix()
+        fire_propa_matrix = np.asarray(self.centroids.fire_propa_matrix, dtype=float)
+        on_land = np.asarray(self.centroids.on_land, dtype=bool).reshape(-1)
+
+        seed_seqs = np.random.SeedSequence(seed).spawn(n_fire_seasons)
+        season_args = (itertools.repeat(ign_min, n_fire_seasons),
+                       itertools.repeat(ign_max, n_fire_seasons),
+                       itertools.repeat(fire_propa_matrix, n_fire_seasons),
+                       itertools.repeat(on_land, n_fire_seasons),
+                       itertools.repeat(self.intensity.data, n_fire_seasons),
+                       itertools.repeat(self.ProbaParams, n_fire_seasons),
+                       itertools.repeat(keep_all_fires, n_fire_seasons))
+        if self.pool:
+            chunksize = max(min(n_fire_seasons//self.pool.ncpus, 1000), 1)
+            seasons = self.pool.map(_proba_fire_season, seed_seqs, *season_args,
+                                    chunksize=chunksize)
+        else:
+            seasons = list(map(_proba_fire_season, seed_seqs, *season_args))
+
+        # assemble the csr matrix of all seasons at once
+        indptr = np.zeros(n_fire_seasons + 1, dtype=int)
+        indptr[1:] = np.cumsum([centr.size for centr, _, _ in seasons])
+        intensity = sparse.csr_matrix(
+            (np.concatenate([bright for _, bright, _ in seasons]),
+             np.concatenate([centr for centr, _, _ in seasons]), indptr),
+            shape=(n_fire_seasons, fire_propa_matrix.size))
+        prob_fire_seasons = [fires for _, _, fires in seasons if fires is not None]
+        return intensity, prob_fire_seasons
 
     def _set_one_proba_fire_season(self, n_ignitions, seed=8):
         """ Generate a probabilistic fire season.
@@ -1001,7 +1067,7 @@ class WildFire(Hazard):
 
         return proba_fires
 
-    def _run_one_fire(self):
+    def _run_one_fire(self, rng=None):
         """ Run one bushfire on a fire propagation probability matrix.
             If the matrix is not defined, it is constructed using past fire
             experience -> a fire can only propagate on centroids that burned
@@ -1037,6 +1103,9 @@ class WildFire(Hazard):
         ----------
         self : climada.hazard.WildFire instance
             needs to contain information of at least 1 historic wildfire
+        rng : np.random.Generator, optional
+            MT19937 based generator to draw random numbers from. If None,
+            the global numpy random state is used.
 
         Returns
         -------
@@ -1047,99 +1116,10 @@ class WildFire(Hazard):
         if not hasattr(self.centroids, 'fire_propa_matrix'):
             self._set_fire_propa_matrix()
 
-        # Ignation only at centroids that burned in the past
-        pos_centr = np.argwhere(self.centroids.fire_propa_matrix.reshape( \
-            len(self.centroids.lat)) == 1)[:, 1]
-
-        LOGGER.debug('Start ignition.')
-        # Random selection of ignition centroid
-        for _ in range(self.centroids.size):
-            centr = np.random.choice(pos_centr)
-            centr_ix = int(centr/self.centroids.shape[1])
-            centr_iy = centr%self.centroids.shape[1]
-            centr_ix = max(0, centr_ix)
-            centr_ix = min(self.centroids.shape[0]-1, centr_ix)
-            centr_iy = max(0, centr_iy)
-            centr_iy = min(self.centroids.shape[1]-1, centr_iy)
-            centr = centr_ix*self.centroids.shape[1] + centr_iy
-            if 1 <= centr_ix < self.centroids.shape[0] - 1 and \
-            1 <= centr_iy < self.centroids.shape[1] - 1:
-                break
-
-        LOGGER.debug('Propagate fire.')
-        centr_burned = np.zeros((self.centroids.shape), int)
-        centr_burned[centr_ix, centr_iy] = 1
-        # Iterate the fire according to the propagation rules
-        count_it = 0
-        while np.any(centr_burned == 1) and count_it < self.ProbaParams.max_it_propa:
-            count_it += 1
-            # Select randomly one of the burning centroids
-            # and propagate throught its neighborhood
-            burned = np.argwhere(centr_burned == 1)
-            if len(burned) > 1:
-                centr_ix, centr_iy = burned[np.random.randint(0, len(burned))]
-            elif len(burned) == 1:
-                centr_ix, centr_iy = burned[0]
-            if not count_it % (self.ProbaParams.max_it_propa-1):
-                LOGGER.warning('Fire propagation not converging at iteration %s.',
-                               count_it)
-            if 1 <= centr_ix < self.centroids.shape[0]-1 and \
-            1 <= centr_iy < self.centroids.shape[1]-1 and \
-            self.centroids.on_land[(centr_ix*self.centroids.shape[1] + centr_iy)]:
-                centr_burned = self._fire_propagation_on_matrix(self.centroids.shape, \
-                    self.centroids.fire_propa_matrix, self.ProbaParams.prop_proba, \
-                    centr_ix, centr_iy, centr_burned, np.random.random(500))
-
-        return centr_burned
-
-    @staticmethod
-    @numba.njit
-    def _fire_propagation_on_matrix(centr_shape, fire_propa_matrix, prop_proba,
-                                    centr_ix, centr_iy, centr_burned, prob_array):
-        """ Propagation of the fire in the 8 neighbouring cells around
-        (centr_ix, centr_iy) according to propagation rules.
-
-        Parameters
-        ----------
-        centr_shape : np.array
-            shape of centroids array
-        fire_propa_matrix : np.array
-            fire proagation matrix indicating centroid specific fire
-            spread probability
-        prop_proba : float
-            global propagation probability
-        centr_ix : int
-            x coordinates of the burning centroid in the centroids matrix
-        centr_iy : int
-            y coordinates of the burning centroid in the centroids matrix
-        centr_burned : np.array
-            array containing information on burned centroids
-        prob_array: np.array
-            array of random numbers to draw from for random fire propagation
-
-        Returns
-        -------
-        centr_burned : np.array
-            updated centr_burned matrix
-        """
-        # Neighbourhood
-        hood = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
-
-        # Creation of the temporary centroids grids
-        burned_one_step = np.zeros(centr_shape, dtype=numba.int32)
-        burned_one_step[centr_ix, centr_iy] = 1
-
-        # Displacements from a centroid to its eight neighbours
-        for i_neig, (delta_x, delta_y) in enumerate(hood):
-            if prob_array[i_neig] <= prop_proba * \
-                fire_propa_matrix[centr_ix+delta_x, centr_iy+delta_y] and \
-            centr_burned[centr_ix+delta_x, centr_iy+delta_y] == 0:
-                burned_one_step[centr_ix+delta_x, centr_iy+delta_y] = 1
-
-        # Calculate burned area
-        centr_burned += burned_one_step
-
-        return centr_burned
+        return _run_one_fire_on_grid(
+            np.asarray(self.centroids.fire_propa_matrix, dtype=float),
+            np.asarray(self.centroids.on_land, dtype=bool).reshape(-1),
+            self.ProbaParams, rng)
 
     def _set_proba_intensity(self, centr_burned):
         """ The intensity values are chosen randomly at every burned centroid
@@ -1179,6 +1159,10 @@ class WildFire(Hazard):
         matrix that coresponds to the shape of the centroids and thus not have
         to be set this way.
 
+        Only the historically burned centroids and the blurred centroids of
+        the previous step are visited, so that the cost scales with the
+        burned area rather than with the grid size.
+
         This method modifies self (climada.hazard.WildFire instance) by
         populating self.centroids.fire_propa_matrix as np.array
 
@@ -1187,31 +1171,30 @@ class WildFire(Hazard):
         self : climada.hazard.WildFire instance
         """
         # historically burned centroids
-        hist_burned = np.zeros(self.centroids.lat.shape, dtype=bool)
         hist_burned = self.intensity.sum(0) > 0.
         self.centroids.hist_burned = hist_burned
 
-        fire_propa_matrix = hist_burned.reshape(self.centroids.shape).astype(float)
-        blurr_lvl = np.ones(self.ProbaParams.blurr_steps)
-        # exponential decay of fire propagation on cell level
-        for i in range(self.ProbaParams.blurr_steps):
-            blurr_lvl[i] = 2.**(-i)
+        n_rows, n_cols = self.centroids.shape
+        fire_propa_matrix = np.zeros(n_rows * n_cols)
+        blurr_front = np.flatnonzero(np.asarray(hist_burned).reshape(-1))
+        fire_propa_matrix[blurr_front] = 1.
         # Neighbourhood
-        hood = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+        hood = np.array([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
 
-        # loop over matrix to create blurr around historical fires
+        # blurr with exponential decay of fire propagation on cell level: in
+        # every step, the unburned neighbours of the centroids blurred in the
+        # previous step get half their propagation probability.
+        # Neighbours across the lower grid edges are taken from the opposite
+        # edge, as they used to be through negative indexing.
         for blurr in range(self.ProbaParams.blurr_steps-1):
-            for i in range(fire_propa_matrix.shape[0]):
-                for j in range(fire_propa_matrix.shape[1]):
-                    if fire_propa_matrix[i, j] == blurr_lvl[blurr]:
-                        for _, (delta_x, delta_y) in enumerate(hood):
-                            try:
-                                if fire_propa_matrix[i+delta_x, j+delta_y] == 0:
-                                    fire_propa_matrix[i+delta_x, j+delta_y] = blurr_lvl[blurr+1]
-                            except IndexError:
-                                pass
-
-        self.centroids.fire_propa_matrix = fire_propa_matrix
+            neig_x = (blurr_front // n_cols)[:, None] + hood[:, 0]
+            neig_y = (blurr_front % n_cols)[:, None] + hood[:, 1]
+            in_grid = (neig_x < n_rows) & (neig_y < n_cols)
+            neig = np.mod(neig_x[in_grid], n_rows) * n_cols + np.mod(neig_y[in_grid], n_cols)
+            blurr_front = np.unique(neig[fire_propa_matrix[neig] == 0])
+            fire_propa_matrix[blurr_front] = 2.**(-blurr-1)
+
+        self.centroids.fire_propa_matrix = fire_propa_matrix.reshape(n_rows, n_cols)
 
     def plot_fire_prob_matrix(self):
         """ Plots fire propagation probability matrix as contour plot.
@@ -1283,33 +1266,461 @@ class WildFire(Hazard):
             ens_size = 1
         self.frequency = np.ones(self.event_id.size) / delta_time / ens_size
 
+def _scatter_max(rows, cols, values, shape):
+    """ Sparse matrix with the maximum of the values given at each (row, col).
+    Non positive maxima are not stored.
+
+    Parameters
+    ----------
+    rows : np.array
+        row index of each value
+    cols : np.array
+        column index of each value
+    values : np.array
+        values to reduce
+    shape : tuple
+        shape of the matrix
+
+    Returns
+    -------
+    mat : sparse.csr_matrix
+        maximum value at each (row, col)
+    """
+    order = np.lexsort((cols, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    new_elem = np.ones(order.size, bool)
+    new_elem[1:] = (np.diff(rows) != 0) | (np.diff(cols) != 0)
+    elem_start = np.flatnonzero(new_elem)
+    data = np.maximum.reduceat(values, elem_start) if elem_start.size else values
+    pos = data > 0
+    return sparse.csr_matrix((data[pos], (rows[elem_start][pos], cols[elem_start][pos])),
+                             shape=shape)
+
+def _unique_rows(*columns):
+    """ Unique rows of the given columns, as np.unique(np.column_stack(columns),
+    axis=0, return_inverse=True) but without sorting the rows as records.
+
+    Parameters
+    ----------
+    columns : np.array
+        columns of equal length
+
+    Returns
+    -------
+    row_first : np.array
+        index of the first occurrence of each unique row, sorted by the
+        unique rows
+    row_inv : np.array
+        index of the unique row of each row
+    """
+    order = np.lexsort(columns[::-1])
+    new_row = np.zeros(order.size, bool)
+    new_row[:1] = True
+    for col in columns:
+        new_row[1:] |= np.diff(col[order]) != 0
+    row_inv = np.empty(order.size, int)
+    row_inv[order] = np.cumsum(new_row) - 1
+    return order[new_row], row_inv
+
+def _firms_cluster_roots(group, lat, lon, clus_eps):
+    """ Connected components of points closer than clus_eps in each group.
+
+    The points are binned into cells small enough for all points of a cell to
+    be connected. Points of neighbouring cells are only compared if the cells
+    are not connected yet, so that dense fires do not require all pairs of
+    neighbours as DBSCAN does.
+
+    Parameters
+    ----------
+    group : np.array
+        group of each point, points of different groups are never connected
+    lat : np.array
+        latitude of each point
+    lon : np.array
+        longitude of each point
+    clus_eps : float
+        maximum distance of connected points in degrees
+
+    Returns
+    -------
+    root : np.array
+        smallest index of the points in the component of each point
+    """
+    cell_size = clus_eps / 1.4142136 # slightly smaller than clus_eps/sqrt(2)
+    cell_lat = np.floor(lat / cell_size).astype(np.int64)
+    cell_lon = np.floor(lon / cell_size).astype(np.int64)
+    cell_order = np.lexsort((cell_lon, cell_lat, group))
+    cell_start = np.flatnonzero(np.r_[True, (np.diff(group[cell_order]) != 0)
+                                      | (np.diff(cell_lat[cell_order]) != 0)
+                                      | (np.diff(cell_lon[cell_order]) != 0)])
+    return _union_cells(cell_order, np.r_[cell_start, lat.size],
+                        group[cell_order[cell_start]], cell_lat[cell_order[cell_start]],
+                        cell_lon[cell_order[cell_start]], lat, lon, clus_eps**2)
+
 @numba.njit
-def _fill_intensity_max(num_centr, ind, index_uni, lat_lon_cpy, fir_bright):
-    """ Assigns maximum intensity value for each centroid. This is required
-    as it can happen that several firms data points are mapped on to one
-    centroid.
+def _find_root(root, idx):
+    """ Find the root of idx in a union-find array, halving the path. """
+    while root[idx] != idx:
+        root[idx] = root[root[idx]]
+        idx = root[idx]
+    return idx
+
+@numba.njit
+def _union_cells(cell_order, cell_start, cell_group, cell_lat, cell_lon,
+                 lat, lon, clus_eps2):
+    """ Union-find over the cells of _firms_cluster_roots.
+
+    Parameters
+    ----------
+    cell_order : np.array
+        point indices sorted by cell
+    cell_start : np.array
+        start of each cell in cell_order, followed by the number of points
+    cell_group : np.array
+        group of each cell, cells are sorted by group, cell_lat, cell_lon
+    cell_lat : np.array
+        latitude bin of each cell
+    cell_lon : np.array
+        longitude bin of each cell
+    lat : np.array
+        latitude of each point
+    lon : np.array
+        longitude of each point
+    clus_eps2 : float
+        square of the maximum distance of connected points
+
+    Returns
+    -------
+    root : np.array
+        smallest index of the points in the component of each point
+    """
+    n_cells = cell_group.size
+    root = np.arange(lat.size)
+    # all points of a cell are connected
+    for i_cell in range(n_cells):
+        first = cell_order[cell_start[i_cell]]
+        for i_pnt in range(cell_start[i_cell] + 1, cell_start[i_cell + 1]):
+            first = min(first, cell_order[i_pnt])
+        for i_pnt in range(cell_start[i_cell], cell_start[i_cell + 1]):
+            root[cell_order[i_pnt]] = first
+
+    # neighbouring cells up to two bins away, each pair of cells once
+    for i_cell in range(n_cells):
+        for delta_lat in range(0, 3):
+            for delta_lon in range(-2, 3):
+                if delta_lat == 0 and delta_lon <= 0:
+                    continue
+                # binary search of neighbouring cell
+                key = (cell_group[i_cell], cell_lat[i_cell] + delta_lat,
+                       cell_lon[i_cell] + delta_lon)
+                low, high = i_cell + 1, n_cells
+                while low < high:
+                    mid = (low + high) // 2
+                    if (cell_group[mid], cell_lat[mid], cell_lon[mid]) < key:
+                        low = mid + 1
+                    else:
+                        high = mid
+                if low == n_cells or \
+                (cell_group[low], cell_lat[low], cell_lon[low]) != key:
+                    continue
+                root_i = _find_root(root, cell_order[cell_start[i_cell]])
+                root_j = _find_root(root, cell_order[cell_start[low]])
+                if root_i == root_j:
+                    continue
+                # connect if any pair of points is close enough
+                connected = False
+                for i_pnt in cell_order[cell_start[i_cell]:cell_start[i_cell + 1]]:
+                    for j_pnt in cell_order[cell_start[low]:cell_start[low + 1]]:
+                        if (lat[i_pnt] - lat[j_pnt])**2 + (lon[i_pnt] - lon[j_pnt])**2 \
+                        <= clus_eps2:
+                            connected = True
+                            break
+                    if connected:
+                        break
+                if connected:
+                    root[max(root_i, root_j)] = min(root_i, root_j)
+
+    for i_pnt in range(lat.size):
+        root[i_pnt] = _find_root(root, i_pnt)
+    return root
+
+def _run_one_fire_on_grid(fire_propa_matrix, on_land, proba_params, rng=None):
+    """ Ignite and propagate one fire, see WildFire._run_one_fire.
+
+    Parameters
+    ----------
+    fire_propa_matrix : np.array
+        fire proagation matrix with the shape of the centroids
+    on_land : np.array
+        flat bool array indicating centroids on land
+    proba_params : WildFire.ProbaParams
+        parameters of the propagation
+    rng : np.random.Generator, optional
+        MT19937 based generator to draw random numbers from. If None, the
+        global numpy random state is used.
+
+    Returns
+    -------
+    centr_burned : np.array
+        array indicating which centroids burned
+    """
+    rnd = np.random if rng is None else rng
+    shape = fire_propa_matrix.shape
+
+    # Ignation only at centroids that burned in the past
+    pos_centr = np.flatnonzero(fire_propa_matrix == 1)
+
+    LOGGER.debug('Start ignition.')
+    # Random selection of ignition centroid
+    for _ in range(fire_propa_matrix.size):
+        centr = rnd.choice(pos_centr)
+        centr_ix = int(centr/shape[1])
+        centr_iy = centr%shape[1]
+        centr_ix = max(0, centr_ix)
+        centr_ix = min(shape[0]-1, centr_ix)
+        centr_iy = max(0, centr_iy)
+        centr_iy = min(shape[1]-1, centr_iy)
+        if 1 <= centr_ix < shape[0] - 1 and 1 <= centr_iy < shape[1] - 1:
+            break
+
+    LOGGER.debug('Propagate fire.')
+    centr_burned = np.zeros(shape, int)
+    # Iterate the fire according to the propagation rules. The numba engine
+    # draws from a copy of the MT19937 state, which is written back
+    # afterwards, so that results depend on the seed only.
+    if rng is None:
+        rnd_state = np.random.get_state()
+        mt_state = np.append(rnd_state[1].astype(np.int64), rnd_state[2])
+    else:
+        rnd_state = rng.bit_generator.state
+        mt_state = np.append(rnd_state['state']['key'].astype(np.int64),
+                             rnd_state['state']['pos'])
+    count_it = _propagate_fire(centr_burned, fire_propa_matrix, on_land,
+                               proba_params.prop_proba, proba_params.max_it_propa,
+                               centr_ix*shape[1] + centr_iy, mt_state)
+    if rng is None:
+        np.random.set_state((rnd_state[0], mt_state[:-1].astype(np.uint32),
+                             int(mt_state[-1]), rnd_state[3], rnd_state[4]))
+    else:
+        rnd_state['state'] = {'key': mt_state[:-1].astype(np.uint32),
+                              'pos': int(mt_state[-1])}
+        rng.bit_generator.state = rnd_state
+    if count_it >= proba_params.max_it_propa - 1:
+        LOGGER.warning('Fire propagation not converging at iteration %s.',
+                       proba_params.max_it_propa - 1)
+
+    return centr_burned
+
+def _proba_fire_season(seed_seq, ign_min, ign_max, fire_propa_matrix, on_land,
+                       hist_bright, proba_params, keep_all_fires):
+    """ Generate one probabilistic fire season from its own random stream.
+
+    Parameters
+    ----------
+    seed_seq : np.random.SeedSequence
+        seed of the random stream of this season
+    ign_min : int
+        minimum number of fires per season
+    ign_max : int
+        maximum number of fires per season (exclusive)
+    fire_propa_matrix : np.array
+        fire proagation matrix with the shape of the centroids
+    on_land : np.array
+        flat bool array indicating centroids on land
+    hist_bright : np.array
+        historic intensities to draw the intensity of burned centroids from
+    proba_params : WildFire.ProbaParams
+        parameters of the propagation
+    keep_all_fires : bool
+        return the intensity of every single fire
+
+    Returns
+    -------
+    centr : np.array
+        centroids burned in this season, sorted
+    bright : np.array
+        max intensity of the season at these centroids
+    fires : csr_matrix or None
+        intensity of every fire of the season if keep_all_fires
+    """
+    rng = np.random.Generator(np.random.MT19937(seed_seq))
+    n_ign = rng.integers(ign_min, ign_max)
+    LOGGER.info('Setting up probabilistic fire season with %s fires.', str(n_ign))
+
+    season_bright = np.zeros(fire_propa_matrix.size)
+    fires_centr, fires_bright = [], []
+    for _ in range(n_ign):
+        centr = np.flatnonzero(_run_one_fire_on_grid(fire_propa_matrix, on_land,
+                                                     proba_params, rng))
+        bright = rng.choice(hist_bright, centr.size)
+        season_bright[centr] = np.maximum(season_bright[centr], bright)
+        if keep_all_fires:
+            fires_centr.append(centr)
+            fires_bright.append(bright)
+
+    fires = None
+    if keep_all_fires:
+        indptr = np.zeros(n_ign + 1, dtype=int)
+        indptr[1:] = np.cumsum([centr.size for centr in fires_centr])
+        fires = sparse.csr_matrix((np.concatenate([np.zeros(0)] + fires_bright),
+                                   np.concatenate([np.zeros(0, int)] + fires_centr),
+                                   indptr),
+                                  shape=(n_ign, fire_propa_matrix.size))
+    centr = np.flatnonzero(season_bright)
+    return centr, season_bright[centr], fires
+
+# Constants of the Mersenne Twister MT19937 used by np.random
+_MT_N = 624
+_MT_M = 397
+_MT_DRAWS_PER_STEP = 1000
+""" 32-bit words consumed by np.random.random(500) in one propagation step """
+
+@numba.njit
+def _mt_twist(mt_state):
+    """ Regenerate the 624 words of a MT19937 state in place.
+
+    Parameters
+    ----------
+    mt_state : np.array
+        int64 array with the 624 state words followed by the position
+    """
+    for i in range(_MT_N):
+        y_val = (mt_state[i] & 0x80000000) | (mt_state[(i + 1) % _MT_N] & 0x7fffffff)
+        new_val = mt_state[(i + _MT_M) % _MT_N] ^ (y_val >> 1)
+        if y_val & 1:
+            new_val ^= 0x9908b0df
+        mt_state[i] = new_val
+    mt_state[_MT_N] = 0
+
+@numba.njit
+def _mt_uint32(mt_state):
+    """ Draw the next 32-bit word from a MT19937 state, as np.random does.
+
+    Parameters
+    ----------
+    mt_state : np.array
+        int64 array with the 624 state words followed by the position
+
+    Returns
+    -------
+    y_val : int
+    """
+    if mt_state[_MT_N] >= _MT_N:
+        _mt_twist(mt_state)
+    y_val = mt_state[mt_state[_MT_N]]
+    mt_state[_MT_N] += 1
+    y_val ^= y_val >> 11
+    y_val ^= (y_val << 7) & 0x9d2c5680
+    y_val ^= (y_val << 15) & 0xefc60000
+    y_val ^= y_val >> 18
+    return y_val
+
+@numba.njit
+def _mt_random(mt_state):
+    """ Equivalent of np.random.random() on a MT19937 state. """
+    a_val = _mt_uint32(mt_state) >> 5
+    b_val = _mt_uint32(mt_state) >> 6
+    return (a_val * 67108864.0 + b_val) / 9007199254740992.0
+
+@numba.njit
+def _mt_randint(mt_state, high):
+    """ Equivalent of np.random.randint(0, high) on a MT19937 state. """
+    rng = high - 1
+    mask = rng
+    for shift in (1, 2, 4, 8, 16):
+        mask |= mask >> shift
+    while True:
+        val = _mt_uint32(mt_state) & mask
+        if val <= rng:
+            return val
+
+@numba.njit
+def _mt_skip(mt_state, n_draws):
+    """ Discard the next n_draws 32-bit words of a MT19937 state. """
+    while n_draws > 0:
+        if mt_state[_MT_N] >= _MT_N:
+            _mt_twist(mt_state)
+        step = min(n_draws, _MT_N - mt_state[_MT_N])
+        mt_state[_MT_N] += step
+        n_draws -= step
+
+@numba.njit
+def _propagate_fire(centr_burned, fire_propa_matrix, on_land, prop_proba,
+                    max_it_propa, centr_ign, mt_state):
+    """ Propagate one fire from an ignition centroid with a cellular automat.
+
+    Only the burning centroids (the active front) are tracked, sorted by
+    their flat index, so that every iteration touches the selected
+    centroid and its eight neighbours only. The random numbers are drawn in
+    the same order as np.random.randint and np.random.random(500) would be,
+    hence the burned footprint for a given seed does not depend on the
+    engine.
 
     Parameters
     ----------
-    num_centr : int
-        number of centroids
-    ind : np.array
-        index of closest centroid of each firms point
-    index_uni : np.array
-        unique index of each centroid
-    lat_lon_cpy : np.array
-        lat /lon information of each firms point
-    fir_bright : np.array
-        brightness of each firms data point
+    centr_burned : np.array
+        2d array of zeros with the shape of the centroids, modified in place:
+        0 = unburned, 1 = burning, 2 = ember centroid
+    fire_propa_matrix : np.array
+        fire proagation matrix indicating centroid specific fire
+        spread probability
+    on_land : np.array
+        flat bool array indicating centroids on land
+    prop_proba : float
+        global propagation probability
+    max_it_propa : int
+        maximum number of iterations
+    centr_ign : int
+        flat index of the ignition centroid
+    mt_state : np.array
+        int64 array with the 624 MT19937 state words followed by the
+        position, modified in place
 
     Returns
     -------
-    brightness_ev : np.array
-        maximum brightness at each centroids
+    count_it : int
+        number of iterations performed
     """
-    brightness_ev = np.zeros((1, num_centr), dtype=numba.float64)
-    for idx in range(index_uni.size):
-        if ind[idx] != -1:
-            brightness_ev[0, ind[idx]] = max(brightness_ev[0, ind[idx]], \
-                         np.max(fir_bright[lat_lon_cpy == index_uni[idx]]))
-    return brightness_ev
+    # Neighbourhood
+    hood = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+    n_rows, n_cols = centr_burned.shape
+
+    front = np.empty(64, dtype=np.int64)
+    front[0] = centr_ign
+    n_front = 1
+    centr_burned[centr_ign // n_cols, centr_ign % n_cols] = 1
+
+    count_it = 0
+    while n_front > 0 and count_it < max_it_propa:
+        count_it += 1
+        # Select randomly one of the burning centroids
+        sel = _mt_randint(mt_state, n_front) if n_front > 1 else 0
+        centr = front[sel]
+        centr_ix, centr_iy = centr // n_cols, centr % n_cols
+        if not (1 <= centr_ix < n_rows - 1 and 1 <= centr_iy < n_cols - 1
+                and on_land[centr]):
+            continue
+
+        # The selected centroid becomes an ember centroid
+        centr_burned[centr_ix, centr_iy] = 2
+        for i in range(sel, n_front - 1):
+            front[i] = front[i + 1]
+        n_front -= 1
+
+        # Propagate through its neighbourhood
+        for delta_x, delta_y in hood:
+            neig_x, neig_y = centr_ix + delta_x, centr_iy + delta_y
+            if _mt_random(mt_state) <= prop_proba * fire_propa_matrix[neig_x, neig_y] \
+            and centr_burned[neig_x, neig_y] == 0:
+                centr_burned[neig_x, neig_y] = 1
+                if n_front == front.size:
+                    front = np.concatenate((front, np.empty_like(front)))
+                neig = neig_x * n_cols + neig_y
+                pos = np.searchsorted(front[:n_front], neig)
+                for i in range(n_front, pos, -1):
+                    front[i] = front[i - 1]
+                front[pos] = neig
+                n_front += 1
+        _mt_skip(mt_state, _MT_DRAWS_PER_STEP - 2 * len(hood))
+
+    return count_it
@@ -19,9 +19,11 @@ with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
 Test Wild fire class
 """
 from pathlib import Path
+import copy
 import unittest
 import numpy as np
 import pandas as pd
+from pathos.pools import ProcessPool as Pool
 
 from climada_petals.hazard import WildFire
 
@@ -152,6 +154,31 @@ class TestWildFire(unittest.TestCase):
         self.assertAlmostEqual(wf.intensity[0, 939], 356.0)
         self.assertAlmostEqual(wf.fraction.getnnz(), 0)
 
+    def test_proba_fire_season_seed_pass(self):
+        """ Test set_proba_fire_seasons with independent streams """
+        wf = WildFire.from_hist_fire_seasons_FIRMS(TEST_FIRMS)
+        wf.ProbaParams.max_it_propa = 10000
+        wf_pool = copy.deepcopy(wf)
+        wf.set_proba_fire_seasons(3, [3, 5], keep_all_fires=True, seed=2)
+
+        self.assertEqual(wf.size, 4)
+        self.assertTrue(np.allclose(wf.orig, [True, False, False, False]))
+        self.assertEqual(wf.intensity.shape, (4, 51042))
+        self.assertEqual(wf.fraction.shape, (4, 51042))
+        self.assertEqual(len(wf.prob_fire_seasons), 3)
+        for idx, fires in enumerate(wf.prob_fire_seasons):
+            self.assertTrue(3 <= fires.shape[0] < 5)
+            self.assertEqual((fires.max(0) != wf.intensity[idx+1]).nnz, 0)
+        self.assertTrue(np.all(np.isin(wf.intensity[1:].data, wf.intensity[0].data)))
+
+        # the result does not depend on the number of CPUs
+        wf_pool.pool = Pool(nodes=2)
+        wf_pool.set_proba_fire_seasons(3, [3, 5], seed=2)
+        wf_pool.pool.close()
+        wf_pool.pool.join()
+        wf_pool.pool.clear()
+        self.assertEqual((wf_pool.intensity != wf.intensity).nnz, 0)
+
     def test_summarize_fires_to_seasons_pass(self):
         """ Test probabilistic set_probabilistic_event_year_set """
         wf = WildFire.from_hist_fire_FIRMS(TEST_FIRMS)
@@ -0,0 +1,48 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Coordinate functions shared by the hazard modules.
+"""
+
+__all__ = ['closest_centroid']
+
+import numpy as np
+
+
+def closest_centroid(tree_centr, lat_lon, res_centr):
+    """Index of the closest centroid of each point, -1 if the closest centroid
+    is farther than half the centroids resolution.
+
+    Parameters
+    ----------
+    tree_centr : BallTree
+        chebyshev tree of the centroids coordinates
+    lat_lon : np.array
+        lat /lon of each point
+    res_centr : float
+        centroids resolution in degree
+
+    Returns
+    -------
+    ind : np.array
+        index of closest centroid of each point
+    """
+    if not lat_lon.shape[0]:
+        return np.zeros(0, int)
+    dist, ind = tree_centr.query(lat_lon, k=1)
+    return np.where(dist[:, 0] <= res_centr / 2, ind[:, 0], -1)
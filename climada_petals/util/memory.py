@@ -0,0 +1,36 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Memory budget of the computations that are split into chunks or parallel tasks.
+"""
+
+__all__ = ['DEF_MAX_MEMORY_GB',
+           'available_memory_gb']
+
+import os
+
+DEF_MAX_MEMORY_GB = 8
+"""memory budget (in GB) used if the available memory cannot be determined"""
+
+
+def available_memory_gb():
+    """Available physical memory in GB, DEF_MAX_MEMORY_GB if it cannot be determined"""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1e9
+    except (AttributeError, ValueError, OSError):
+        return DEF_MAX_MEMORY_GB
@@ -0,0 +1,43 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Test coordinates module.
+"""
+import unittest
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from climada_petals.util.coordinates import closest_centroid
+
+class TestClosestCentroid(unittest.TestCase):
+    """Test closest_centroid"""
+
+    def test_closest_centroid_pass(self):
+        """Points are mapped to the centroid within half the resolution"""
+        lat, lon = np.meshgrid(np.arange(3.), np.arange(4.), indexing='ij')
+        tree_centr = BallTree(np.column_stack([lat.ravel(), lon.ravel()]), metric='chebyshev')
+        lat_lon = np.array([[0.1, 0.2], [1.4, 2.5], [2.0, 3.0], [1.0, 4.6], [-0.2, 1.0]])
+        np.testing.assert_array_equal(closest_centroid(tree_centr, lat_lon, 1.0),
+                                      [0, 6, 11, -1, 1])
+        self.assertEqual(closest_centroid(tree_centr, np.zeros((0, 2)), 1.0).size, 0)
+
+# Execute Tests
+if __name__ == "__main__":
+    TESTS = unittest.TestLoader().loadTestsFromTestCase(TestClosestCentroid)
+    unittest.TextTestRunner(verbosity=2).run(TESTS)
@@ -0,0 +1,44 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Test memory module.
+"""
+import os
+import unittest
+from unittest import mock
+
+from climada_petals.util import memory
+from climada_petals.util.memory import DEF_MAX_MEMORY_GB, available_memory_gb
+
+class TestAvailableMemory(unittest.TestCase):
+    """Test available_memory_gb"""
+
+    def test_available_memory_pass(self):
+        """The available memory is positive, or the default if it cannot be determined"""
+        self.assertGreater(available_memory_gb(), 0)
+        with mock.patch.object(memory.os, 'sysconf', side_effect=ValueError, create=True):
+            self.assertEqual(available_memory_gb(), DEF_MAX_MEMORY_GB)
+        if hasattr(os, 'sysconf'):
+            with mock.patch.dict(memory.os.__dict__):
+                del memory.os.__dict__['sysconf']
+                self.assertEqual(available_memory_gb(), DEF_MAX_MEMORY_GB)
+
+# Execute Tests
+if __name__ == "__main__":
+    TESTS = unittest.TestLoader().loadTestsFromTestCase(TestAvailableMemory)
+    unittest.TextTestRunner(verbosity=2).run(TESTS)
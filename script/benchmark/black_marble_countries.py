@@ -0,0 +1,130 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the modelling of all countries in BlackMarble.set_countries.
+
+The countries are modelled one after the other (BlackMarble._set_one_country, as
+set_countries without pool) and with a process pool that memory maps the nightlight matrix
+(_set_countries_pool, as set_countries with pool). The country geometries are obtained by
+polygonizing the gridded country codes of climada, and the nightlight matrix, GDP and income
+groups are synthetic, so that no download is needed. The exposures of both runs are checked
+to be identical.
+
+Usage: python script/benchmark/black_marble_countries.py [ncpus]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import rasterio
+import rasterio.features
+import shapely
+from pathos.pools import ProcessPool as Pool
+from scipy import sparse
+
+import climada.util.coordinates as u_coord
+import climada.util.hdf5_handler as u_hdf5
+from climada_petals.entity.exposures.black_marble import BlackMarble, _set_countries_pool
+
+RES_DEG = 1 / 20
+""" resolution of the synthetic nightlight matrix (NOAA nightlights: 1 / 120) """
+BORDER = (-180, -65, 180, 75)
+""" extent of the nightlight matrix: min_lon, min_lat, max_lon, max_lat """
+DENSITY = 0.05
+""" fraction of non-zero nightlight values """
+COUNTRY_DOWNSAMPLING = 2
+""" downsampling of the gridded country codes (150 arcsec) before polygonizing """
+
+
+def country_info(rnd):
+    """Geometries of all countries with synthetic GDP and income group, in the format of
+    set_countries"""
+    base_file = u_hdf5.read(u_coord.NATEARTH_CENTROIDS[150])
+    meta = base_file['meta']
+    region_id = base_file['region_id'].reshape(meta['height'][0], meta['width'][0])
+    region_id = region_id[::COUNTRY_DOWNSAMPLING, ::COUNTRY_DOWNSAMPLING].astype(np.int32)
+    transform = rasterio.Affine(*meta['transform']) * rasterio.Affine.scale(COUNTRY_DOWNSAMPLING)
+    polygons = {}
+    for geom, value in rasterio.features.shapes(region_id, mask=region_id > 0,
+                                                transform=transform):
+        polygons.setdefault(int(value), []).append(shapely.geometry.shape(geom))
+
+    cntry_info = {}
+    for cntry_id, cntry_polygons in sorted(polygons.items()):
+        geom = shapely.unary_union(cntry_polygons)
+        if geom.bounds[1] < BORDER[1] or geom.bounds[3] > BORDER[3]:
+            continue
+        cntry_info[str(cntry_id)] = [cntry_id, str(cntry_id), geom, 2016,
+                                     10 ** rnd.uniform(8, 13), int(rnd.integers(1, 5))]
+    return cntry_info
+
+
+def nightlight_matrix(rnd):
+    """Synthetic sparse nightlight matrix on the extent BORDER"""
+    shape = (int(round((BORDER[3] - BORDER[1]) / RES_DEG)),
+             int(round((BORDER[2] - BORDER[0]) / RES_DEG)))
+    nnz = int(DENSITY * shape[0] * shape[1])
+    nightlight = sparse.csr_matrix(
+        (rnd.integers(1, 64, nnz).astype(float),
+         (rnd.integers(0, shape[0], nnz), rnd.integers(0, shape[1], nnz))), shape=shape)
+    coord_nl = np.array([[BORDER[1] + RES_DEG / 2, RES_DEG],
+                         [BORDER[0] + RES_DEG / 2, RES_DEG]])
+    return nightlight, coord_nl
+
+
+def main():
+    """Print run times of the serial and the pool run, and whether they agree"""
+    ncpus = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    rnd = np.random.default_rng(0)
+    cntry_info = country_info(rnd)
+    cntry_admin1 = {cntry_iso: [] for cntry_iso in cntry_info}
+    nightlight, coord_nl = nightlight_matrix(rnd)
+    print(f"{len(cntry_info)} countries, nightlight matrix {nightlight.shape} with "
+          f"{nightlight.nnz} values, pool of {ncpus} processes\n")
+
+    pool = Pool(nodes=ncpus)
+    pool.map(abs, range(ncpus))
+
+    print(f"{'res_fact':>8} {'serial [s]':>11} {'pool [s]':>9} {'speed-up':>9} {'identical':>10}")
+    for res_fact in [1.0, 0.5]:
+        start = time.perf_counter()
+        gdf_ref = [
+            BlackMarble._set_one_country(cntry_val, nightlight, coord_nl, res_fact, 1 / res_fact,
+                                         cntry_admin1[cntry_iso]).gdf
+            for cntry_iso, cntry_val in cntry_info.items()
+        ]
+        t_ref = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gdf_pool = _set_countries_pool(pool, cntry_info, cntry_admin1, nightlight, coord_nl,
+                                       res_fact, 1 / res_fact)
+        t_pool = time.perf_counter() - start
+
+        identical = all(gdf.equals(ref) for gdf, ref in zip(gdf_pool, gdf_ref))
+        print(f"{res_fact:>8.1f} {t_ref:>11.2f} {t_pool:>9.2f} {t_ref / t_pool:>9.2f} "
+              f"{str(identical):>10}")
+
+    pool.close()
+    pool.join()
+    pool.clear()
+
+
+if __name__ == "__main__":
+    main()
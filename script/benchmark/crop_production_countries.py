@@ -0,0 +1,227 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the country level computations of CropProduction exposures.
+
+value_to_usd, CropProduction.aggregate_countries and normalize_with_fao_cp look up the
+FAO values of all countries with one groupby per call. They are compared to the former
+implementations with one look-up in the FAO table (and one selection of exposure points)
+per country, on a global 0.5 degree crop production exposure with synthetic FAO price
+and production tables covering all countries. The largest relative deviation between
+both is reported as well.
+
+Usage: python script/benchmark/crop_production_countries.py
+"""
+
+import copy
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import climada.util.coordinates as u_coord
+from climada_petals.entity.exposures.crop_production import (
+    CROP_NAME,
+    FAO_FILE,
+    FAO_FILE2,
+    CropProduction,
+    normalize_with_fao_cp,
+    value_to_usd,
+)
+
+RESOLUTION = 0.5
+CROP = 'mai'
+YEARS_TABLE = (1991, 2018)
+""" years covered by the synthetic FAO tables """
+YEARRANGE = (2008, 2018)
+
+
+def aggregate_countries_loop(exp):
+    """Former implementation of CropProduction.aggregate_countries"""
+    list_countries = np.unique(exp.gdf.region_id)
+    country_values = np.zeros(len(list_countries))
+    for i, iso_nr in enumerate(list_countries):
+        country_values[i] = exp.gdf.loc[exp.gdf.region_id == iso_nr].value.sum()
+    return list_countries, country_values
+
+
+def value_to_usd_loop(exp_cp, input_dir, yearrange):
+    """Former implementation of value_to_usd: one look-up per country"""
+    new_exp = copy.deepcopy(exp_cp)
+    fao = dict()
+    fao['file'] = pd.read_csv(input_dir / FAO_FILE)
+    fao['crops'] = fao['file'].Item.values
+    fao['year'] = fao['file'].Year.values
+    fao['price'] = fao['file'].Value.values
+    fao_country = u_coord.country_faocode2iso(getattr(fao['file'], 'Area Code').values)
+
+    new_exp.gdf.loc[exp_cp.gdf.region_id == -99, 'region_id'] = 0
+    iso3num = np.asarray(u_coord.country_to_iso(
+        new_exp.gdf.region_id, representation="numeric", fillvalue=999), dtype=object)
+    list_countries = np.unique(iso3num)
+
+    area_price = np.zeros(new_exp.gdf.value.size)
+    for country in list_countries:
+        [idx_country] = (iso3num == country).nonzero()
+        if country == 999:
+            area_price[idx_country] = new_exp.gdf.value[idx_country] * 0
+        elif country != 0:
+            idx_price = np.where((np.asarray(fao_country) == country) &
+                                 (np.asarray(fao['crops']) == CROP_NAME[new_exp.crop]['fao']) &
+                                 (fao['year'] >= yearrange[0]) &
+                                 (fao['year'] <= yearrange[1]))
+            if idx_price[0].size != 0:
+                price = np.mean(fao['price'][idx_price])
+            else:
+                idx_price = np.where((np.asarray(fao['crops']) ==
+                                      CROP_NAME[new_exp.crop]['fao']) &
+                                     (fao['year'] >= yearrange[0]) &
+                                     (fao['year'] <= yearrange[1]))
+                price = np.mean(fao['price'][idx_price])
+            area_price[idx_country] = new_exp.gdf.value[idx_country] * price
+
+    new_exp.gdf['tonnes_per_year'] = exp_cp.gdf['value'].values
+    new_exp.gdf['value'] = area_price
+    new_exp.value_unit = 'USD/y'
+    return new_exp
+
+
+def normalize_with_fao_cp_loop(exp_firr, exp_noirr, input_dir, yearrange):
+    """Former implementation of normalize_with_fao_cp (exposures in t/y)"""
+    country_list, countries_firr = aggregate_countries_loop(exp_firr)
+    country_list, countries_noirr = aggregate_countries_loop(exp_noirr)
+    exp_tot_production = countries_firr + countries_noirr
+
+    fao = pd.read_csv(input_dir / FAO_FILE2)
+    fao_crops = fao.Item.values
+    fao_year = fao.Year.values
+    fao_values = fao.Value.values
+    fao_code = getattr(fao, 'Area Code').values
+    fao_country = u_coord.country_iso2faocode(country_list)
+
+    fao_crop_production = np.zeros(len(country_list))
+    ratio = np.ones(len(country_list))
+    exp_firr_norm = copy.deepcopy(exp_firr)
+    exp_noirr_norm = copy.deepcopy(exp_noirr)
+    for country, iso_nr in enumerate(country_list):
+        idx = np.where((np.asarray(fao_code) == fao_country[country])
+                       & (np.asarray(fao_crops) == CROP_NAME[exp_firr.crop]['fao'])
+                       & (fao_year >= yearrange[0]) & (fao_year <= yearrange[1]))
+        fao_crop_production[country] = np.mean(fao_values[idx])
+        if exp_tot_production[country] == 0:
+            exp_tot_production[country] = fao_crop_production[country]
+        elif fao_crop_production[country] != 0:
+            ratio[country] = fao_crop_production[country] / exp_tot_production[country]
+        in_country = exp_firr.gdf.region_id == iso_nr
+        exp_firr_norm.gdf.loc[in_country, 'value'] = ratio[country] * \
+            exp_firr.gdf.value[in_country]
+        exp_noirr_norm.gdf.loc[in_country, 'value'] = ratio[country] * \
+            exp_noirr.gdf.value[in_country]
+    return country_list, ratio, exp_firr_norm, exp_noirr_norm, fao_crop_production
+
+
+def global_exposure(rnd, irr):
+    """Crop production exposure on the land points of a global grid"""
+    lat, lon = np.meshgrid(np.arange(85 - RESOLUTION / 2, -60, -RESOLUTION),
+                           np.arange(-180 + RESOLUTION / 2, 180, RESOLUTION), indexing='ij')
+    region_id = u_coord.get_country_code(lat.ravel(), lon.ravel(), gridded=True)
+    on_land = region_id != 0
+    exp = CropProduction()
+    exp.gdf['latitude'] = lat.ravel()[on_land]
+    exp.gdf['longitude'] = lon.ravel()[on_land]
+    exp.gdf['region_id'] = region_id[on_land]
+    exp.gdf['value'] = rnd.lognormal(5, 2, on_land.sum()) * rnd.binomial(1, 0.6, on_land.sum())
+    exp.crop = CROP
+    exp.value_unit = 't/y'
+    exp.description = f"synthetic {irr}"
+    return exp
+
+
+def write_fao_tables(rnd, input_dir):
+    """Synthetic FAO price and production tables with all crops, years and countries (but
+    a tenth of the countries without values)"""
+    _, fao_codes = u_coord.fao_code_def()
+    fao_codes = rnd.permutation(fao_codes)[:int(0.9 * len(fao_codes))]
+    years = np.arange(YEARS_TABLE[0], YEARS_TABLE[1] + 1)
+    crops = [names['fao'] for names in CROP_NAME.values()]
+    codes, items, years = [arr.ravel() for arr in np.meshgrid(fao_codes, crops, years)]
+    for filename, scale in [(FAO_FILE, 300), (FAO_FILE2, 1e6)]:
+        pd.DataFrame({'Area Code': codes, 'Item': items, 'Year': years,
+                      'Value': rnd.lognormal(0, 1, codes.size) * scale}
+                     ).to_csv(input_dir / filename, index=False)
+    return codes.size
+
+
+def max_rel_diff(values, reference):
+    """Largest relative deviation of values from reference (NaN where both are NaN)"""
+    values, reference = np.asarray(values, dtype=float), np.asarray(reference, dtype=float)
+    if not np.array_equal(np.isnan(values), np.isnan(reference)):
+        return np.inf
+    valid = ~np.isnan(values) & (reference != 0)
+    return np.max(np.abs(values[valid] - reference[valid]) / np.abs(reference[valid]),
+                  initial=0)
+
+
+def time_call(func, *args):
+    """Run time of a single call of func(*args)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Print run times and deviations of the former and new implementations"""
+    rnd = np.random.RandomState(0)
+    exp_firr = global_exposure(rnd, 'firr')
+    exp_noirr = global_exposure(rnd, 'noirr')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_dir = Path(tmp_dir)
+        n_rows = write_fao_tables(rnd, input_dir)
+        print(f"{exp_firr.gdf.shape[0]} exposure points, "
+              f"{exp_firr.gdf.region_id.nunique()} countries, {n_rows} rows per FAO table\n")
+
+        print(f"{'function':<22} {'loop [s]':>9} {'groupby [s]':>12} {'speed-up':>9} "
+              f"{'max rel diff':>13}")
+
+        (countries_ref, values_ref), t_ref = time_call(aggregate_countries_loop, exp_firr)
+        (countries, values), t_new = time_call(exp_firr.aggregate_countries)
+        assert np.array_equal(countries, countries_ref)
+        print(f"{'aggregate_countries':<22} {t_ref:>9.3f} {t_new:>12.3f} {t_ref / t_new:>9.1f} "
+              f"{max_rel_diff(values, values_ref):>13.1e}")
+
+        exp_ref, t_ref = time_call(value_to_usd_loop, exp_firr, input_dir, YEARRANGE)
+        exp_usd, t_new = time_call(value_to_usd, exp_firr, input_dir, YEARRANGE)
+        print(f"{'value_to_usd':<22} {t_ref:>9.3f} {t_new:>12.3f} {t_ref / t_new:>9.1f} "
+              f"{max_rel_diff(exp_usd.gdf.value, exp_ref.gdf.value):>13.1e}")
+
+        result_ref, t_ref = time_call(normalize_with_fao_cp_loop, exp_firr, exp_noirr,
+                                      input_dir, YEARRANGE)
+        result, t_new = time_call(normalize_with_fao_cp, exp_firr, exp_noirr, input_dir,
+                                  YEARRANGE)
+        diff = max(max_rel_diff(result[1], result_ref[1]),
+                   max_rel_diff(result[2].gdf.value, result_ref[2].gdf.value),
+                   max_rel_diff(result[3].gdf.value, result_ref[3].gdf.value),
+                   max_rel_diff(result[4], result_ref[4]))
+        print(f"{'normalize_with_fao_cp':<22} {t_ref:>9.3f} {t_new:>12.3f} "
+              f"{t_ref / t_new:>9.1f} {diff:>13.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the computation of the LowFlow intensity matrix from clustered monthly data.
+
+LowFlow._intensity_loop sums the days below threshold of all events with a single
+scatter-add, after searching the closest centroid of each distinct data point once
+(with a pathos pool if LowFlow.pool is set). It is compared to the former
+implementation with one centroid search and one dense intensity row per event, on
+synthetic monthly data of increasing extent, clustered with LowFlow.identify_clusters.
+
+Usage: python script/benchmark/low_flow_intensity.py [ncpus]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pathos.pools import ProcessPool as Pool
+from scipy import sparse
+from sklearn.neighbors import BallTree
+
+from climada.hazard.centroids import Centroids
+from climada_petals.hazard.low_flow import LowFlow
+
+GRIDS = [(40, 40, 24), (120, 120, 36), (240, 240, 60)]
+""" number of latitudes, longitudes and months of the synthetic data """
+RESOLUTION = 0.5
+LOW_FLOW_FRACTION = 0.1
+""" fraction of grid cells and months with days below threshold """
+INTENSITY_STEP = 300
+""" number of events stacked at once by the former implementation """
+
+
+def intensity_one_cluster(lowflow_df, tree_centr, cluster_id, res_centr, num_centr):
+    """Former implementation: dense intensity row of a single event"""
+    temp_data = lowflow_df.reindex(
+        index=np.argwhere(np.array(lowflow_df['cluster_id'] == cluster_id)).reshape(-1),
+        columns=['lat', 'lon', 'ndays'])
+    lat_lon_uni, lat_lon_cpy = np.unique(temp_data[['lat', 'lon']].values,
+                                         return_inverse=True, axis=0)
+    lat_lon_cpy = lat_lon_cpy.reshape(-1)
+    ind, _ = tree_centr.query_radius(lat_lon_uni, r=res_centr / 2, count_only=False,
+                                     return_distance=True, sort_results=True)
+    ind = np.array([ind_i[0] if ind_i.size else -1 for ind_i in ind])
+    intensity_cl = np.zeros(num_centr)
+    for idx in range(lat_lon_uni.shape[0]):
+        if ind[idx] != -1:
+            intensity_cl[ind[idx]] = np.sum(temp_data['ndays'].values[lat_lon_cpy == idx])
+    return intensity_cl
+
+
+def intensity_loop_events(lowflow_df, uniq_ev, coord, res_centr, num_centr):
+    """Former implementation: loop over events, stacked in steps of INTENSITY_STEP"""
+    tree_centr = BallTree(coord, metric='chebyshev')
+    blocks = []
+    for start in range(0, uniq_ev.size, INTENSITY_STEP):
+        blocks.append(sparse.csr_matrix(
+            [intensity_one_cluster(lowflow_df, tree_centr, cl_id, res_centr, num_centr)
+             for cl_id in uniq_ev[start:start + INTENSITY_STEP]]))
+    return sparse.vstack(blocks, format='csr')
+
+
+def clustered_data(rnd, nlat, nlon, nmonths):
+    """Synthetic monthly days below threshold, clustered into events, and centroids"""
+    grid = np.stack(np.meshgrid(np.arange(nmonths), np.arange(nlat), np.arange(nlon),
+                                indexing='ij'), -1).reshape(-1, 3)
+    grid = grid[rnd.rand(grid.shape[0]) < LOW_FLOW_FRACTION]
+    haz = LowFlow()
+    haz.lowflow_df = pd.DataFrame(dict(
+        lat=40 - RESOLUTION * grid[:, 1], lon=RESOLUTION * grid[:, 2],
+        dt_month=24000 + grid[:, 0], ndays=rnd.randint(1, 29, grid.shape[0]).astype(float),
+        iter_ev=True, cons_id=-1))
+    haz.identify_clusters(clus_thresh_xy=1.5, clus_thresh_t=1, min_samples=1)
+    centroids = Centroids.from_pnt_bounds(
+        (0, 40 - RESOLUTION * (nlat - 1), RESOLUTION * (nlon - 1), 40), res=RESOLUTION)
+    return haz, centroids
+
+
+def main(ncpus=4):
+    """Print run times for all grids and check that the intensity matrices agree"""
+    rnd = np.random.RandomState(0)
+    pool = Pool(nodes=ncpus)
+    print(f"{'points':>9} {'events':>7} {'loop [s]':>9} {'vectorized [s]':>15} "
+          f"{f'pool({ncpus}) [s]':>12} {'speed-up':>9}")
+    for nlat, nlon, nmonths in GRIDS:
+        haz, centroids = clustered_data(rnd, nlat, nlon, nmonths)
+        uniq_ev = np.unique(haz.lowflow_df['cluster_id'].values)
+        args = (uniq_ev, centroids.coord, RESOLUTION, centroids.size)
+
+        start = time.perf_counter()
+        inten_ref = intensity_loop_events(haz.lowflow_df, *args)
+        t_ref = time.perf_counter() - start
+        haz.pool = None
+        start = time.perf_counter()
+        inten_vec = haz._intensity_loop(*args)
+        t_vec = time.perf_counter() - start
+        haz.pool = pool
+        start = time.perf_counter()
+        inten_pool = haz._intensity_loop(*args)
+        t_pool = time.perf_counter() - start
+
+        for inten in [inten_vec, inten_pool]:
+            if (inten != inten_ref).nnz:
+                raise ValueError("intensity matrices differ")
+        print(f"{len(haz.lowflow_df):>9} {uniq_ev.size:>7} {t_ref:>9.2f} {t_vec:>15.3f} "
+              f"{t_pool:>12.3f} {t_ref / t_vec:>9.1f}")
+    pool.close()
+    pool.join()
+    pool.clear()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
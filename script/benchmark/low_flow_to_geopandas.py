@@ -0,0 +1,100 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the conversion of monthly low flow data to a GeoDataFrame.
+
+LowFlow.from_netcdf converts the monthly number of days below threshold of every
+year chunk (one decade of ISIMIP data) with low_flow._xarray_to_geopandas. The
+vectorized conversion is compared to the former implementation with row-wise date
+conversion and one shapely Point per row, on synthetic decades of global 0.5° data
+where a fraction of the (land) grid cells is below threshold in a given month.
+
+Usage: python script/benchmark/low_flow_to_geopandas.py
+"""
+
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import xarray as xr
+from shapely.geometry import Point
+
+from climada_petals.hazard.low_flow import _xarray_to_geopandas
+
+DECADES = [(1971, 1980), (1981, 1990), (1991, 2000)]
+RESOLUTION = 0.5
+LAND_FRACTION = 0.3
+""" fraction of grid cells with discharge data """
+LOW_FLOW_FRACTION = 0.1
+""" fraction of land grid cells and months with days below threshold """
+
+
+def xarray_to_geopandas_rows(dis_xarray):
+    """Former implementation: row-wise dates and one shapely Point per row"""
+    dataf = dis_xarray.to_dataframe()
+    dataf.reset_index(inplace=True)
+    dataf = dataf.dropna()
+    dataf['iter_ev'] = np.ones(len(dataf), bool)
+    dataf['cons_id'] = np.zeros(len(dataf), int) - 1
+    dataf['dtime'] = dataf['time'].apply(lambda x: x.toordinal())
+    dataf['dt_month'] = dataf['time'].apply(lambda x: x.year * 12 + x.month)
+    return gpd.GeoDataFrame(dataf, geometry=[Point(x, y) for x, y in zip(dataf['lon'],
+                                                                         dataf['lat'])])
+
+
+def monthly_decade(rnd, years):
+    """Synthetic monthly days below threshold on the global grid, NaN where none"""
+    time_axis = pd.date_range(f'{years[0]}-01-01', f'{years[1]}-12-31', freq='ME')
+    lat = np.arange(90 - RESOLUTION / 2, -90, -RESOLUTION)
+    lon = np.arange(-180 + RESOLUTION / 2, 180, RESOLUTION)
+    land = rnd.rand(lat.size, lon.size) < LAND_FRACTION
+    low = rnd.rand(time_axis.size, lat.size, lon.size) < LOW_FLOW_FRACTION
+    ndays = np.where(land & low, rnd.randint(1, 29, low.shape), np.nan).astype('float32')
+    return xr.Dataset({'ndays': (('time', 'lat', 'lon'), ndays)},
+                      coords=dict(time=time_axis, lat=lat, lon=lon))
+
+
+def main():
+    """Print run times per decade and in total, and check that the results agree"""
+    rnd = np.random.RandomState(0)
+    total_rows, total_ref, total_new = 0, 0.0, 0.0
+    print(f"{'years':>10} {'rows':>10} {'rows [s]':>9} {'vectorized [s]':>15} {'speed-up':>9}")
+    for years in DECADES:
+        data = monthly_decade(rnd, years)
+        start = time.perf_counter()
+        df_ref = xarray_to_geopandas_rows(data)
+        t_ref = time.perf_counter() - start
+        start = time.perf_counter()
+        df_new = _xarray_to_geopandas(data)
+        t_new = time.perf_counter() - start
+        pd.testing.assert_frame_equal(df_ref.drop(columns='geometry'),
+                                      df_new.drop(columns='geometry'))
+        if not df_ref.geometry.geom_equals_exact(df_new.geometry, 0).all():
+            raise ValueError("geometries differ")
+        print(f"{years[0]:>5}-{years[1]:>4} {len(df_new):>10} {t_ref:>9.2f} {t_new:>15.2f} "
+              f"{t_ref / t_new:>9.1f}")
+        total_rows += len(df_new)
+        total_ref += t_ref
+        total_new += t_new
+    print(f"{'total':>10} {total_rows:>10} {total_ref:>9.2f} {total_new:>15.2f} "
+          f"{total_ref / total_new:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
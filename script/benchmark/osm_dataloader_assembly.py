@@ -0,0 +1,254 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the assembly of Overpass results into GeoDataFrames in OSMApiQuery.
+
+An Overpass JSON response is replayed by a local stub server and downloaded with overpy, as
+in OSMApiQuery.get_data_overpass. The result is assembled with OSMApiQuery._assemble_results
+and with the former implementation, which rebuilt the list of way geometries for every way and
+looked up the available nodes and ways in lists. The assembled GeoDataFrames are checked to be
+identical.
+
+If no response is given, synthetic city-like responses (buildings as closed ways, streets
+sharing nodes, multipolygon relations with inner and outer ways, and points of interest) of
+increasing size are used. A recorded response can be saved from the Overpass API with e.g.
+``curl -d @query.txt https://overpass-api.de/api/interpreter -o response.json``.
+
+Usage: python script/benchmark/osm_dataloader_assembly.py [response.json]
+"""
+
+import http.server
+import json
+import sys
+import threading
+import time
+
+import geopandas as gpd
+import numpy as np
+import overpy
+import shapely
+
+from climada_petals.entity.exposures.osm_dataloader import LOGGER, OSMApiQuery
+
+N_BUILDINGS = [1000, 2000, 4000]
+""" number of buildings of the synthetic responses; streets, relations and points of interest
+are scaled accordingly """
+
+
+class FormerOSMApiQuery(OSMApiQuery):
+    """OSMApiQuery with the former assembly methods"""
+
+    def _assemble_from_relations(self, result):
+        nodes_taken = []
+        ways_taken = []
+        data_geom = []
+        data_id = []
+        data_tags = []
+        for relation in result.relations:
+            data_tags.append(relation.tags)
+            data_id.append(relation.id)
+            roles = []
+            relationways = []
+            for way in relation.members:
+                relationways.append(way.ref)
+                roles.append(way.role)
+            ways_taken.append(relationways)
+            nodes_taken_mp, gdf_polys = self._assemble_from_ways(
+                result, relationways, closed_lines_are_polys=True)
+            nodes_taken.append(nodes_taken_mp)
+            gdf_polys['role'] = roles
+            inner_mp = shapely.geometry.MultiPolygon(
+                gdf_polys.geometry[(gdf_polys.geometry.type == 'Polygon') &
+                                   (gdf_polys.role == 'inner')].values)
+            outer_mp = shapely.geometry.MultiPolygon(
+                gdf_polys.geometry[(gdf_polys.geometry.type == 'Polygon') &
+                                   (gdf_polys.role == 'outer')].values)
+            lines = gdf_polys.geometry[
+                (gdf_polys.geometry.type == 'LineString')].values
+            if len(lines) > 0:
+                poly = shapely.geometry.Polygon(
+                    shapely.ops.linemerge(shapely.geometry.MultiLineString(lines)))
+            else:
+                poly = shapely.geometry.Polygon([])
+            multipoly = shapely.ops.unary_union([outer_mp - inner_mp, poly])
+            data_geom.append(multipoly)
+        gdf_rels = gpd.GeoDataFrame(
+            data={'osm_id': data_id, 'geometry': data_geom, 'tags': data_tags},
+            geometry='geometry', crs='epsg:4326')
+        nodes_taken = [node for nodes in nodes_taken for node in nodes]
+        ways_taken = [way for ways in ways_taken for way in ways]
+        return nodes_taken, ways_taken, gdf_rels
+
+    def _assemble_from_ways(self, result, ways_avail, closed_lines_are_polys):
+        nodes_taken = []
+        data_geom = []
+        data_id = []
+        data_tags = []
+        for way in result.ways:
+            if way.id in ways_avail:
+                node_lat_lons = []
+                for node in way.nodes:
+                    nodes_taken.append(node.id)
+                    node_lat_lons.append((float(node.lat), float(node.lon)))
+                data_geom.append(shapely.geometry.LineString(node_lat_lons))
+                data_id.append(way.id)
+                data_tags.append(way.tags)
+            if closed_lines_are_polys:
+                data_geom = [shapely.geometry.Polygon(way) if way.is_closed
+                             else way for way in data_geom]
+        gdf_ways = gpd.GeoDataFrame(
+            data={'osm_id': data_id, 'geometry': data_geom, 'tags': data_tags},
+            geometry='geometry', crs='epsg:4326')
+        return nodes_taken, gdf_ways
+
+    def _assemble_from_nodes(self, result, nodes_avail):
+        data_geom = []
+        data_id = []
+        data_tags = []
+        for node in result.nodes:
+            if node.id in nodes_avail:
+                data_geom.append(shapely.geometry.Point(node.lat, node.lon))
+                data_id.append(node.id)
+                data_tags.append(node.tags)
+        gdf_nodes = gpd.GeoDataFrame(
+            data={'osm_id': data_id, 'geometry': data_geom, 'tags': data_tags},
+            geometry='geometry', crs='epsg:4326')
+        return gdf_nodes
+
+    def _update_availability(self, full_set, to_remove):
+        return [item for item in full_set if item not in to_remove]
+
+
+def synthetic_response(n_buildings, rnd):
+    """Overpass JSON response of a synthetic city"""
+    elements = []
+    ids = iter(range(1, 100 * n_buildings))
+
+    def node(lat, lon, tags=None):
+        element = {'type': 'node', 'id': next(ids), 'lat': round(lat, 7), 'lon': round(lon, 7)}
+        if tags:
+            element['tags'] = tags
+        elements.append(element)
+        return element['id']
+
+    def way(node_ids, tags=None):
+        element = {'type': 'way', 'id': next(ids), 'nodes': node_ids}
+        if tags:
+            element['tags'] = tags
+        elements.append(element)
+        return element['id']
+
+    def ring(lat, lon, size):
+        node_ids = [node(lat + d_lat * size, lon + d_lon * size)
+                    for d_lat, d_lon in [(0, 0), (0, 1), (1, 1), (1, 0)]]
+        return node_ids + node_ids[:1]
+
+    side = int(np.ceil(np.sqrt(n_buildings)))
+    step = 2e-4
+    for i_bld in range(n_buildings):
+        lat, lon = 47.3 + step * (i_bld // side), 8.5 + step * (i_bld % side)
+        way(ring(lat, lon, 1e-4), {'building': str(rnd.choice(['yes', 'house', 'school']))})
+    # streets along the rows of buildings, and a crossing street sharing their first nodes
+    crossing = []
+    for i_row in range(side):
+        street = [node(47.3 + step * (i_row + 0.75), 8.5 + step * i_col)
+                  for i_col in range(side)]
+        crossing.append(street[0])
+        way(street, {'highway': 'residential'})
+    way(crossing, {'highway': 'primary'})
+    for i_rel in range(n_buildings // 20):
+        lat, lon = 47.2 - 1e-3 * (i_rel // side), 8.5 + 1e-3 * (i_rel % side)
+        outer = way(ring(lat, lon, 8e-4))
+        inner = way(ring(lat + 2e-4, lon + 2e-4, 2e-4))
+        elements.append({'type': 'relation', 'id': next(ids),
+                         'members': [{'type': 'way', 'ref': outer, 'role': 'outer'},
+                                     {'type': 'way', 'ref': inner, 'role': 'inner'}],
+                         'tags': {'type': 'multipolygon', 'building': 'yes'}})
+    for i_poi in range(n_buildings // 2):
+        node(47.3 + rnd.uniform(0, step * side), 8.5 + rnd.uniform(0, step * side),
+             {'amenity': str(rnd.choice(['cafe', 'bank', 'place_of_worship']))})
+    return {'version': 0.6, 'generator': 'synthetic', 'elements': elements}
+
+
+class StubOverpassHandler(http.server.BaseHTTPRequestHandler):
+    """Replies to every query with the response of the server"""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Reply with the stored response"""
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.server.response)))
+        self.end_headers()
+        self.wfile.write(self.server.response)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Silence the request log"""
+
+
+def assembled_equal(gdf, gdf_ref):
+    """Whether ids, tags and geometries of the assembled GeoDataFrames are identical"""
+    return (gdf.shape == gdf_ref.shape
+            and gdf.osm_id.tolist() == gdf_ref.osm_id.tolist()
+            and gdf.tags.tolist() == gdf_ref.tags.tolist()
+            and gdf.geometry.to_wkb().tolist() == gdf_ref.geometry.to_wkb().tolist())
+
+
+def run(response, server, label):
+    """Print download and assembly times of one response"""
+    server.response = json.dumps(response).encode()
+    query = OSMApiQuery((47.3, 8.5, 47.4, 8.6), '["building"]')
+    api = overpy.Overpass(url=f"http://127.0.0.1:{server.server_address[1]}/api/interpreter")
+    start = time.perf_counter()
+    result = api.query(query._overpass_query_string())
+    t_download = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gdf_ref = FormerOSMApiQuery(query.area, query.condition)._assemble_results(result)
+    t_ref = time.perf_counter() - start
+    start = time.perf_counter()
+    gdf = query._assemble_results(result)
+    t_new = time.perf_counter() - start
+
+    print(f"{label:<16} {len(response['elements']):>9} {len(gdf):>6} {t_download:>13.2f} "
+          f"{t_ref:>12.2f} {t_new:>11.2f} {t_ref / t_new:>9.1f} "
+          f"{str(assembled_equal(gdf, gdf_ref)):>10}")
+
+
+def main():
+    """Print download and assembly times of the former and the new implementation"""
+    LOGGER.setLevel('WARNING')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubOverpassHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"{'response':<16} {'elements':>9} {'rows':>6} {'download [s]':>13} "
+          f"{'former [s]':>12} {'new [s]':>11} {'speed-up':>9} {'identical':>10}")
+    try:
+        if len(sys.argv) > 1:
+            with open(sys.argv[1], encoding='utf-8') as file:
+                run(json.load(file), server, 'recorded')
+        else:
+            rnd = np.random.default_rng(0)
+            for n_buildings in N_BUILDINGS:
+                run(synthetic_response(n_buildings, rnd), server, f"{n_buildings} buildings")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
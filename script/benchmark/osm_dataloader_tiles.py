@@ -0,0 +1,155 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark tiled, concurrent and cached queries of OSMApiQuery.get_data_overpass.
+
+A local stand-in for the Overpass API replies to bounding box queries with the elements of a
+synthetic city-like response (see osm_dataloader_assembly.py) that have a node in the bounding
+box, and the ways and nodes they consist of, after a fixed delay per request. The whole area is
+queried at once, in tiles one after the other, in tiles with concurrent requests, and again from
+the cache of the responses. The GeoDataFrames of the tiled queries are checked to be identical
+to the one of the single query.
+
+Usage: python script/benchmark/osm_dataloader_tiles.py [delay in seconds]
+"""
+
+import http.server
+import json
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from climada_petals.entity.exposures.osm_dataloader import LOGGER, OSMApiQuery
+from osm_dataloader_assembly import assembled_equal, synthetic_response
+
+N_BUILDINGS = 4000
+TILE_SIZE = 0.01
+""" tile size in degrees, the synthetic city extends over about 0.12 x 0.07 degrees """
+MAX_WORKERS = [1, 4, 8]
+DELAY = 0.5
+""" default delay of the stand-in server per request in seconds """
+
+
+class StubOverpassHandler(http.server.BaseHTTPRequestHandler):
+    """Replies to bounding box queries with the elements of the response of the server in
+    the bounding box"""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Reply with the elements in the bounding box of the query, after the delay"""
+        query = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        bbox = [float(val) for val in re.search(r'\]\(([^)]*)\)', query).group(1).split(',')]
+        response = json.dumps(self.server.elements_in_bbox(bbox)).encode()
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.n_requests += 1
+            self.server.n_elements += len(json.loads(response)['elements'])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Silence the request log"""
+
+
+class StubOverpassServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for the Overpass API, ignoring the conditions of the queries"""
+
+    def __init__(self, response, delay):
+        super().__init__(('127.0.0.1', 0), StubOverpassHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.n_requests = self.n_elements = 0
+        self.elements = {(elem['type'], elem['id']): elem for elem in response['elements']}
+        nodes = [elem for elem in response['elements'] if elem['type'] == 'node']
+        self.node_ids = np.array([node['id'] for node in nodes])
+        self.node_lat_lon = np.array([(node['lat'], node['lon']) for node in nodes])
+
+    @property
+    def url(self):
+        """URL of the stand-in server"""
+        return f"http://127.0.0.1:{self.server_address[1]}/api/interpreter"
+
+    def elements_in_bbox(self, bbox):
+        """Elements with a node in the bbox (s, w, n, e), and the ways and nodes they consist
+        of, sorted by type and id as by the Overpass API"""
+        lat, lon = self.node_lat_lon.T
+        nodes = set(self.node_ids[(bbox[0] <= lat) & (lat <= bbox[2])
+                                  & (bbox[1] <= lon) & (lon <= bbox[3])].tolist())
+        ways = {ident for (kind, ident), elem in self.elements.items()
+                if kind == 'way' and not nodes.isdisjoint(elem['nodes'])}
+        rels = {ident for (kind, ident), elem in self.elements.items() if kind == 'relation'
+                and not ways.isdisjoint(member['ref'] for member in elem['members'])}
+        for rel in rels:
+            ways.update(member['ref'] for member in self.elements['relation', rel]['members'])
+        for way in ways:
+            nodes.update(self.elements['way', way]['nodes'])
+        return {'version': 0.6, 'generator': 'stand-in', 'elements': (
+            [self.elements['node', ident] for ident in sorted(nodes)]
+            + [self.elements['way', ident] for ident in sorted(ways)]
+            + [self.elements['relation', ident] for ident in sorted(rels)])}
+
+
+def main():
+    """Print run times of single, tiled, concurrent and cached queries"""
+    LOGGER.setLevel('WARNING')
+    delay = float(sys.argv[1]) if len(sys.argv) > 1 else DELAY
+    response = synthetic_response(N_BUILDINGS, np.random.default_rng(0))
+    server = StubOverpassServer(response, delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    lats = [elem['lat'] for elem in response['elements'] if elem['type'] == 'node']
+    lons = [elem['lon'] for elem in response['elements'] if elem['type'] == 'node']
+    query = OSMApiQuery((min(lats), min(lons), max(lats), max(lons)), '["building"]')
+    print(f"{len(response['elements'])} elements, {len(query._tiles(TILE_SIZE))} tiles, "
+          f"{delay} s delay per request\n")
+
+    print(f"{'query':<22} {'requests':>9} {'elements':>9} {'rows':>6} {'time [s]':>9} "
+          f"{'identical':>10}")
+
+    def run(label, **kwargs):
+        n_requests, n_elements = server.n_requests, server.n_elements
+        start = time.perf_counter()
+        gdf = query.get_data_overpass(url=server.url, **kwargs)
+        elapsed = time.perf_counter() - start
+        identical = '' if gdf_ref is None else str(assembled_equal(gdf, gdf_ref))
+        print(f"{label:<22} {server.n_requests - n_requests:>9} "
+              f"{server.n_elements - n_elements:>9} {len(gdf):>6} {elapsed:>9.2f} "
+              f"{identical:>10}")
+        return gdf
+
+    try:
+        gdf_ref = None
+        gdf_ref = run('single query', tile_size=None)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for max_workers in MAX_WORKERS:
+                run(f"tiles, {max_workers} workers", tile_size=TILE_SIZE,
+                    max_workers=max_workers, cache_dir=cache_dir if max_workers == 1 else None)
+            run('tiles, cached', tile_size=TILE_SIZE, cache_dir=cache_dir)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the saturation specific humidity solver of the TCR rain model.
+
+The fused Newton-Raphson kernel behind tc_rainfield._qs_from_t_diff_level is
+compared to the former implementation on full arrays, for realistic ranges of
+600 hPa temperatures and maximum wind speeds, different pressure levels and
+array sizes (the function is called once per track with one value per track
+position). The largest relative deviation between both is reported as well.
+
+Usage: python script/benchmark/tc_rain_humidity.py
+"""
+
+import time
+
+import numpy as np
+
+from climada_petals.hazard.tc_rainfield import (
+    DELTA_T_TROPOPAUSE,
+    GRADIENT_LEVEL_TO_SURFACE_WINDS,
+    L_EVAP_WATER,
+    R_DRY_AIR,
+    T_ICE_K,
+    _qs_from_t_diff_level,
+    _r_from_t_same_level,
+)
+
+SIZES = [50, 500, 5000, 50000]
+PRESSURE_LEVELS = [(600, 950), (500, 900), (700, 1000)]
+TEMPS_RANGE = (255, 285)
+""" temperatures (in K) at the input pressure level """
+VMAX_RANGE = (10, 80)
+""" maximum surface wind speeds (in m/s) """
+MIN_TIME = 0.2
+""" repeat each measurement for at least this many seconds """
+
+
+def qs_from_t_diff_level_arrays(temps_in, vmax, pres_in, pres_out, cap_heat_air=1005.0,
+                                max_iter=5):
+    """Former implementation: Newton-Raphson iteration on full (masked) arrays"""
+    c_vmax = GRADIENT_LEVEL_TO_SURFACE_WINDS**-2
+    r_in, _ = _r_from_t_same_level(pres_in, np.fmax(T_ICE_K - 50, temps_in))
+    r_out = np.zeros_like(r_in)
+    temps_out = temps_in.copy() + 20
+    mask = (temps_in > 100)
+    s_in = (
+        cap_heat_air * np.log(temps_in[mask])
+        + L_EVAP_WATER * r_in[mask] / temps_in[mask]
+        - R_DRY_AIR * np.log(pres_in)
+        + c_vmax * vmax[mask]**2 / DELTA_T_TROPOPAUSE
+    )
+    for _ in range(max_iter):
+        r_out[mask], drdT = _r_from_t_same_level(pres_out, temps_out[mask], gradient=True)
+        s_out = (
+            cap_heat_air * np.log(temps_out[mask])
+            + L_EVAP_WATER * r_out[mask] / temps_out[mask]
+            - R_DRY_AIR * np.log(pres_out)
+        )
+        dsdT = (
+            cap_heat_air * temps_out[mask]
+            + L_EVAP_WATER * (drdT * temps_out[mask] - r_out[mask])
+        ) / temps_out[mask]**2
+        temps_out[mask] -= (s_out - s_in) / dsdT
+    return r_out / (1 + r_out)
+
+
+def time_call(func, *args):
+    """Mean run time of func(*args), repeated for at least MIN_TIME seconds"""
+    n_calls = 0
+    start = time.perf_counter()
+    while True:
+        result = func(*args)
+        n_calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            return result, elapsed / n_calls
+
+
+def main():
+    """Print run times per call and deviations for all sizes and pressure levels"""
+    rnd = np.random.RandomState(0)
+    # compile
+    _qs_from_t_diff_level(np.full(2, 270.0), np.full(2, 30.0), 600, 950)
+
+    print(f"{'size':>6} {'p_in':>5} {'p_out':>5} {'arrays [ms]':>12} {'fused [ms]':>11} "
+          f"{'speed-up':>9} {'max rel diff':>13}")
+    for size in SIZES:
+        temps_in = rnd.uniform(*TEMPS_RANGE, size=size)
+        vmax = rnd.uniform(*VMAX_RANGE, size=size)
+        for pres_in, pres_out in PRESSURE_LEVELS:
+            q_ref, t_ref = time_call(
+                qs_from_t_diff_level_arrays, temps_in, vmax, pres_in, pres_out)
+            q_out, t_fused = time_call(
+                _qs_from_t_diff_level, temps_in, vmax, pres_in, pres_out)
+            max_rel_diff = np.max(np.abs(q_out - q_ref) / q_ref)
+            print(f"{size:>6} {pres_in:>5} {pres_out:>5} {1e3 * t_ref:>12.4f} "
+                  f"{1e3 * t_fused:>11.4f} {t_ref / t_fused:>9.1f} {max_rel_diff:>13.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+This file is part of CLIMADA.
+
+Copyright (C) 2017 ETH Zurich, CLIMADA contributors listed in AUTHORS.
+
+CLIMADA is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free
+Software Foundation, version 3.
+
+CLIMADA is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with CLIMADA. If not, see <https://www.gnu.org/licenses/>.
+
+---
+
+Benchmark the propagation of probabilistic wild fires.
+
+The active front engine of WildFire._run_one_fire is compared to the former
+implementation, which scanned the whole grid for burning centroids in every
+iteration, for growing grid sizes and WildFire.ProbaParams.max_it_propa.
+
+Usage: python script/benchmark/wildfire_propagation.py
+"""
+
+import time
+
+import numpy as np
+
+from climada_petals.hazard.wildfire import WildFire, _propagate_fire
+
+GRID_SIZES = [100, 200, 400, 800]
+MAX_IT_PROPA = [1000, 10000, 100000]
+MAX_REF_CELL_IT = 2e9
+""" skip the reference implementation above this number of cell iterations """
+N_SEEDS = 3
+
+HOOD = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def propagate_fire_grid_scan(fire_propa_matrix, on_land, prop_proba,
+                             max_it_propa, centr_ix, centr_iy):
+    """Former implementation: argwhere over the grid in every iteration"""
+    shape = fire_propa_matrix.shape
+    centr_burned = np.zeros(shape, int)
+    centr_burned[centr_ix, centr_iy] = 1
+    count_it = 0
+    while np.any(centr_burned == 1) and count_it < max_it_propa:
+        count_it += 1
+        burned = np.argwhere(centr_burned == 1)
+        if len(burned) > 1:
+            centr_ix, centr_iy = burned[np.random.randint(0, len(burned))]
+        else:
+            centr_ix, centr_iy = burned[0]
+        if 1 <= centr_ix < shape[0]-1 and 1 <= centr_iy < shape[1]-1 and \
+        on_land[centr_ix*shape[1] + centr_iy]:
+            prob_array = np.random.random(500)
+            burned_one_step = np.zeros(shape, int)
+            burned_one_step[centr_ix, centr_iy] = 1
+            for i_neig, (delta_x, delta_y) in enumerate(HOOD):
+                if prob_array[i_neig] <= prop_proba * \
+                    fire_propa_matrix[centr_ix+delta_x, centr_iy+delta_y] and \
+                centr_burned[centr_ix+delta_x, centr_iy+delta_y] == 0:
+                    burned_one_step[centr_ix+delta_x, centr_iy+delta_y] = 1
+            centr_burned += burned_one_step
+    return centr_burned
+
+
+def propagate_fire_front(fire_propa_matrix, on_land, prop_proba,
+                         max_it_propa, centr_ix, centr_iy):
+    """Active front engine, as called in WildFire._run_one_fire"""
+    rnd_state = np.random.get_state()
+    mt_state = np.append(rnd_state[1].astype(np.int64), rnd_state[2])
+    centr_burned = np.zeros(fire_propa_matrix.shape, int)
+    _propagate_fire(centr_burned, fire_propa_matrix, on_land, prop_proba,
+                    max_it_propa, centr_ix*fire_propa_matrix.shape[1] + centr_iy,
+                    mt_state)
+    np.random.set_state((rnd_state[0], mt_state[:-1].astype(np.uint32),
+                         int(mt_state[-1]), rnd_state[3], rnd_state[4]))
+    return centr_burned
+
+
+def time_fires(propagate, fire_propa_matrix, on_land, prop_proba, max_it_propa):
+    """Run N_SEEDS fires from the grid center, return footprints and mean time"""
+    centr = fire_propa_matrix.shape[0] // 2
+    footprints = []
+    start = time.perf_counter()
+    for seed in range(N_SEEDS):
+        np.random.seed(seed)
+        footprints.append(propagate(fire_propa_matrix, on_land, prop_proba,
+                                    max_it_propa, centr, centr))
+    return footprints, (time.perf_counter() - start) / N_SEEDS
+
+
+def main():
+    """Print mean run time per fire for all grid sizes and iteration limits"""
+    prop_proba = WildFire.ProbaParams.prop_proba * 4
+    rnd = np.random.RandomState(0)
+    # compile
+    time_fires(propagate_fire_front, np.ones((10, 10)), np.ones(100, bool), 0.5, 10)
+
+    print(f"{'grid':>10} {'max_it':>8} {'burned':>8} {'grid scan [s]':>14} "
+          f"{'front [s]':>10} {'speed-up':>9} {'identical':>9}")
+    for size in GRID_SIZES:
+        fire_propa_matrix = rnd.choice([0.25, 0.5, 1.], size=(size, size))
+        on_land = np.ones(size * size, bool)
+        for max_it_propa in MAX_IT_PROPA:
+            front, t_front = time_fires(propagate_fire_front, fire_propa_matrix,
+                                        on_land, prop_proba, max_it_propa)
+            n_burned = np.mean([(fire > 0).sum() for fire in front])
+            if size * size * max_it_propa <= MAX_REF_CELL_IT:
+                ref, t_ref = time_fires(propagate_fire_grid_scan, fire_propa_matrix,
+                                        on_land, prop_proba, max_it_propa)
+                identical = all(np.array_equal(f_ref, f_front)
+                                for f_ref, f_front in zip(ref, front))
+                print(f"{size:>5}x{size:<4} {max_it_propa:>8} {n_burned:>8.0f} "
+                      f"{t_ref:>14.4f} {t_front:>10.4f} {t_ref / t_front:>9.1f} "
+                      f"{str(identical):>9}")
+            else:
+                print(f"{size:>5}x{size:<4} {max_it_propa:>8} {n_burned:>8.0f} "
+                      f"{'-':>14} {t_front:>10.4f} {'-':>9} {'-':>9}")
+
+
+if __name__ == "__main__":
+    main()